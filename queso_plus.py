@@ -10,13 +10,45 @@ import sys
 import json
 import threading
 import time
-from collections import defaultdict, Counter
-from urllib.parse import urlparse, urljoin
-import requests
-from flask import Flask, request, render_template_string, jsonify, has_request_context
+_T_ARRANQUE = time.monotonic()  # antes de los imports pesados: lo reporta "serve"
+import queue
+import atexit
+import socket
+import ipaddress
+import gzip
+import hashlib
+import sqlite3
+import shlex
+import csv
+import io
+import base64
+import bisect
+import heapq
+import math
+import zlib
+import signal
+import socketserver
+import struct
+import zipfile
+import tempfile
+import codecs
+import shutil
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from html import unescape as desescapar_html, escape as escapar_html
+from collections import defaultdict, Counter, OrderedDict, deque
+from urllib.parse import urlparse, urljoin, urldefrag, unquote_plus
+from flask import Flask, Response, request, render_template_string, jsonify, has_request_context, send_file, g
 from datetime import datetime, timedelta
 import re
-from werkzeug.serving import make_server
+from werkzeug.serving import BaseWSGIServer, make_server
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # ---------------------------
 # Banner ASCII QUESO
@@ -37,12 +69,21 @@ BANNER = """
 # Configuración y paths
 # ---------------------------
 app = Flask(__name__)
+# endpoints del operador (/eventos, /buscar, /sesiones): solo en el listener
+# admin (ServidorMetricas), nunca en los puertos señuelo
+app_admin = Flask(__name__)
 CLONE_DIR = "sitio_clonado"
 LOG_FILE = "honeypot_carnitas.log"
 CONFIG_FILE = "config_honeypot.json"
 BLOCKED_IPS_FILE = "ips_bloqueadas.json"
+BLOCKED_JOURNAL_FILE = "ips_bloqueadas.journal"
 ASSETS_DIR = os.path.join(CLONE_DIR, "recursos")
 CAPTURED_DATA_FILE = "datos_capturados.log"
+AGGREGATE_FILE = "estado_analisis.json"
+SIGNATURES_FILE = "firmas_ataque.json"
+INDEX_FILE = "honeypot_indice.db"
+SESSIONS_FILE = "honeypot_sesiones.jsonl"
+SESSIONS_STATE_FILE = "estado_sesiones.json"
 
 # Config default
 CONFIG_PREDETERMINADA = {
@@ -55,10 +96,87 @@ CONFIG_PREDETERMINADA = {
     "logging_avanzado": True,
     "puertos_activos": [8080],
     "niveles_profundidad": 3,
-    "crear_subdirectorios": True,
+    "crear_subdirectorios": True,        # árbol virtual de señuelos (directorios)
     "modo_stealth": False,
     "capturar_cookies": True,
-    "simular_vulnerabilidades": True
+    "simular_vulnerabilidades": True,    # señuelos que "filtran" (.env, respaldos, .git)
+    # señuelos virtuales: se generan en memoria al primer pedido
+    "senuelos_directorios": [
+        "admin", "administrator", "wp-admin", "wp-content", "wp-includes", "login", "panel", "cpanel",
+        "phpmyadmin", "pma", "dbadmin", "mysql", "adminer", "backend", "manager", "dashboard", "api",
+        "user", "users", "uploads", "images", "css", "js", "backup", "backups", "old", "dev", "test",
+        "staging", "private", "config", "includes", "webmail", "portal", "jenkins", "vendor",
+    ],
+    "senuelos_archivos_directorio": ["index.html", "login.php", "config.php.bak", ".env"],
+    "senuelos_archivos": [
+        "index.html", "login.html", "login.php", "wp-login.php", "xmlrpc.php", "config.php", "config.php.bak",
+        "wp-config.php.bak", "wp-config.php~", "wp-config.php.old", "robots.txt", "sitemap.xml", ".htaccess",
+        ".env", ".env.local", ".env.production", ".env.bak", ".git/HEAD", ".git/config", ".aws/credentials",
+        "composer.json", "package.json", "administrator/index.php", "user/login", "phpmyadmin/index.php",
+    ],
+    "senuelos_respaldos_nombres": ["backup", "db", "database", "dump", "site", "www", "data", "old"],
+    "senuelos_respaldos_extensiones": [".sql", ".sql.gz", ".zip", ".tar.gz", ".bak"],
+    "senuelos_cache_max": 2048,
+    "senuelos_url_base": "",             # vacío = el Host de la petición
+    # escritor de logs en segundo plano
+    "log_cola_max": 10000,
+    "log_lote_registros": 256,
+    "log_lote_ms": 200,
+    "log_fsync": "nunca",                # nunca | lote | intervalo
+    "log_fsync_intervalo_seg": 5,
+    "log_desbordamiento": "descartar",   # descartar | bloquear
+    "rotacion_max_mb": 64,               # 0 = no rotar
+    "rotacion_compresion": "gzip",       # gzip | binario (.qlog) | ninguna
+    "rotacion_max_segmentos": 0,         # 0 = conservar todos
+    "analisis_checkpoint_seg": 30,
+    "analisis_resumen_seg": 5,           # cada cuánto se recalculan los top de /analysis
+    "estadisticas_aproximadas": False,   # HyperLogLog + Space-Saving: memoria fija
+    "aproximado_top_k": 1000,            # contadores por top (error máx. = total / k)
+    "aproximado_hll_p": 14,              # 2**p registros (error típico 1.04 / sqrt(2**p))
+    # sesiones de atacantes (IP + User-Agent)
+    "sesion_inactividad_seg": 1800,
+    "sesiones_max_abiertas": 10000,      # al pasarse se cierra la menos reciente
+    "sesion_max_pasos": 50,              # pasos guardados por sesión (el resto solo se cuenta)
+    "sesiones_top": 100,                 # cerradas con más eventos que se quedan en memoria
+    # rate limiting
+    "modo_rate_limit": "ventana_deslizante",   # ventana_deslizante | token_bucket
+    "max_ips_rastreadas": 100000,
+    "ip_inactiva_seg": 300,
+    "bloqueo_compactar_cada": 1000,
+    # assets
+    "assets_brotli": True,
+    "assets_max_age": 86400,
+    # clonado
+    "clonado_hilos": 8,
+    "clonado_reintentos": 3,
+    "clonado_timeout": 10,
+    "clonado_max_paginas": 200,
+    # servidor
+    "host_servidor": "0.0.0.0",
+    "hilos_servidor": 32,
+    "timeout_conexion_seg": 10,          # conexión sin mandar nada (o keep-alive ociosa) -> se cierra
+    "trabajadores": 1,                   # >1 = procesos pre-fork con estado compartido
+    "coordinador_socket": "",            # vacío = socket Unix en el directorio temporal
+    "eventos_buffer_max": 1000,          # eventos en cola por espectador en vivo
+    "eventos_max_clientes": 50,
+    "eventos_sondeo_ms": 500,
+    "metricas_puerto": 9464,             # listener admin (/metrics, /eventos, /buscar, /sesiones); 0 = apagado
+    "metricas_host": "127.0.0.1",        # solo admin: no exponer junto al señuelo
+    "metricas_token": "",                # si se pone, pide Authorization: Bearer <token>
+    # tarpit: las IPs bloqueadas o con rate limit se redirigen aquí
+    "tarpit_puerto": 0,                  # 0 = apagado (se contesta 403/429 como siempre)
+    "tarpit_host": "",                   # vacío = host_servidor
+    "tarpit_url": "",                    # URL pública para el redirect (vacío = mismo host del señuelo)
+    "tarpit_modo": "mixto",              # goteo | listado | mixto (listado si la ruta termina en /)
+    "tarpit_intervalo_seg": 1.0,         # cada cuánto sale el siguiente byte/renglón
+    "tarpit_max_conexiones": 20000,
+    "tarpit_max_seg": 0,                 # 0 = hasta que el cliente se rinda
+    # keylogger por lotes
+    "teclas_lote_max": 50,
+    "teclas_intervalo_ms": 3000,
+    "teclas_max_por_peticion": 2000,
+    # cuerpo máximo de una petición (más grande = 413 sin leerlo)
+    "max_peticion_kb": 1024
 }
 
 # ---------------------------
@@ -85,21 +203,202 @@ def guardar_config(config):
     except Exception as e:
         print(f"[!] Error guardando config: {e}")
 
+class ListaBloqueo:
+    """IPs y rangos CIDR (IPv4/IPv6) bloqueados.
+
+    Las IPs sueltas van a un set de strings (camino rápido); los rangos a una
+    tabla hash por longitud de prefijo, así que la búsqueda del prefijo más
+    largo cuesta una consulta por longitud distinta en uso. Los cambios se
+    apuntan en BLOCKED_JOURNAL_FILE a través del escritor de logs y cada
+    ``bloqueo_compactar_cada`` registros se reescribe BLOCKED_IPS_FILE y se
+    vacía el journal.
+    """
+
+    MAX_CACHE = 65536
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = set()
+        self._exactas = set()
+        # ip -> resultado de la búsqueda por prefijo; se vacía en cada cambio
+        self._cache = {}
+        # version -> {longitud_prefijo: set(prefijos como int)}
+        self._tablas = {4: {}, 6: {}}
+        self._longitudes = {4: (), 6: ()}
+        self._pendientes = 0
+
+    @staticmethod
+    def normalizar(valor):
+        valor = valor.strip()
+        try:
+            red = ipaddress.ip_network(valor, strict=False)
+        except ValueError:
+            return valor, None
+        if red.prefixlen == red.max_prefixlen:
+            return str(red.network_address), red
+        return str(red), red
+
+    def _aplicar(self, op, valor):
+        clave, red = self.normalizar(valor)
+        if op == "+":
+            if clave in self._entradas:
+                return False
+            self._entradas.add(clave)
+        else:
+            if clave not in self._entradas:
+                return False
+            self._entradas.discard(clave)
+        self._cache = {}
+        if red is None or red.prefixlen == red.max_prefixlen:
+            if op == "+":
+                self._exactas.add(clave)
+            else:
+                self._exactas.discard(clave)
+        if red is not None and (red.version == 6 or red.prefixlen < 32):
+            # las IPv4 sueltas ya quedan cubiertas por el set de strings
+            tabla = self._tablas[red.version]
+            bits = red.max_prefixlen - red.prefixlen
+            prefijo = int(red.network_address) >> bits
+            if op == "+":
+                tabla.setdefault(red.prefixlen, set()).add(prefijo)
+            else:
+                tabla.get(red.prefixlen, set()).discard(prefijo)
+                if not tabla.get(red.prefixlen, True):
+                    del tabla[red.prefixlen]
+            self._longitudes[red.version] = tuple(sorted(tabla, reverse=True))
+        return True
+
+    def _cambiar(self, op, valor):
+        if op == "+" and self.normalizar(str(valor))[1] is None:
+            return False  # ni IP ni CIDR: no se bloquea ni se apunta en el journal
+        with self._lock:
+            if not self._aplicar(op, valor):
+                return False
+            clave = self.normalizar(valor)[0]
+            # el journal no se descarta aunque la cola esté llena (un bloqueo
+            # perdido vuelve tras reiniciar); se encola con el lock tomado para
+            # que el orden en disco sea el de los cambios
+            log_writer.encolar(BLOCKED_JOURNAL_FILE, {"op": op, "red": clave, "ts": datetime.now().isoformat()},
+                               bloquear=True)
+            self._pendientes += 1
+            if self._pendientes >= int(config.get("bloqueo_compactar_cada", 1000)):
+                self._programar_compactacion()
+        return True
+
+    def add(self, valor):
+        return self._cambiar("+", valor)
+
+    def discard(self, valor):
+        return self._cambiar("-", valor)
+
+    def _prefijo_mas_largo(self, ip):
+        v6 = ":" in ip
+        version = 6 if v6 else 4
+        longitudes = self._longitudes[version]
+        if not longitudes:
+            return None
+        try:
+            n = int.from_bytes(socket.inet_pton(socket.AF_INET6 if v6 else socket.AF_INET, ip), "big")
+        except (OSError, ValueError):
+            return None
+        total = 128 if v6 else 32
+        tabla = self._tablas[version]
+        for plen in longitudes:
+            pref = n >> (total - plen)
+            if pref in tabla.get(plen, ()):
+                return pref, plen, total
+        return None
+
+    def coincidencia(self, ip):
+        """Entrada (IP o rango) más específica que contiene ``ip``, o None."""
+        if ip in self._exactas:
+            return ip
+        hit = self._prefijo_mas_largo(ip)
+        if hit is None:
+            return None
+        pref, plen, total = hit
+        red = ipaddress.ip_network((pref << (total - plen), plen))
+        return str(red.network_address) if plen == total else str(red)
+
+    def __contains__(self, ip):
+        if ip in self._exactas:
+            return True
+        cache = self._cache
+        r = cache.get(ip)
+        if r is None:
+            r = self._prefijo_mas_largo(ip) is not None
+            if len(cache) >= self.MAX_CACHE:
+                cache.clear()
+            cache[ip] = r
+        return r
+
+    def __iter__(self):
+        return iter(list(self._entradas))
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def cargar(self, ruta=None, ruta_journal=None):
+        ruta = ruta or BLOCKED_IPS_FILE
+        ruta_journal = ruta_journal or BLOCKED_JOURNAL_FILE
+        with self._lock:
+            try:
+                with open(ruta, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                invalidas = 0
+                for valor in data if isinstance(data, (list, tuple)) else []:
+                    if self.normalizar(str(valor))[1] is None:
+                        invalidas += 1
+                        continue
+                    self._aplicar("+", str(valor))
+                if invalidas:
+                    print(f"[!] {invalidas} entradas de {ruta} no son IP ni CIDR; se ignoran.")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"[!] Error cargando IPs bloqueadas: {e}")
+            try:
+                with open(ruta_journal, "r", encoding="utf-8") as f:
+                    for linea in f:
+                        try:
+                            rec = json.loads(linea)
+                            if rec["op"] == "+" and self.normalizar(str(rec["red"]))[1] is None:
+                                continue
+                            self._aplicar(rec["op"], rec["red"])
+                            self._pendientes += 1
+                        except Exception:
+                            continue  # registro a medio escribir
+            except FileNotFoundError:
+                pass
+        return self
+
+    def compactar(self):
+        """Snapshot a BLOCKED_IPS_FILE y journal vacío, escritos por el hilo
+        del escritor (no llamar desde ese hilo)."""
+        with self._lock:
+            self._programar_compactacion()
+
+    def _programar_compactacion(self):
+        # con el lock tomado: la snapshot incluye justo lo encolado antes de la
+        # tarea, y lo que se encole después cae en el journal ya vaciado
+        entradas = sorted(self._entradas)
+        self._pendientes = 0
+
+        def volcar():
+            guardar_ips_bloqueadas(entradas)
+            log_writer.soltar(BLOCKED_JOURNAL_FILE)
+            open(BLOCKED_JOURNAL_FILE, "w").close()
+        log_writer.tarea(volcar)
+
 def cargar_ips_bloqueadas():
-    try:
-        with open(BLOCKED_IPS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return set(data) if isinstance(data, (list, tuple)) else set()
-    except FileNotFoundError:
-        return set()
-    except Exception as e:
-        print(f"[!] Error cargando IPs bloqueadas: {e}")
-        return set()
+    return ListaBloqueo().cargar()
 
 def guardar_ips_bloqueadas(ips_bloqueadas):
+    tmp = BLOCKED_IPS_FILE + ".tmp"
     try:
-        with open(BLOCKED_IPS_FILE, "w", encoding="utf-8") as f:
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(list(ips_bloqueadas), f, indent=2, ensure_ascii=False)
+        os.replace(tmp, BLOCKED_IPS_FILE)
     except Exception as e:
         print(f"[!] Error guardando IPs bloqueadas: {e}")
 
@@ -117,16 +416,1091 @@ def inicializar_archivos():
 # ---------------------------
 # Contenedores y globals
 # ---------------------------
-request_counts = defaultdict(list)
-blocked_ips = cargar_ips_bloqueadas()
-config = cargar_config()
+# Al importar no se lee nada de disco: config arranca con los valores por
+# defecto y la lista de bloqueo vacía hasta que inicializar() (menú o
+# subcomandos) lee los archivos.
+blocked_ips = ListaBloqueo()
+config = CONFIG_PREDETERMINADA.copy()
+app.config["MAX_CONTENT_LENGTH"] = config["max_peticion_kb"] * 1024
+_bloqueo_cargado = False
+
+def inicializar(ruta_config=None):
+    """Lee la config (``ruta_config`` o CONFIG_FILE) y la lista de bloqueo,
+    en los mismos objetos (el resto del módulo guarda referencias a ellos).
+    Va antes del primer log: el escritor dimensiona su cola con la config
+    al arrancar."""
+    global CONFIG_FILE, _bloqueo_cargado
+    if ruta_config:
+        CONFIG_FILE = ruta_config
+    nueva = cargar_config()
+    config.clear()
+    config.update(nueva)
+    app.config["MAX_CONTENT_LENGTH"] = int(config.get("max_peticion_kb", 1024)) * 1024
+    if not _bloqueo_cargado:
+        blocked_ips.cargar()
+        _bloqueo_cargado = True
+
+# ---------------------------
+# Métricas (formato Prometheus)
+# ---------------------------
+def _etiquetas_prom(etiquetas):
+    if not etiquetas:
+        return ""
+    partes = []
+    for k, v in etiquetas:
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        partes.append(f'{k}="{v}"')
+    return "{" + ",".join(partes) + "}"
+
+def _num_prom(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Metricas:
+    """Contadores, histogramas de buckets fijos y medidores.
+
+    Para no meter un lock en cada petición, cada hilo anota en su propio
+    shard (threading.local) y solo exponer() suma los shards; los de hilos
+    que ya terminaron se consolidan ahí mismo. Las etiquetas son tuplas de
+    pares (nombre, valor). En modo multiproceso cada trabajador manda sus
+    deltas al maestro (enviar_delta / sumar_lote), que es el que expone.
+    """
+
+    BUCKETS_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._muertos = ({}, {})
+        self._enviado = ({}, {})
+        self._definiciones = OrderedDict()
+        self._medidores = {}
+
+    def tras_fork(self):
+        """En un proceso hijo: descarta lo heredado del padre (y su lock)."""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._muertos = ({}, {})
+        self._enviado = ({}, {})
+
+    def definir(self, nombre, tipo, ayuda, buckets=None):
+        self._definiciones[nombre] = (tipo, ayuda, tuple(buckets) if buckets else None)
+
+    def medidor(self, nombre, ayuda, fn, tipo="gauge"):
+        """``fn()`` se evalúa al exponer: número o lista de (etiquetas, valor)."""
+        self.definir(nombre, tipo, ayuda)
+        self._medidores[nombre] = fn
+
+    def _shard(self):
+        s = getattr(self._local, "s", None)
+        if s is None:
+            s = self._local.s = ({}, {})
+            with self._lock:
+                self._shards.append((threading.current_thread(), s))
+        return s
+
+    def incrementar(self, nombre, etiquetas=(), n=1):
+        c = self._shard()[0]
+        k = (nombre, etiquetas)
+        c[k] = c.get(k, 0) + n
+
+    def observar(self, nombre, valor, etiquetas=()):
+        h = self._shard()[1]
+        k = (nombre, etiquetas)
+        fila = h.get(k)
+        buckets = self._definiciones[nombre][2]
+        if fila is None:
+            fila = h[k] = [0] * (len(buckets) + 3)  # buckets, +Inf, suma, cuenta
+        fila[bisect.bisect_left(buckets, valor)] += 1
+        fila[-2] += valor
+        fila[-1] += 1
+
+    @staticmethod
+    def _sumar(destino, origen):
+        contadores, histogramas = destino
+        for k, v in origen[0].copy().items():
+            contadores[k] = contadores.get(k, 0) + v
+        for k, fila in origen[1].copy().items():
+            acc = histogramas.get(k)
+            if acc is None:
+                histogramas[k] = list(fila)
+            else:
+                for i, v in enumerate(list(fila)):
+                    acc[i] += v
+
+    def _total(self):
+        with self._lock:
+            vivos = []
+            for hilo, s in self._shards:
+                if hilo.is_alive():
+                    vivos.append((hilo, s))
+                else:
+                    self._sumar(self._muertos, s)
+            self._shards = vivos
+            total = ({}, {})
+            self._sumar(total, self._muertos)
+        for _, s in vivos:
+            self._sumar(total, s)
+        return total
+
+    def enviar_delta(self, enviar):
+        """Llama ``enviar(lote)`` con lo contado desde el último envío que
+        salió bien (si hay algo); ``lote`` es JSON serializable."""
+        total = self._total()
+        contadores, histogramas = self._enviado
+        lote = [[], []]
+        for (nombre, etiquetas), v in total[0].items():
+            d = v - contadores.get((nombre, etiquetas), 0)
+            if d:
+                lote[0].append([nombre, etiquetas, d])
+        for (nombre, etiquetas), fila in total[1].items():
+            previa = histogramas.get((nombre, etiquetas))
+            d = fila if previa is None else [a - b for a, b in zip(fila, previa)]
+            if d[-1]:
+                lote[1].append([nombre, etiquetas, d])
+        if lote[0] or lote[1]:
+            enviar(lote)
+        self._enviado = total
+
+    def sumar_lote(self, lote):
+        """Suma un lote de enviar_delta() (de otro proceso) a lo propio."""
+        def clave(nombre, etiquetas):
+            return nombre, tuple(tuple(par) for par in etiquetas)
+        origen = ({clave(n, e): v for n, e, v in lote[0]},
+                  {clave(n, e): fila for n, e, fila in lote[1] if n in self._definiciones})
+        with self._lock:
+            self._sumar(self._muertos, origen)
+
+    def exponer(self):
+        """Texto en formato de exposición de Prometheus (0.0.4)."""
+        total = self._total()
+        por_nombre = defaultdict(list)
+        for (nombre, etiquetas), v in total[0].items():
+            por_nombre[nombre].append((etiquetas, v))
+        for (nombre, etiquetas), fila in total[1].items():
+            por_nombre[nombre].append((etiquetas, fila))
+        for nombre, fn in self._medidores.items():
+            try:
+                v = fn()
+            except Exception:
+                continue
+            por_nombre[nombre].extend(v if isinstance(v, list) else [((), v)])
+        salida = []
+        for nombre, (tipo, ayuda, buckets) in self._definiciones.items():
+            salida.append(f"# HELP {nombre} {ayuda}")
+            salida.append(f"# TYPE {nombre} {tipo}")
+            for etiquetas, v in sorted(por_nombre.get(nombre, []), key=lambda x: x[0]):
+                if tipo != "histogram":
+                    salida.append(f"{nombre}{_etiquetas_prom(etiquetas)} {_num_prom(v)}")
+                    continue
+                acumulado = 0
+                for le, n in zip(buckets + ("+Inf",), v):
+                    acumulado += n
+                    salida.append(f"{nombre}_bucket{_etiquetas_prom(etiquetas + (('le', le),))} {acumulado}")
+                salida.append(f"{nombre}_sum{_etiquetas_prom(etiquetas)} {_num_prom(v[-2])}")
+                salida.append(f"{nombre}_count{_etiquetas_prom(etiquetas)} {v[-1]}")
+        return "\n".join(salida) + "\n"
+
+metricas = Metricas()
+metricas.definir("queso_http_peticiones_total", "counter", "Peticiones atendidas por ruta, método y código.")
+metricas.definir("queso_http_latencia_segundos", "histogram", "Latencia de las peticiones por ruta.",
+                 Metricas.BUCKETS_LATENCIA)
+metricas.definir("queso_peticiones_rechazadas_total", "counter",
+                 "Peticiones cortadas antes de la ruta (motivo=bloqueo|rate_limit).")
+metricas.definir("queso_bloqueos_automaticos_total", "counter", "IPs bloqueadas por exceder el rate limit.")
+metricas.definir("queso_log_escritura_segundos", "histogram", "Duración de cada escritura de lote del escritor de logs.",
+                 Metricas.BUCKETS_LATENCIA)
+metricas.definir("queso_clonado_segundos", "histogram", "Duración de las clonaciones.",
+                 (1, 5, 10, 30, 60, 120, 300, 600, 1800))
+metricas.definir("queso_clonados_total", "counter", "Clonaciones por resultado.")
+metricas.definir("queso_senuelos_servidos_total", "counter", "Peticiones atendidas por el árbol de señuelos.")
+metricas.definir("queso_tarpit_redirigidas_total", "counter", "Peticiones bloqueadas o con rate limit mandadas al tarpit.")
+
+# ---------------------------
+# Formato binario compacto (.qlog)
+# ---------------------------
+# Cada registro va prefijado por su longitud (varint) y un byte de tipo:
+#   1 = cadena del diccionario (se le asigna el siguiente id)
+#   2 = evento: timestamp int64 (µs desde 1970, hora local sin zona), un byte
+#       de banderas (1 = lleva "tags", 2 = µs escritos aunque sean cero),
+#       varints con ids de type/ip/user_agent/referer, nº de tags y sus ids si
+#       los hay, y "data": si es un objeto (bandera 4) el id de su lista de
+#       claves y un id por valor (cada valor ya en JSON); si no, el resto del
+#       cuerpo es su JSON tal cual.
+#   3 = línea cruda (cualquier cosa que no se pueda reproducir byte a byte)
+# El diccionario es propio de cada archivo y se va definiendo en línea, así
+# que se escribe y se lee en una sola pasada.
+QLOG_MAGIC = b"QLOG\x01\n"
+_QLOG_CADENA, _QLOG_EVENTO, _QLOG_CRUDA = 1, 2, 3
+_QLOG_TAGS, _QLOG_US, _QLOG_DATA = 1, 2, 4
+_QLOG_CLAVES = ["timestamp", "type", "ip", "user_agent", "referer", "data"]
+_EPOCA = datetime(1970, 1, 1)
+_US_HORA = 3600 * 10 ** 6
+_json_txt = json.JSONEncoder(ensure_ascii=False).encode  # = json.dumps(x, ensure_ascii=False)
+_VARINT_1 = [bytes((n,)) for n in range(0x80)]
+
+def _varint(n):
+    if n < 0x80:
+        return _VARINT_1[n]
+    salida = bytearray()
+    while n > 0x7F:
+        salida.append((n & 0x7F) | 0x80)
+        n >>= 7
+    salida.append(n)
+    return bytes(salida)
+
+def _leer_varint(buf, pos):
+    n = desplazamiento = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << desplazamiento
+        if b < 0x80:
+            return n, pos
+        desplazamiento += 7
+
+def _ts_a_us(ts):
+    d = datetime.fromisoformat(ts)
+    if d.tzinfo is not None:
+        raise ValueError("timestamp con zona")
+    return (d - _EPOCA) // timedelta(microseconds=1)
+
+def _us_a_ts(us, banderas=0):
+    d = _EPOCA + timedelta(microseconds=us)
+    return d.isoformat(timespec="microseconds") if banderas & _QLOG_US else d.isoformat()
+
+def _linea_evento(ts, tipo, ip, ua, referer, data, tags):
+    """Línea JSON idéntica a la que escribe log_event() (``tipo``… ya en JSON)."""
+    partes = ['{"timestamp": "', ts, '", "type": ', tipo, ', "ip": ', ip, ', "user_agent": ', ua,
+              ', "referer": ', referer, ', "data": ', data]
+    if tags is not None:
+        partes += [', "tags": [', ", ".join(tags), "]"]
+    partes.append("}\n")
+    return "".join(partes).encode("utf-8")
+
+def _cabecera_qlog(cuerpo):
+    """(us, banderas, [ids de type/ip/ua/referer], ids de tags o None, pos de "data")."""
+    us, banderas = struct.unpack_from("!qB", cuerpo)
+    pos, ids = 9, []
+    for _ in range(4):
+        b = cuerpo[pos]
+        if b < 0x80:  # lo normal: ids de un byte
+            ids.append(b)
+            pos += 1
+        else:
+            i, pos = _leer_varint(cuerpo, pos)
+            ids.append(i)
+    tags = None
+    if banderas & _QLOG_TAGS:
+        n, pos = _leer_varint(cuerpo, pos)
+        tags = []
+        for _ in range(n):
+            i, pos = _leer_varint(cuerpo, pos)
+            tags.append(i)
+    return us, banderas, ids, tags, pos
+
+class EscritorQlog:
+    """Convierte líneas de log a .qlog; se usa como un archivo (``write``)."""
+
+    def __init__(self, f):
+        self.f = f
+        self.ids = {}
+        self.citados = {}  # cadena del diccionario -> su forma JSON
+        self.eventos = self.crudas = 0
+        f.write(QLOG_MAGIC)
+
+    def _registro(self, tipo, cuerpo):
+        self.f.write(_varint(len(cuerpo) + 1) + bytes((tipo,)) + cuerpo)
+
+    def _id(self, texto):
+        i = self.ids.get(texto)
+        if i is None:
+            i = self.ids[texto] = len(self.ids)
+            self._registro(_QLOG_CADENA, texto.encode("utf-8"))
+        return i
+
+    def _citado(self, texto):
+        q = self.citados.get(texto)
+        if q is None:
+            q = self.citados[texto] = _json_txt(texto)
+        return q
+
+    def _evento(self, linea):
+        """Cuerpo binario de ``linea`` o None si no se reproduciría exacta."""
+        j = json.loads(linea)
+        tags = j.get("tags")
+        claves = list(j)
+        if claves != _QLOG_CLAVES and claves != _QLOG_CLAVES + ["tags"]:
+            return None
+        campos = [j[k] for k in _QLOG_CLAVES[:5]]
+        if not all(isinstance(c, str) for c in campos):
+            return None
+        if tags is not None and not (isinstance(tags, list) and all(isinstance(t, str) for t in tags)):
+            return None
+        us = _ts_a_us(campos[0])
+        banderas = _QLOG_TAGS if tags is not None else 0
+        ts = _us_a_ts(us)
+        if ts != campos[0]:
+            banderas |= _QLOG_US
+            ts = _us_a_ts(us, banderas)
+        data = j["data"]
+        if isinstance(data, dict):
+            banderas |= _QLOG_DATA
+            esquema = _json_txt(list(data))
+            valores = [_json_txt(v) for v in data.values()]
+            data_txt = "{" + ", ".join(self._citado(k) + ": " + v for k, v in zip(data, valores)) + "}"
+        else:
+            data_txt = _json_txt(data)
+        if _linea_evento(ts, *map(self._citado, campos[1:]), data_txt,
+                         None if tags is None else [self._citado(t) for t in tags]) != linea:
+            return None
+        ids = [self._id(c) for c in campos[1:]]
+        if tags is not None:
+            ids.append(len(tags))
+            ids += [self._id(t) for t in tags]
+        cola = b""
+        if banderas & _QLOG_DATA:
+            ids.append(self._id(esquema))
+            ids += [self._id(v) for v in valores]
+        else:
+            cola = data_txt.encode("utf-8")
+        return struct.pack("!qB", us, banderas) + b"".join(map(_varint, ids)) + cola
+
+    def write(self, linea):
+        try:
+            cuerpo = self._evento(linea)
+        except Exception:
+            cuerpo = None
+        if cuerpo is None:
+            self.crudas += 1
+            self._registro(_QLOG_CRUDA, linea)
+        else:
+            self.eventos += 1
+            self._registro(_QLOG_EVENTO, cuerpo)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class LectorQlog:
+    """Lee un .qlog. Iterarlo devuelve las líneas JSON originales (bytes),
+    como un archivo abierto en "rb"; ``eventos()`` da los campos sin pasar
+    por JSON, que es lo que usa el análisis completo."""
+
+    BLOQUE = 1 << 20
+
+    def __init__(self, ruta):
+        self.f = open(ruta, "rb")
+        if self.f.read(len(QLOG_MAGIC)) != QLOG_MAGIC:
+            self.f.close()
+            raise ValueError(f"{ruta} no es un archivo .qlog")
+        self._saltar = 0
+
+    def _registros(self):
+        buf, pos = b"", 0
+        while True:
+            try:
+                n, ini = _leer_varint(buf, pos)
+                if ini + n <= len(buf):
+                    pos = ini + n
+                    yield buf[ini], buf[ini + 1:pos]
+                    continue
+            except IndexError:
+                pass
+            trozo = self.f.read(self.BLOQUE)
+            if not trozo:
+                return
+            buf, pos = buf[pos:] + trozo, 0
+
+    def eventos(self):
+        """Itera (us, banderas, tipo, ip, ua, referer, tags, data_json) por
+        evento, o (None, linea) por línea cruda."""
+        tabla, esquemas = [], {}
+        for tipo, cuerpo in self._registros():
+            if tipo == _QLOG_CADENA:
+                tabla.append(cuerpo.decode("utf-8"))
+            elif tipo == _QLOG_EVENTO:
+                us, banderas, ids, tags, pos = _cabecera_qlog(cuerpo)
+                if banderas & _QLOG_DATA:
+                    e, pos = _leer_varint(cuerpo, pos)
+                    claves = esquemas.get(e)
+                    if claves is None:
+                        claves = esquemas[e] = [_json_txt(k) + ": " for k in json.loads(tabla[e])]
+                    partes = []
+                    for k in claves:
+                        i, pos = _leer_varint(cuerpo, pos)
+                        partes.append(k + tabla[i])
+                    data = "{" + ", ".join(partes) + "}"
+                else:
+                    data = cuerpo[pos:].decode("utf-8")
+                yield (us, banderas, tabla[ids[0]], tabla[ids[1]], tabla[ids[2]], tabla[ids[3]],
+                       None if tags is None else [tabla[i] for i in tags], data)
+            elif tipo == _QLOG_CRUDA:
+                yield None, cuerpo
+
+    def contar(self, rutas=False):
+        """Recuentos para analyze_logs() sin crear una cadena por evento: se
+        cuenta por id del diccionario y se traduce al final. Devuelve
+        (total, ips, uas, horas, tags, rutas, lineas_crudas); ``rutas`` (el
+        "path" de "data") solo se cuenta si se pide."""
+        tabla, ips, uas, horas, tags, ids_rutas, crudas = [], [], [], [], [], [], []
+        pos_ruta = {}  # id de la lista de claves -> posición de "path" (o None)
+        for tipo, cuerpo in self._registros():
+            if tipo == _QLOG_EVENTO:
+                us, banderas, ids, t, pos = _cabecera_qlog(cuerpo)
+                ips.append(ids[1])
+                uas.append(ids[2])
+                horas.append(us // _US_HORA)
+                if t:
+                    tags.extend(t)
+                if rutas and banderas & _QLOG_DATA:
+                    e, pos = _leer_varint(cuerpo, pos)
+                    if e not in pos_ruta:
+                        claves = json.loads(tabla[e])
+                        pos_ruta[e] = claves.index("path") if "path" in claves else None
+                    if pos_ruta[e] is not None:
+                        for _ in range(pos_ruta[e] + 1):
+                            i, pos = _leer_varint(cuerpo, pos)
+                        ids_rutas.append(i)
+            elif tipo == _QLOG_CADENA:
+                tabla.append(cuerpo.decode("utf-8"))
+            elif tipo == _QLOG_CRUDA:
+                crudas.append(cuerpo)
+        traducir = lambda ids: Counter({tabla[i]: n for i, n in Counter(ids).items()})
+        por_hora = Counter()
+        for h, n in Counter(horas).items():
+            por_hora[h % 24] += n
+        por_ruta = Counter()
+        for i, n in Counter(ids_rutas).items():
+            ruta = json.loads(tabla[i])  # los valores de "data" se guardan en JSON
+            if isinstance(ruta, str) and ruta:
+                por_ruta[ruta] += n
+        return len(ips), traducir(ips), traducir(uas), por_hora, traducir(tags), por_ruta, crudas
+
+    def seek(self, pos):
+        """Solo hacia delante y antes de iterar: salta ``pos`` bytes del JSON."""
+        self._saltar = pos
+
+    def __iter__(self):
+        saltar, citados = self._saltar, {}
+        for ev in self.eventos():
+            if ev[0] is None:
+                linea = ev[1]
+            else:
+                us, banderas, tipo, ip, ua, referer, tags, data = ev
+                js = []
+                for c in (tipo, ip, ua, referer):
+                    q = citados.get(c)
+                    if q is None:
+                        q = citados[c] = _json_txt(c)
+                    js.append(q)
+                linea = _linea_evento(_us_a_ts(us, banderas), *js, data,
+                                      None if tags is None else [_json_txt(t) for t in tags])
+            if saltar > 0:
+                saltar -= len(linea)
+                continue
+            yield linea
+
+    def read(self):
+        return b"".join(self)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def compactar_log(origen, destino):
+    """Convierte un log JSON a .qlog. Devuelve (bytes_origen, bytes_destino, eventos, crudas)."""
+    with open(origen, "rb") as f, EscritorQlog(open(destino + ".tmp", "wb")) as out:
+        for linea in f:
+            out.write(linea)
+    os.replace(destino + ".tmp", destino)
+    return os.path.getsize(origen), os.path.getsize(destino), out.eventos, out.crudas
+
+def main_qlog(args):
+    """``leer ARCHIVO.qlog...`` (a JSON por stdout) o ``compactar LOG DESTINO.qlog``."""
+    if args[:1] == ["leer"] and len(args) > 1:
+        salida = sys.stdout.buffer
+        try:
+            for ruta in args[1:]:
+                with LectorQlog(ruta) as f:
+                    for linea in f:
+                        salida.write(linea)
+            salida.flush()
+        except BrokenPipeError:
+            pass
+        return 0
+    if args[:1] == ["compactar"] and len(args) == 3:
+        antes, despues, eventos, crudas = compactar_log(args[1], args[2])
+        print(f"{args[1]} -> {args[2]}: {antes} -> {despues} bytes "
+              f"(x{antes / max(despues, 1):.1f}), {eventos} eventos, {crudas} líneas crudas")
+        return 0
+    print("Uso: queso_plus.py leer ARCHIVO.qlog... | compactar LOG.json DESTINO.qlog", file=sys.stderr)
+    return 2
+
+# ---------------------------
+# Rotación de logs en segmentos
+# ---------------------------
+def _ts_linea(linea):
+    """Timestamp de una línea de log/captura (JSON o ``ts - ...``)."""
+    linea = linea.strip()
+    if not linea:
+        return None
+    if linea.startswith(b"{" if isinstance(linea, bytes) else "{"):
+        try:
+            ts = json.loads(linea).get("timestamp")
+            return ts if isinstance(ts, str) else None
+        except Exception:
+            return None
+    if isinstance(linea, bytes):
+        linea = linea.decode("utf-8", "replace")
+    ts = linea.split(" - ", 1)[0]
+    return ts if ts[:4].isdigit() else None
+
+def _lineas_atras(f, fin, bloque=1 << 16):
+    """(pos, linea) de ``f`` hacia atrás desde ``fin``, leyendo por bloques.
+    Una última línea sin salto (escritura a medias) se ignora."""
+    pos, buf, primero = fin, b"", True
+    while True:
+        i = buf.rfind(b"\n", 0, len(buf) - 1) if buf else -1
+        if i >= 0:
+            yield pos + i + 1, buf[i + 1:]
+            buf = buf[:i + 1]
+            continue
+        if pos == 0:
+            if buf:
+                yield 0, buf
+            return
+        n = min(bloque, pos)
+        pos -= n
+        f.seek(pos)
+        buf = f.read(n) + buf
+        if primero:
+            corte = buf.rfind(b"\n")
+            buf = buf[:corte + 1] if corte >= 0 else b""
+            primero = corte < 0
+
+class FlujoLog:
+    """Un log como flujo continuo: segmentos rotados + archivo activo.
+
+    Al pasar de ``rotacion_max_mb`` el escritor renombra el archivo activo a
+    ``<ruta>.000001`` y un hilo aparte lo comprime (``.gz``) o lo pasa al
+    formato binario (``.qlog``) y anota en ``<ruta>.manifiesto.json`` su
+    rango de tiempo y número de registros.
+    Los offsets son lógicos (bytes desde el inicio del primer segmento), así
+    que los consumidores incrementales no notan la rotación.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.ruta_manifiesto = ruta + ".manifiesto.json"
+        self._lock = threading.RLock()
+        self._manifiesto = None
+        self._mtime = None
+
+    # -- manifiesto --
+    def _leer_manifiesto(self):
+        with self._lock:
+            try:
+                mtime = os.stat(self.ruta_manifiesto).st_mtime_ns
+            except OSError:
+                mtime = None
+            if self._manifiesto is None or mtime != self._mtime:
+                m = {"version": 1, "id": None, "segmentos": []}
+                if mtime is not None:
+                    try:
+                        with open(self.ruta_manifiesto, "r", encoding="utf-8") as f:
+                            m.update(json.load(f))
+                    except Exception as e:
+                        print(f"[!] Manifiesto de {self.ruta} ilegible: {e}", file=sys.stderr)
+                self._manifiesto, self._mtime = m, mtime
+            return self._manifiesto
+
+    def _guardar_manifiesto(self, m):
+        tmp = self.ruta_manifiesto + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(m, f, indent=1, ensure_ascii=False)
+        os.replace(tmp, self.ruta_manifiesto)
+        self._manifiesto, self._mtime = m, os.stat(self.ruta_manifiesto).st_mtime_ns
+
+    def segmentos(self):
+        return [dict(s) for s in self._leer_manifiesto()["segmentos"]]
+
+    def base(self):
+        """Offset lógico donde empieza el archivo activo."""
+        segs = self._leer_manifiesto()["segmentos"]
+        return segs[-1]["inicio"] + segs[-1]["bytes"] if segs else 0
+
+    def identidad(self):
+        """Cambia solo si el flujo se reemplaza o se borra (no al rotar)."""
+        m = self._leer_manifiesto()
+        if m.get("id") is not None:
+            return m["id"]
+        try:
+            return os.stat(self.ruta).st_ino
+        except OSError:
+            return None
+
+    def tamano(self):
+        with self._lock:
+            try:
+                return self.base() + os.path.getsize(self.ruta)
+            except OSError:
+                return self.base()
+
+    # -- lectura --
+    def _abrir(self, seg):
+        for _ in range(2):
+            try:
+                if seg["archivo"].endswith(".qlog"):
+                    return LectorQlog(seg["archivo"])
+                if seg["comprimido"]:
+                    return gzip.open(seg["archivo"], "rb")
+                return open(seg["archivo"], "rb")
+            except FileNotFoundError:
+                # lo acaban de comprimir: releer el manifiesto
+                actual = [s for s in self.segmentos() if s["n"] == seg["n"]]
+                if not actual:
+                    return None
+                seg = actual[0]
+        return None
+
+    def archivos(self, offset=0, desde=None, hasta=None):
+        """Itera (inicio_logico, archivo_abierto) en orden, desde ``offset``.
+
+        El archivo activo se abre bajo el lock, así que si rota a mitad de
+        lectura se sigue leyendo el mismo (ya segmento) con offsets correctos.
+        """
+        while True:
+            with self._lock:
+                segs, base = self.segmentos(), self.base()
+            for seg in segs:
+                fin = seg["inicio"] + seg["bytes"]
+                if offset >= fin:
+                    continue
+                offset = fin
+                if desde and seg.get("hasta") and seg["hasta"] < desde:
+                    continue
+                if hasta and seg.get("desde") and seg["desde"] > hasta:
+                    continue
+                f = self._abrir(seg)
+                if f is not None:
+                    yield seg["inicio"], f
+            with self._lock:
+                if self.base() != base:
+                    continue  # rotó mientras leíamos: falta el segmento nuevo
+                try:
+                    f = open(self.ruta, "rb")
+                except FileNotFoundError:
+                    return
+            yield base, f
+            return
+
+    def leer_desde(self, offset=0):
+        """Itera (offset_fin, linea_bytes) a partir del offset lógico ``offset``."""
+        for inicio, f in self.archivos(offset):
+            with f:
+                pos = max(offset, inicio)
+                if pos > inicio:
+                    f.seek(pos - inicio)
+                for linea in f:
+                    pos += len(linea)
+                    yield pos, linea
+
+    def leer_hacia_atras(self, offset=None):
+        """Itera (offset_inicio, linea_bytes) de la más nueva a la más vieja,
+        empezando antes del offset lógico ``offset`` (None = el final).
+
+        El archivo activo y los segmentos sin comprimir se leen por bloques
+        desde el final; un segmento .gz o .qlog se lee entero (está acotado
+        por ``rotacion_max_mb``) solo si se llega hasta él.
+        """
+        with self._lock:
+            segs, base = self.segmentos(), self.base()
+            try:
+                activo = open(self.ruta, "rb")
+            except FileNotFoundError:
+                activo = None
+        partes = [(seg["inicio"], seg) for seg in segs] + [(base, None)]
+        try:
+            for inicio, seg in reversed(partes):
+                if offset is not None and offset <= inicio:
+                    continue
+                if seg is None:
+                    if activo is None:
+                        continue
+                    f, tam = activo, os.fstat(activo.fileno()).st_size
+                else:
+                    f, tam = self._abrir(seg), seg["bytes"]
+                    if f is None:
+                        continue
+                    if seg["comprimido"]:
+                        with f:
+                            f = io.BytesIO(f.read())
+                fin = tam if offset is None else min(tam, offset - inicio)
+                with f:
+                    for pos, linea in _lineas_atras(f, fin):
+                        yield inicio + pos, linea
+        finally:
+            if activo is not None:
+                activo.close()
+
+    def lineas(self, desde=None, hasta=None):
+        """Líneas de texto de todo el flujo, de la más vieja a la más nueva.
+
+        Con ``desde``/``hasta`` (ISO) se saltan los segmentos cuyo rango del
+        manifiesto cae fuera de la ventana; las líneas no se filtran una a una.
+        """
+        for _, f in self.archivos(0, desde, hasta):
+            with f:
+                for linea in f:
+                    yield linea.decode("utf-8", "replace")
+
+    # -- escritura (hilo escritor) --
+    def rotar(self):
+        """Cierra el archivo activo como segmento. El llamador ya soltó el descriptor."""
+        with self._lock:
+            try:
+                tam = os.path.getsize(self.ruta)
+            except OSError:
+                return
+            if not tam:
+                return
+            m = self._leer_manifiesto()
+            m = dict(m, segmentos=list(m["segmentos"]))
+            if m.get("id") is None:
+                m["id"] = os.stat(self.ruta).st_ino
+            n = m["segmentos"][-1]["n"] + 1 if m["segmentos"] else 1
+            seg = {"n": n, "archivo": f"{self.ruta}.{n:06d}", "inicio": self.base(), "bytes": tam,
+                   "registros": None, "desde": None, "hasta": None, "comprimido": False}
+            os.rename(self.ruta, seg["archivo"])
+            open(self.ruta, "ab").close()
+            m["segmentos"].append(seg)
+            self._guardar_manifiesto(m)
+        threading.Thread(target=self._cerrar_segmento, args=(n,), name=f"rotacion-{n}", daemon=True).start()
+
+    def _cerrar_segmento(self, n):
+        """Cuenta registros, rango de tiempo y comprime (en segundo plano)."""
+        seg = next((s for s in self.segmentos() if s["n"] == n), None)
+        if seg is None or seg["comprimido"]:
+            return
+        formato = config.get("rotacion_compresion", "gzip")
+        comprimir = formato in ("gzip", "binario")
+        registros, desde, hasta = 0, None, None
+        destino = seg["archivo"] + (".qlog" if formato == "binario" else ".gz")
+        if formato == "binario":
+            salida = lambda: EscritorQlog(open(destino + ".tmp", "wb"))
+        elif comprimir:
+            salida = lambda: gzip.open(destino + ".tmp", "wb", compresslevel=6)
+        else:
+            salida = lambda: open(os.devnull, "wb")
+        try:
+            with open(seg["archivo"], "rb") as f, salida() as out:
+                ultima = b""
+                for linea in f:
+                    if desde is None:
+                        desde = _ts_linea(linea)
+                    registros += 1
+                    ultima = linea
+                    out.write(linea)
+                hasta = _ts_linea(ultima)
+            if comprimir:
+                os.replace(destino + ".tmp", destino)
+        except Exception as e:
+            print(f"[!] Error cerrando segmento {seg['archivo']}: {e}", file=sys.stderr)
+            return
+        with self._lock:
+            m = self._leer_manifiesto()
+            m = dict(m, segmentos=[dict(s) for s in m["segmentos"]])
+            for s in m["segmentos"]:
+                if s["n"] == n:
+                    s.update(registros=registros, desde=desde, hasta=hasta)
+                    if comprimir:
+                        s.update(archivo=destino, comprimido=True, bytes_disco=os.path.getsize(destino))
+            borrar = []
+            maximo = int(config.get("rotacion_max_segmentos", 0))
+            if maximo and len(m["segmentos"]) > maximo:
+                borrar = m["segmentos"][:-maximo]
+                m["segmentos"] = m["segmentos"][-maximo:]
+            self._guardar_manifiesto(m)
+        if comprimir:
+            os.remove(seg["archivo"])
+        for s in borrar:
+            try:
+                os.remove(s["archivo"])
+            except OSError:
+                pass
+
+    def reanudar(self):
+        """Termina compresiones que quedaron a medias (p. ej. por un cierre)."""
+        for seg in self.segmentos():
+            if not seg["comprimido"] and seg["registros"] is None:
+                threading.Thread(target=self._cerrar_segmento, args=(seg["n"],), daemon=True).start()
+
+    def truncar(self):
+        """Borra segmentos y manifiesto y vacía el archivo activo."""
+        with self._lock:
+            for seg in self.segmentos():
+                for ruta in (seg["archivo"], seg["archivo"] + ".tmp"):
+                    try:
+                        os.remove(ruta)
+                    except OSError:
+                        pass
+            try:
+                os.remove(self.ruta_manifiesto)
+            except OSError:
+                pass
+            self._manifiesto = None
+            open(self.ruta, "w").close()
+
+def fin_de_dia(valor):
+    """``hasta`` con solo fecha (YYYY-MM-DD) incluye todo ese día."""
+    return valor + "T23:59:59.999999" if valor and len(valor) == 10 else valor
+
+_flujos = {}
+
+def flujo(ruta):
+    f = _flujos.get(ruta)
+    if f is None:
+        f = _flujos.setdefault(ruta, FlujoLog(ruta))
+    return f
+
+# ---------------------------
+# Escritor de logs en segundo plano (group commit)
+# ---------------------------
+def _formatear_evento(entry):
+    if isinstance(entry, str):
+        return entry if entry.endswith("\n") else entry + "\n"
+    if config.get("logging_avanzado", True):
+        return f"{json.dumps(entry, ensure_ascii=False)}\n"
+    return f"{entry['timestamp']} - {entry['data']} - IP: {entry['ip']}\n"
+
+def _formatear_json(registro):
+    return f"{json.dumps(registro, ensure_ascii=False)}\n"
+
+def _formatear_captura(registro):
+    timestamp, data = registro
+    return f"{timestamp} - {json.dumps(data, ensure_ascii=False)}\n"
+
+class EscritorLogs(threading.Thread):
+    """Un solo hilo escribe todos los logs; los handlers solo encolan.
+
+    Agrupa registros (cada ``log_lote_registros`` o ``log_lote_ms``), hace
+    fsync según ``log_fsync`` y, si la cola se llena, descarta y cuenta o
+    bloquea al productor según ``log_desbordamiento``. También rota LOG_FILE
+    y CAPTURED_DATA_FILE (ver FlujoLog).
+    """
+
+    _PARAR = object()
+    ROTABLES = (LOG_FILE, CAPTURED_DATA_FILE)
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="escritor-logs", daemon=True)
+        self.cola = None  # se crea al arrancar, ya con la config definitiva
+        self.descartados = 0
+        self.escritos = 0
+        self._lock = threading.Lock()
+        self._archivos = {}
+        self._bases = {}
+        self._formateadores = {
+            LOG_FILE: _formatear_evento,
+            CAPTURED_DATA_FILE: _formatear_captura,
+            BLOCKED_JOURNAL_FILE: _formatear_json,
+        }
+        self._ultimo_fsync = time.monotonic()
+        self._arrancado = False
+        self._oyentes = []
+
+    def suscribir(self, fn):
+        """``fn(eventos, inicio, fin)`` se llama desde este hilo tras cada lote
+        escrito en LOG_FILE; ``eventos`` es una lista de (registro, linea_bytes)
+        y ``inicio``/``fin`` son los offsets lógicos del lote (ver FlujoLog)."""
+        self._oyentes.append(fn)
+
+    def _asegurar_arranque(self):
+        if not self._arrancado:
+            with self._lock:
+                if not self._arrancado:
+                    self.cola = queue.Queue(maxsize=int(config.get("log_cola_max", 10000)))
+                    self.start()
+                    self._arrancado = True
+
+    def encolar(self, ruta, registro, bloquear=False):
+        """Encola ``registro`` para ``ruta``. Con ``bloquear`` espera sitio en
+        la cola aunque ``log_desbordamiento`` sea "descartar"."""
+        self._asegurar_arranque()
+        if bloquear or config.get("log_desbordamiento", "descartar") == "bloquear":
+            self.cola.put((ruta, registro))
+            return True
+        try:
+            self.cola.put_nowait((ruta, registro))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.descartados += 1
+            return False
+
+    def vaciar(self, timeout=10):
+        """Espera a que todo lo encolado hasta ahora quede escrito."""
+        if not self._arrancado or not self.is_alive():
+            return True
+        listo = threading.Event()
+        self.cola.put(listo)
+        return listo.wait(timeout)
+
+    def tarea(self, fn):
+        """Ejecuta ``fn()`` en el hilo escritor, después de lo ya encolado."""
+        self._asegurar_arranque()
+        self.cola.put(fn)
+
+    def soltar(self, ruta):
+        """Cierra el descriptor de ``ruta`` y olvida su offset base (solo
+        desde el hilo escritor)."""
+        self._bases.pop(ruta, None)
+        f = self._archivos.pop(ruta, None)
+        if f is not None:
+            f.close()
+
+    def truncar(self, ruta, despues=None, timeout=10):
+        """Vacía ``ruta`` (con sus segmentos) desde el hilo escritor: suelta el
+        descriptor antes de truncar para que el siguiente lote parta del
+        offset 0, y corre ``despues()`` ahí mismo, antes de ese lote."""
+        hecho = threading.Event()
+
+        def tarea():
+            try:
+                self.soltar(ruta)
+                flujo(ruta).truncar()
+                if despues is not None:
+                    despues()
+            finally:
+                hecho.set()
+        self.tarea(tarea)
+        return hecho.wait(timeout)
+
+    def cerrar(self, timeout=10):
+        if not self._arrancado or not self.is_alive():
+            return
+        self.cola.put(self._PARAR)
+        self.join(timeout)
+
+    def _al_arrancar(self):
+        for ruta in self.ROTABLES:
+            flujo(ruta).reanudar()
+
+    def run(self):
+        self._al_arrancar()
+        while True:
+            item = self.cola.get()
+            lote = [item]
+            limite = time.monotonic() + config.get("log_lote_ms", 200) / 1000.0
+            max_lote = int(config.get("log_lote_registros", 256))
+            while len(lote) < max_lote and isinstance(lote[-1], tuple):
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self.cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            self._escribir_lote([i for i in lote if isinstance(i, tuple)])
+            ultimo = lote[-1]
+            if isinstance(ultimo, threading.Event):
+                ultimo.set()
+            elif callable(ultimo):
+                try:
+                    ultimo()
+                except Exception as e:
+                    print(f"[!] Error en tarea del escritor: {e}", file=sys.stderr)
+            elif ultimo is self._PARAR:
+                self._cerrar_archivos()
+                return
+
+    def _archivo(self, ruta):
+        f = self._archivos.get(ruta)
+        if f is None or f.closed:
+            f = open(ruta, "ab")
+            self._archivos[ruta] = f
+            self._bases[ruta] = flujo(ruta).base() if ruta in self.ROTABLES else 0
+        return f
+
+    def _escribir_lote(self, lote):
+        if not lote:
+            return
+        por_ruta = defaultdict(list)
+        for ruta, registro in lote:
+            try:
+                fmt = self._formateadores.get(ruta, _formatear_evento)
+                por_ruta[ruta].append((registro, fmt(registro).encode("utf-8")))
+            except Exception as e:
+                print(f"[!] Error al serializar log: {e}", file=sys.stderr)
+        politica = config.get("log_fsync", "nunca")
+        ahora = time.monotonic()
+        hacer_fsync = politica == "lote" or (
+            politica == "intervalo" and ahora - self._ultimo_fsync >= config.get("log_fsync_intervalo_seg", 5))
+        max_bytes = int(config.get("rotacion_max_mb", 64) * 1024 * 1024)
+        for ruta, eventos in por_ruta.items():
+            try:
+                f = self._archivo(ruta)
+                base = self._bases[ruta]
+                bloque = b"".join(linea for _, linea in eventos)
+                t0 = time.perf_counter()
+                f.write(bloque)
+                f.flush()
+                if hacer_fsync:
+                    os.fsync(f.fileno())
+                metricas.observar("queso_log_escritura_segundos", time.perf_counter() - t0, (("archivo", ruta),))
+                fin = base + f.tell()
+                # calculado después de escribir: si otro proceso añadió líneas
+                # entre lotes, los oyentes ven el hueco y las leen del archivo
+                inicio = fin - len(bloque)
+                self.escritos += len(eventos)
+                if max_bytes and ruta in self.ROTABLES and fin - base >= max_bytes:
+                    self.soltar(ruta)
+                    flujo(ruta).rotar()
+            except Exception as e:
+                print(f"[!] Error al escribir log: {e}", file=sys.stderr)
+                continue
+            if ruta == LOG_FILE:
+                for fn in self._oyentes:
+                    try:
+                        fn(eventos, inicio, fin)
+                    except Exception as e:
+                        print(f"[!] Error en oyente de logs: {e}", file=sys.stderr)
+        if hacer_fsync:
+            self._ultimo_fsync = ahora
+
+    def _cerrar_archivos(self):
+        for f in self._archivos.values():
+            try:
+                f.close()
+            except Exception:
+                pass
+        self._archivos.clear()
+
+log_writer = EscritorLogs()
+atexit.register(log_writer.cerrar)
 
 # ---------------------------
 # Logging mejorado
 # ---------------------------
-def advanced_log_data(data, log_type="INFO"):
+def advanced_log_data(data, log_type="INFO", cliente=None):
+    """``cliente`` = (ip, user_agent, referer) para eventos fuera de una
+    petición de Flask (p. ej. el tarpit)."""
     timestamp = datetime.now().isoformat()
-    if has_request_context():
+    if cliente is not None:
+        ip, user_agent, referer = cliente
+    elif has_request_context():
         try:
             ip = request.headers.get('X-Forwarded-For', request.remote_addr)
             user_agent = request.headers.get('User-Agent', 'Unknown')
@@ -148,14 +1522,14 @@ def advanced_log_data(data, log_type="INFO"):
         "referer": referer,
         "data": data
     }
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            if config.get("logging_avanzado", True):
-                log.write(f"{json.dumps(log_entry, ensure_ascii=False)}\n")
-            else:
-                log.write(f"{timestamp} - {data} - IP: {ip}\n")
-    except Exception as e:
-        print(f"[!] Error al escribir log: {e}", file=sys.stderr)
+    tags = None
+    if has_request_context():
+        tags = g.get("tags")
+        if cliente is None:
+            g.registrado = True  # la petición ya quedó en el log (ver registrar_ataque)
+    if tags:
+        log_entry["tags"] = tags
+    log_writer.encolar(LOG_FILE, log_entry)
 
 # ---------------------------
 # Rate limiting / bloqueo
@@ -163,22 +1537,481 @@ def advanced_log_data(data, log_type="INFO"):
 def is_ip_blocked(ip):
     return ip in blocked_ips
 
+class LimitadorTasa:
+    """Rate limiting por IP con chequeo O(1) y memoria acotada.
+
+    Modos (``modo_rate_limit``):
+      - ventana_deslizante: contador de ventana deslizante de 60 s (ventana
+        actual + anterior ponderada).
+      - token_bucket: cubeta de ``max_peticiones_por_minuto`` fichas que se
+        rellena a max/60 fichas por segundo.
+
+    Cada petición rechazada suma un strike; al llegar a
+    ``umbral_bloqueo_automatico`` la IP debe bloquearse. Las IPs inactivas
+    más de ``ip_inactiva_seg`` se olvidan y nunca se rastrean más de
+    ``max_ips_rastreadas`` (se expulsa la usada hace más tiempo).
+    """
+
+    VENTANA = 60.0
+    PERMITIR, LIMITAR, BLOQUEAR = "permitir", "limitar", "bloquear"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # ip -> [marca_a, valor_a, valor_b, strikes, ultimo_acceso]
+        self._claves = OrderedDict()
+
+    def __len__(self):
+        return len(self._claves)
+
+    def verificar(self, ip, ahora=None):
+        ahora = time.monotonic() if ahora is None else ahora
+        limite = max(1, int(config.get("max_peticiones_por_minuto", 60)))
+        modo = config.get("modo_rate_limit", "ventana_deslizante")
+        with self._lock:
+            st = self._claves.get(ip)
+            if st is None:
+                if modo == "token_bucket":
+                    st = [ahora, float(limite), 0, 0, ahora]
+                else:
+                    st = [ahora - ahora % self.VENTANA, 0, 0, 0, ahora]
+                self._claves[ip] = st
+            else:
+                self._claves.move_to_end(ip)
+            st[4] = ahora
+            if modo == "token_bucket":
+                fichas = min(float(limite), st[1] + (ahora - st[0]) * limite / self.VENTANA)
+                st[0] = ahora
+                permitido = fichas >= 1.0
+                st[1] = fichas - 1.0 if permitido else fichas
+            else:
+                inicio = ahora - ahora % self.VENTANA
+                if inicio != st[0]:
+                    # la ventana actual pasa a ser la anterior (o se descarta si ya es vieja)
+                    st[2] = st[1] if inicio - st[0] == self.VENTANA else 0
+                    st[1] = 0
+                    st[0] = inicio
+                st[1] += 1
+                estimado = st[2] * (1.0 - (ahora - inicio) / self.VENTANA) + st[1]
+                permitido = estimado <= limite
+            if permitido:
+                veredicto = self.PERMITIR
+            else:
+                st[3] += 1
+                umbral = max(1, int(config.get("umbral_bloqueo_automatico", 10)))
+                veredicto = self.BLOQUEAR if st[3] >= umbral else self.LIMITAR
+            self._expulsar(ahora)
+        return veredicto
+
+    def _expulsar(self, ahora, maximo_por_llamada=16):
+        tope = int(config.get("max_ips_rastreadas", 100000))
+        ttl = config.get("ip_inactiva_seg", 300)
+        claves = self._claves
+        for _ in range(maximo_por_llamada):
+            if not claves:
+                return
+            ip, st = next(iter(claves.items()))
+            if len(claves) > tope or ahora - st[4] > ttl:
+                claves.popitem(last=False)
+            else:
+                return
+        while len(claves) > tope:
+            claves.popitem(last=False)
+
+    def olvidar(self, ip):
+        with self._lock:
+            self._claves.pop(ip, None)
+
+limitador = LimitadorTasa()
+
 def rate_limit_check(ip):
-    now = datetime.now()
-    minute_ago = now - timedelta(minutes=1)
-    request_counts[ip] = [t for t in request_counts[ip] if t > minute_ago]
-    request_counts[ip].append(now)
-    if len(request_counts[ip]) > config.get("max_peticiones_por_minuto", 60):
-        blocked_ips.add(ip)
-        guardar_ips_bloqueadas(blocked_ips)
-        return False
-    return True
+    veredicto = limitador.verificar(ip)
+    if veredicto == LimitadorTasa.PERMITIR:
+        return True
+    if veredicto == LimitadorTasa.BLOQUEAR:
+        limitador.olvidar(ip)
+        if blocked_ips.add(ip):
+            metricas.incrementar("queso_bloqueos_automaticos_total")
+            advanced_log_data({"action": "auto_block", "ip": ip}, "BLOCKED")
+        elif ListaBloqueo.normalizar(ip)[1] is None:
+            # X-Forwarded-For inventado: no es una IP que se pueda bloquear
+            advanced_log_data({"action": "auto_block_invalido", "ip": ip}, "BLOCKED")
+    return False
+
+# ---------------------------
+# Firmas de ataque (clasificación al vuelo)
+# ---------------------------
+# Los patrones se compilan con re.IGNORECASE y no deben usar flags globales en
+# línea. "campos" limita dónde se buscan (path, query, form, headers); si no se
+# pone, se buscan en todos. "claves" (opcional) son literales de los que al
+# menos uno aparece en toda coincidencia; si faltan se deducen del patrón.
+FIRMAS_PREDETERMINADAS = {
+    "credential_stuffing": {"max_usuarios": 5, "ventana_seg": 300},
+    "reglas": [
+        {"id": "sqli-union", "categoria": "sqli", "patron": r"\bunion\b[\s\S]{0,40}\bselect\b"},
+        {"id": "sqli-tautologia", "categoria": "sqli", "patron": r"['\"]\s*(?:or|and)\s*['\"]?\w+['\"]?\s*=\s*['\"]?\w+"},
+        {"id": "sqli-comentario", "categoria": "sqli", "patron": r"['\"]\s*(?:--|#|/\*)"},
+        {"id": "sqli-funciones", "categoria": "sqli", "patron": r"\b(?:sleep|benchmark|pg_sleep|load_file|extractvalue|updatexml)\s*\("},
+        {"id": "sqli-apilada", "categoria": "sqli", "patron": r";\s*(?:drop|insert|update|delete|select|exec)\b"},
+        {"id": "sqli-information-schema", "categoria": "sqli", "patron": r"\binformation_schema\b"},
+        {"id": "sqli-waitfor", "categoria": "sqli", "patron": r"\bwaitfor\s+delay\b"},
+        {"id": "xss-script", "categoria": "xss", "patron": r"<\s*script\b"},
+        {"id": "xss-handler", "categoria": "xss", "patron": r"\bon(?:error|load|mouseover|focus|click|toggle)\s*="},
+        {"id": "xss-javascript-uri", "categoria": "xss", "patron": r"javascript\s*:"},
+        {"id": "xss-tags", "categoria": "xss", "patron": r"<\s*(?:iframe|svg|img|body|object|embed)\b[^>]*>"},
+        {"id": "xss-document", "categoria": "xss", "patron": r"\bdocument\.(?:cookie|location|write)\b|\balert\s*\("},
+        {"id": "traversal-puntos", "categoria": "path_traversal", "patron": r"(?:\.\.|%2e%2e|%252e%252e)(?:/|\\|%2f|%5c)"},
+        {"id": "traversal-sensibles", "categoria": "path_traversal", "patron": r"/etc/(?:passwd|shadow|hosts)|boot\.ini|win\.ini|/proc/self/"},
+        {"id": "traversal-wrappers", "categoria": "path_traversal", "patron": r"\b(?:php|file|zip|data|expect)://"},
+        {"id": "cmdi-separadores", "categoria": "command_injection", "patron": r"(?:;|\|\|?|&&|`|\$\()\s*(?:cat|ls|id|whoami|uname|wget|curl|nc|bash|sh|ping|echo)\b"},
+        {"id": "cmdi-shells", "categoria": "command_injection", "patron": r"/bin/(?:ba)?sh\b|\bcmd\.exe\b|\bpowershell\b"},
+        {"id": "cmdi-shellshock", "categoria": "command_injection", "patron": r"\(\)\s*\{\s*:;\s*\}"},
+        {"id": "cmdi-log4shell", "categoria": "command_injection", "patron": r"\$\{jndi:"},
+        {"id": "scanner-ua", "categoria": "scanner", "campos": ["headers"],
+         "claves": ["sqlmap", "nikto", "nmap", "masscan", "zgrab", "gobuster", "dirb", "wpscan", "nuclei", "acunetix",
+                    "nessus", "openvas", "w3af", "hydra", "wfuzz", "ffuf", "feroxbuster", "zmeu", "censys", "shodan"],
+         "patron": r"user-agent:[^\n]*\b(?:sqlmap|nikto|nmap|masscan|zgrab|gobuster|dirbuster|dirb|wpscan|nuclei|acunetix|nessus|openvas|w3af|hydra|wfuzz|ffuf|feroxbuster|zmeu|censys|shodan)\b"},
+        {"id": "scanner-rutas", "categoria": "scanner", "campos": ["path"],
+         "patron": r"/(?:\.git/|\.env|\.svn/|\.ds_store|wp-login\.php|xmlrpc\.php|phpmyadmin|pma/|server-status|actuator|cgi-bin/|\.aws/|backup\.(?:zip|sql|tar))"},
+    ],
+}
+
+try:
+    import re._parser as _sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+
+def _opciones_literales(items):
+    """Conjuntos de literales de los que al menos uno aparece en cualquier
+    coincidencia de la (sub)expresión ya parseada."""
+    opciones, corrida = [], []
+
+    def cerrar():
+        if corrida:
+            opciones.append({"".join(corrida).lower()})
+            corrida.clear()
+
+    repeticiones = {_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT,
+                    getattr(_sre_parse, "POSSESSIVE_REPEAT", None)}
+    for op, av in items:
+        if op is _sre_parse.LITERAL:
+            corrida.append(chr(av))
+            continue
+        cerrar()
+        o = None
+        if op is _sre_parse.SUBPATTERN:
+            o = _mejor_opcion(_opciones_literales(av[-1]))
+        elif op is _sre_parse.BRANCH:
+            alternativas = [_mejor_opcion(_opciones_literales(alt)) for alt in av[1]]
+            if alternativas and all(alternativas):
+                o = set().union(*alternativas)
+        elif op in repeticiones and av[0] >= 1:
+            o = _mejor_opcion(_opciones_literales(av[2]))
+        elif op is getattr(_sre_parse, "ATOMIC_GROUP", None):
+            o = _mejor_opcion(_opciones_literales(av))
+        if o:
+            opciones.append(o)
+    cerrar()
+    return opciones
+
+def _mejor_opcion(opciones):
+    # la más selectiva: la que tiene el literal más corto más largo
+    return max(opciones, key=lambda o: min(len(x) for x in o), default=None)
+
+def claves_firma(patron):
+    """Literales (en minúsculas) que toda coincidencia de ``patron`` contiene
+    al menos uno; None si no se puede garantizar ninguno."""
+    try:
+        return _mejor_opcion(_opciones_literales(_sre_parse.parse(patron, re.I)))
+    except Exception:
+        return None
+
+def regex_trie(palabras):
+    """Regex de una alternancia en forma de trie: en cada posición solo se
+    sigue una rama, así que el costo no crece con el número de palabras."""
+    trie = {}
+    for p in palabras:
+        nodo = trie
+        for ch in p:
+            nodo = nodo.setdefault(ch, {})
+        nodo[""] = {}
+
+    def construir(nodo):
+        alternativas = [re.escape(ch) + construir(sub) for ch, sub in sorted(nodo.items()) if ch]
+        if not alternativas:
+            return ""
+        grupo = alternativas[0] if len(alternativas) == 1 else "(?:" + "|".join(alternativas) + ")"
+        if "" in nodo:
+            return f"(?:{grupo})?"
+        return grupo
+    return construir(trie)
+
+class MotorFirmas:
+    """Clasifica peticiones contra cientos de firmas en microsegundos.
+
+    De cada regla se sacan literales obligatorios (o se usan sus ``claves``
+    si el archivo las trae) y por cada campo se arma un solo prefiltro en
+    forma de trie con todos ellos. Un recorrido del texto en minúsculas da
+    las reglas candidatas y solo esas corren su regex completa. Las reglas
+    sin literal obligatorio se prueban siempre.
+    """
+
+    CAMPOS = ("path", "query", "form", "headers")
+
+    def __init__(self, definicion):
+        self.reglas = []
+        self.regex = []
+        self.siempre = defaultdict(list)
+        self.por_clave = defaultdict(lambda: defaultdict(set))
+        self.prefiltros = {}
+        for regla in definicion.get("reglas", []):
+            try:
+                rx = re.compile(regla["patron"], re.I)
+            except (re.error, KeyError) as e:
+                print(f"[!] Firma inválida {regla.get('id', '?')}: {e}")
+                continue
+            idx = len(self.reglas)
+            self.reglas.append(regla)
+            self.regex.append(rx)
+            claves = regla.get("claves")
+            claves = {c.lower() for c in claves} if claves else claves_firma(regla["patron"])
+            for campo in regla.get("campos") or self.CAMPOS:
+                if claves:
+                    for c in claves:
+                        self.por_clave[campo][c].add(idx)
+                else:
+                    self.siempre[campo].append(idx)
+        for campo, claves in self.por_clave.items():
+            # el prefiltro da la clave más larga en cada posición: le sumamos
+            # las reglas de las claves que son prefijo suyo
+            for c in list(claves):
+                for otra in list(claves):
+                    if otra != c and c.startswith(otra):
+                        claves[c] |= claves[otra]
+            self.prefiltros[campo] = re.compile(f"(?=({regex_trie(claves)}))")
+        cs = definicion.get("credential_stuffing", {})
+        self.cs_max = int(cs.get("max_usuarios", 5))
+        self.cs_ventana = float(cs.get("ventana_seg", 300))
+        self._cs = OrderedDict()      # ip -> [inicio, set(usuarios)]
+        self._cs_lock = threading.Lock()
+
+    def coincidencias(self, superficie):
+        """Índices de las reglas que coinciden en ``superficie`` (campo -> texto)."""
+        hits = set()
+        for campo, texto in superficie.items():
+            if not texto:
+                continue
+            candidatas = set(self.siempre.get(campo, ()))
+            pf = self.prefiltros.get(campo)
+            if pf is not None:
+                por_clave = self.por_clave[campo]
+                for clave in set(pf.findall(texto.lower())):
+                    candidatas |= por_clave[clave]
+            for i in candidatas - hits:
+                if self.regex[i].search(texto):
+                    hits.add(i)
+        return hits
+
+    def clasificar(self, superficie):
+        hits = self.coincidencias(superficie)
+        categorias = sorted({self.reglas[i]["categoria"] for i in hits})
+        return categorias, sorted(self.reglas[i]["id"] for i in hits)
+
+    def credenciales(self, ip, usuario, max_ips=10000):
+        """Apunta un intento de login; True si la IP ya probó más de
+        ``max_usuarios`` usuarios distintos dentro de la ventana."""
+        ahora = time.monotonic()
+        with self._cs_lock:
+            st = self._cs.get(ip)
+            if st is None or ahora - st[0] > self.cs_ventana:
+                st = self._cs[ip] = [ahora, set()]
+            self._cs.move_to_end(ip)
+            if len(st[1]) <= self.cs_max:
+                st[1].add(usuario)
+            while len(self._cs) > max_ips:
+                self._cs.popitem(last=False)
+            return len(st[1]) > self.cs_max
+
+def cargar_firmas():
+    try:
+        with open(SIGNATURES_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        try:
+            with open(SIGNATURES_FILE, "w", encoding="utf-8") as f:
+                json.dump(FIRMAS_PREDETERMINADAS, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print(f"[!] Error guardando firmas: {e}")
+        return FIRMAS_PREDETERMINADAS
+    except Exception as e:
+        print(f"[!] Error cargando firmas, uso las predeterminadas: {e}")
+        return FIRMAS_PREDETERMINADAS
+
+_motor_firmas = None
+
+def motor_firmas():
+    global _motor_firmas
+    if _motor_firmas is None:
+        _motor_firmas = MotorFirmas(cargar_firmas())
+    return _motor_firmas
+
+class _CuerpoConPrefijo:
+    """Stream de la petición con sus primeros bytes ya leídos: los devuelve
+    antes del resto, así la ruta sigue viendo el cuerpo completo."""
+
+    def __init__(self, prefijo, resto):
+        self._prefijo = prefijo
+        self._resto = resto
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            datos, self._prefijo = self._prefijo + self._resto.read(), b""
+            return datos
+        if self._prefijo:
+            datos, self._prefijo = self._prefijo[:n], self._prefijo[n:]
+            return datos
+        return self._resto.read(n)
+
+def superficie_peticion(max_cuerpo=8192):
+    """Texto de la petición actual que revisan las firmas. Del cuerpo solo
+    se leen ``max_cuerpo`` bytes (o caracteres, si es un formulario)."""
+    if request.form:
+        partes, largo = [], 0
+        for k, v in request.form.items(multi=True):
+            partes.append(f"{k}={v}")
+            largo += len(partes[-1]) + 1
+            if largo >= max_cuerpo:
+                break
+        cuerpo = "\n".join(partes)[:max_cuerpo]
+    elif request.content_length is not None and request.content_length <= max_cuerpo:
+        cuerpo = request.get_data(cache=True).decode("utf-8", "replace")
+    else:
+        # cuerpo grande o sin Content-Length: solo el principio, sin cargar el resto
+        prefijo = request.stream.read(max_cuerpo)
+        request.stream = _CuerpoConPrefijo(prefijo, request.stream)
+        cuerpo = prefijo.decode("utf-8", "replace")
+    return {
+        "path": request.path,
+        "query": unquote_plus(request.query_string.decode("latin-1")),
+        "form": cuerpo,
+        "headers": "\n".join(f"{k.lower()}: {v}" for k, v in request.headers.items()),
+    }
+
+def clasificar_peticion():
+    """Etiqueta la petición actual (queda en g.tags para todos sus logs)."""
+    categorias, reglas = motor_firmas().clasificar(superficie_peticion())
+    g.tags = categorias
+    g.firmas = reglas
+    return categorias
 
 # ---------------------------
-# Funciones para crear estructura / generar contenido falso
+# Generar contenido falso
 # ---------------------------
+def script_teclas(pagina_js="location.pathname"):
+    """Keylogger de la trampa: junta teclas en el navegador y las manda por
+    lotes (al llenar el buffer, cada pocos segundos, al salir de un campo y
+    con sendBeacon al cerrar la página) a /log_teclas_lote."""
+    return """<script>
+    (function() {
+        var buf = [], MAX = %d, DESTINO = '/log_teclas_lote', PAGINA = %s;
+        function campo(t) { return (t && (t.name || t.id || t.tagName)) || 'document'; }
+        function enviar(beacon) {
+            if (!buf.length) return;
+            var cuerpo = JSON.stringify({pagina: PAGINA, teclas: buf});
+            buf = [];
+            if (beacon && navigator.sendBeacon &&
+                navigator.sendBeacon(DESTINO, new Blob([cuerpo], {type: 'application/json'}))) return;
+            fetch(DESTINO, {method: 'POST', headers: {'Content-Type': 'application/json'}, body: cuerpo, keepalive: true});
+        }
+        document.addEventListener('keydown', function(e) {
+            buf.push({k: e.key, c: campo(e.target), t: Date.now()});
+            if (buf.length >= MAX) enviar(false);
+        }, true);
+        document.addEventListener('blur', function() { enviar(false); }, true);
+        setInterval(function() { enviar(false); }, %d);
+        window.addEventListener('pagehide', function() { enviar(true); });
+        document.addEventListener('visibilitychange', function() {
+            if (document.visibilityState === 'hidden') enviar(true);
+        });
+    })();
+    </script>""" % (int(config.get("teclas_lote_max", 50)), pagina_js, int(config.get("teclas_intervalo_ms", 3000)))
+
+def _secreto_falso(url_base, nombre, largo=24):
+    """Valor "secreto" estable por sitio: el mismo señuelo siempre filtra lo mismo."""
+    return hashlib.sha256(f"{url_base}|{nombre}".encode()).hexdigest()[:largo]
+
+def _volcado_sql_falso(url_base):
+    host = urlparse(url_base).netloc or "localhost"
+    filas = ",\n".join(f"({i},'{u}','{u}@{host}','$2y$10${_secreto_falso(url_base, u, 53)}')"
+                       for i, u in enumerate(["admin", "soporte", "ventas", "jlopez", "mgarcia"], 1))
+    return f"""-- MySQL dump 10.13  Distrib 8.0.36, for Linux (x86_64)
+-- Host: 127.0.0.1    Database: {host.split(':')[0].replace('.', '_')}_prod
+CREATE TABLE `usuarios` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `usuario` varchar(64) NOT NULL,
+  `email` varchar(128) NOT NULL,
+  `password` varchar(255) NOT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+INSERT INTO `usuarios` VALUES {filas};
+"""
+
+def _fuente_php_falsa(directorio, archivo, url_base):
+    host = urlparse(url_base).netloc.split(":")[0] or "localhost"
+    return f"""<?php
+// {directorio}/{archivo}
+define('DB_NAME', '{host.replace('.', '_')}_prod');
+define('DB_USER', 'webadmin');
+define('DB_PASSWORD', '{_secreto_falso(url_base, 'db', 16)}');
+define('DB_HOST', '127.0.0.1');
+define('AUTH_KEY', '{_secreto_falso(url_base, 'auth', 64)}');
+if ($_POST) {{
+    $data = json_encode($_POST);
+    file_put_contents('{CAPTURED_DATA_FILE}', date('Y-m-d H:i:s') . " - " . $data . "\\n", FILE_APPEND);
+}}
+header('Location: /');
+exit();
+?>"""
+
 def generar_contenido_falso(directorio, archivo, url_base):
-    if archivo.endswith('.html'):
+    """Contenido de un señuelo (str, o bytes para los comprimidos). Las
+    páginas .html/.php son formularios de login con keylogger; lo demás
+    imita archivos que se filtran por error (.env, respaldos, .git...)."""
+    nombre = archivo.lower()
+    host = urlparse(url_base).netloc or "localhost"
+    if nombre.endswith((".bak", ".old", ".orig", ".save", "~")) and ".php" in nombre:
+        return _fuente_php_falsa(directorio, archivo, url_base)
+    if nombre.endswith((".sql.gz", ".tar.gz", ".gz")):
+        return gzip.compress(_volcado_sql_falso(url_base).encode("utf-8"), mtime=0)
+    if nombre.endswith(".zip"):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("dump.sql", _volcado_sql_falso(url_base))
+        return buf.getvalue()
+    if nombre.endswith((".sql", ".bak")):
+        return _volcado_sql_falso(url_base)
+    if nombre.startswith(".env"):
+        return (f"APP_ENV=production\nAPP_DEBUG=false\nAPP_URL={url_base}\n"
+                f"APP_KEY=base64:{base64.b64encode(_secreto_falso(url_base, 'app').encode()).decode()}\n"
+                f"DB_CONNECTION=mysql\nDB_HOST=127.0.0.1\nDB_PORT=3306\nDB_USERNAME=webadmin\n"
+                f"DB_PASSWORD={_secreto_falso(url_base, 'db', 16)}\n"
+                f"AWS_ACCESS_KEY_ID=AKIA{_secreto_falso(url_base, 'aws', 16).upper()}\n"
+                f"AWS_SECRET_ACCESS_KEY={_secreto_falso(url_base, 'aws-secret', 40)}\n")
+    if directorio.endswith(".git"):
+        if nombre == "head":
+            return "ref: refs/heads/main\n"
+        if nombre == "config":
+            return (f"[core]\n\trepositoryformatversion = 0\n\tfilemode = true\n\tbare = false\n"
+                    f'[remote "origin"]\n\turl = https://git.{host}/web/{host}.git\n'
+                    f"\tfetch = +refs/heads/*:refs/remotes/origin/*\n[branch \"main\"]\n\tremote = origin\n")
+    if directorio.endswith(".aws") and nombre == "credentials":
+        return (f"[default]\naws_access_key_id = AKIA{_secreto_falso(url_base, 'aws', 16).upper()}\n"
+                f"aws_secret_access_key = {_secreto_falso(url_base, 'aws-secret', 40)}\n")
+    if nombre.endswith(".json"):
+        return json.dumps({"name": f"{host}/web", "version": "2.4.1", "private": True}, indent=2) + "\n"
+    if nombre == "sitemap.xml":
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+                f"  <url><loc>{url_base}/</loc></url>\n  <url><loc>{url_base}/login.php</loc></url>\n</urlset>\n")
+    if nombre.endswith(('.html', '.php')) or "." not in nombre:
         return f"""<!DOCTYPE html>
 <html lang="es">
 <head>
@@ -204,27 +2037,9 @@ def generar_contenido_falso(directorio, archivo, url_base):
             <button type="submit">Iniciar sesión</button>
         </form>
     </div>
-    <script>
-        document.addEventListener('keydown', function(e) {{
-            fetch('/log_teclas', {{
-                method: 'POST',
-                headers: {{'Content-Type': 'application/json'}},
-                body: JSON.stringify({{ tecla: e.key, pagina: '{directorio}/{archivo}', timestamp: new Date().toISOString() }})
-            }});
-        }});
-    </script>
+    {script_teclas(json.dumps(f"{directorio}/{archivo}"))}
 </body>
 </html>"""
-    elif archivo.endswith('.php'):
-        return f"""<?php
-// Archivo falso {directorio}/{archivo}
-if ($_POST) {{
-    $data = json_encode($_POST);
-    file_put_contents('{CAPTURED_DATA_FILE}', date('Y-m-d H:i:s') . " - " . $data . "\\n", FILE_APPEND);
-}}
-header('Location: /');
-exit();
-?>"""
     elif archivo == 'robots.txt':
         return f"User-agent: *\nDisallow: /admin/\nSitemap: {url_base}/sitemap.xml\n"
     elif archivo == '.htaccess':
@@ -232,234 +2047,2249 @@ exit();
     else:
         return f"# Archivo falso: {directorio}/{archivo}\n"
 
-def crear_estructura_completa(url_base):
-    directorios_comunes = [
-        "admin", "wp-admin", "login", "panel", "phpmyadmin", "cpanel",
-        "uploads", "images", "css", "js", "api", "user", "dashboard"
-    ]
-    archivos_comunes = ["index.html", "login.html", "config.php", "robots.txt", ".htaccess"]
-    for d in directorios_comunes:
-        os.makedirs(os.path.join(CLONE_DIR, d), exist_ok=True)
-        for a in ["index.html", "login.php"]:
-            with open(os.path.join(CLONE_DIR, d, a), "w", encoding="utf-8") as f:
-                f.write(generar_contenido_falso(d, a, url_base))
-    for a in archivos_comunes:
-        with open(os.path.join(CLONE_DIR, a), "w", encoding="utf-8") as f:
-            f.write(generar_contenido_falso("root", a, url_base))
-    advanced_log_data(f"Estructura creada para {url_base}", "SYSTEM")
-
-# ---------------------------
-# Clonar sitio (simple)
-# ---------------------------
-def clone_site(url):
-    try:
+# ---------------------------
+# Señuelos virtuales (en memoria)
+# ---------------------------
+MIME_SENUELOS = {".php": "text/html", ".sql": "application/sql", ".gz": "application/gzip",
+                 ".zip": "application/zip", ".bak": "application/octet-stream"}
+PAGINAS_SENUELO = (".html", ".php")
+
+def es_pagina_senuelo(archivo):
+    """Formularios de login (lo único que se sirve sin ``simular_vulnerabilidades``)."""
+    nombre = archivo.lower()
+    return nombre.endswith(PAGINAS_SENUELO) or "." not in nombre
+
+class ArbolSenuelos:
+    """Árbol virtual de señuelos definido en la config.
+
+    Se arma una vez como trie por segmentos de ruta, así que resolver una
+    petición cuesta O(largo de la ruta) sin tocar disco. El contenido se
+    genera con generar_contenido_falso() al primer pedido y se guarda en una
+    caché LRU de ``senuelos_cache_max`` entradas por (url_base, ruta).
+    """
+
+    def __init__(self, directorios, archivos_directorio, archivos, respaldos=(), solo_paginas=False,
+                 cache_max=2048):
+        self.raiz = {}
+        self.total = 0
+        for d in directorios:
+            for a in list(archivos_directorio) + list(respaldos):
+                self._insertar(f"{d}/{a}", solo_paginas)
+        for a in list(archivos) + list(respaldos):
+            self._insertar(a, solo_paginas)
+        self.cache_max = max(1, int(cache_max))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _insertar(self, ruta, solo_paginas):
+        partes = [p for p in ruta.split("/") if p]
+        if not partes or (solo_paginas and not es_pagina_senuelo(partes[-1])):
+            return
+        nodo = self.raiz
+        for p in partes:
+            nodo = nodo.setdefault(p, {})
+        if None not in nodo:
+            nodo[None] = "/".join(partes)  # la clave None marca un archivo
+            self.total += 1
+
+    def resolver(self, ruta):
+        """Ruta virtual del señuelo para ``ruta`` (un directorio da su
+        index.html o index.php), o None."""
+        nodo = self.raiz
+        for p in ruta.split("/"):
+            if p:
+                nodo = nodo.get(p)
+                if nodo is None:
+                    return None
+        hoja = nodo.get(None)
+        if hoja is None:
+            indice = nodo.get("index.html") or nodo.get("index.php")
+            hoja = indice.get(None) if indice else None
+        return hoja
+
+    def contenido(self, hoja, url_base):
+        """(bytes, mimetype, etag) del señuelo ``hoja``."""
+        clave = (url_base, hoja)
+        with self._lock:
+            res = self._cache.get(clave)
+            if res is not None:
+                self._cache.move_to_end(clave)
+                return res
+        directorio, _, archivo = hoja.rpartition("/")
+        datos = generar_contenido_falso(directorio or "root", archivo, url_base)
+        if isinstance(datos, str):
+            datos = datos.encode("utf-8")
+            mime = MIME_SENUELOS.get(os.path.splitext(archivo)[1].lower()) or tipo_mime(archivo)
+            if mime == "application/octet-stream":
+                mime = "text/plain"
+            mime += "; charset=utf-8"
+        else:
+            mime = MIME_SENUELOS.get(os.path.splitext(archivo)[1].lower(), "application/octet-stream")
+        res = (datos, mime, hashlib.sha1(datos).hexdigest()[:20])
+        with self._lock:
+            self._cache[clave] = res
+            while len(self._cache) > self.cache_max:
+                self._cache.popitem(last=False)
+        return res
+
+_arbol_senuelos = None
+
+def arbol_senuelos():
+    global _arbol_senuelos
+    if _arbol_senuelos is None:
+        respaldos = [n + e for n in config.get("senuelos_respaldos_nombres", [])
+                     for e in config.get("senuelos_respaldos_extensiones", [])]
+        _arbol_senuelos = ArbolSenuelos(
+            config.get("senuelos_directorios", []) if config.get("crear_subdirectorios", True) else [],
+            config.get("senuelos_archivos_directorio", []),
+            config.get("senuelos_archivos", []),
+            respaldos,
+            solo_paginas=not config.get("simular_vulnerabilidades", True),
+            cache_max=config.get("senuelos_cache_max", 2048))
+    return _arbol_senuelos
+
+# ---------------------------
+# Assets: tipos MIME y variantes precomprimidas
+# ---------------------------
+TIPOS_MIME = {
+    ".css": "text/css",
+    ".js": "application/javascript",
+    ".mjs": "application/javascript",
+    ".json": "application/json",
+    ".map": "application/json",
+    ".html": "text/html",
+    ".htm": "text/html",
+    ".txt": "text/plain",
+    ".xml": "application/xml",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+    ".ico": "image/x-icon",
+    ".bmp": "image/bmp",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+    ".ttf": "font/ttf",
+    ".otf": "font/otf",
+    ".eot": "application/vnd.ms-fontobject",
+    ".mp4": "video/mp4",
+    ".webm": "video/webm",
+    ".mp3": "audio/mpeg",
+    ".pdf": "application/pdf",
+    ".wasm": "application/wasm",
+}
+# tipos que vale la pena comprimir (imágenes, woff y video ya vienen comprimidos)
+EXTENSIONES_COMPRIMIBLES = {".css", ".js", ".mjs", ".json", ".map", ".html", ".htm",
+                            ".txt", ".xml", ".svg", ".ttf", ".otf", ".eot", ".ico", ".bmp", ".wasm"}
+# (codificación, sufijo) en orden de preferencia
+VARIANTES_COMPRIMIDAS = (("br", ".br"), ("gzip", ".gz"))
+
+def tipo_mime(nombre):
+    return TIPOS_MIME.get(os.path.splitext(nombre)[1].lower(), "application/octet-stream")
+
+def generar_variantes_comprimidas(ruta):
+    """Deja ``ruta.gz`` (y ``ruta.br`` si hay brotli) junto al asset si
+    realmente ahorran bytes."""
+    if os.path.splitext(ruta)[1].lower() not in EXTENSIONES_COMPRIMIBLES:
+        return
+    with open(ruta, "rb") as f:
+        datos = f.read()
+    if len(datos) < 256:
+        return
+    variantes = [(".gz", lambda d: gzip.compress(d, 9))]
+    if brotli is not None and config.get("assets_brotli", True):
+        variantes.append((".br", lambda d: brotli.compress(d, quality=11)))
+    for sufijo, comprimir in variantes:
+        try:
+            comprimido = comprimir(datos)
+            if len(comprimido) < len(datos) * 0.9:
+                with open(ruta + sufijo, "wb") as f:
+                    f.write(comprimido)
+            elif os.path.exists(ruta + sufijo):
+                os.remove(ruta + sufijo)
+        except Exception as e:
+            print(f"[!] Error comprimiendo {ruta}: {e}")
+
+# ---------------------------
+# Reescritura de HTML/CSS en una pasada (streaming)
+# ---------------------------
+RE_TAG = re.compile(r'<(/?)([A-Za-z][^\s/>]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>')
+RE_ATTR = re.compile(r'([^\s=/>"\']+)(?:(\s*=\s*)("[^"]*"|\'[^\']*\'|[^\s>"\']+))?')
+RE_REL = re.compile(r'\brel\s*=\s*["\']?([^"\'>]*)', re.I)
+# atajo: etiquetas sin ningún atributo que pueda llevar una URL salen tal cual
+RE_ATTR_INTERES = re.compile(r'(?:src|srcset|href|style|poster|background|action)\s*=', re.I)
+RE_CIERRE_RAW = {
+    "script": re.compile(r'</script', re.I),
+    "style": re.compile(r'</style', re.I),
+}
+RE_CSS_URL = re.compile(
+    r'url\(\s*(?:"([^"]*)"|\'([^\']*)\'|([^)\s"\']*))\s*\)'
+    r'|@import\s+(?:"([^"]*)"|\'([^\']*)\')', re.I)
+# rel de <link> que apuntan a un recurso (el resto, p.ej. canonical, son páginas)
+RELS_ASSET = {"stylesheet", "icon", "shortcut", "apple-touch-icon", "preload",
+              "prefetch", "modulepreload", "manifest", "mask-icon"}
+ATRIBUTOS_ASSET = {"src", "data-src", "poster", "background", "data-background"}
+ATRIBUTOS_SRCSET = {"srcset", "data-srcset", "imagesrcset"}
+# un token (etiqueta/comentario) incompleto más grande que esto se pasa tal cual
+MAX_TOKEN = 256 * 1024
+
+def reescribir_css(texto, url_base, resolver_asset):
+    """Cambia ``url(...)`` e ``@import`` por rutas locales en una pasada."""
+    def sub(m):
+        es_import = m.group(4) is not None or m.group(5) is not None
+        valor = next(g for g in m.groups() if g is not None)
+        if not valor or valor.startswith(("data:", "#")):
+            return m.group(0)
+        local = resolver_asset(urljoin(url_base, valor.strip()), ".css" if es_import else "")
+        if local is None:
+            return m.group(0)
+        return f'@import "{local}"' if es_import else f'url("{local}")'
+    return RE_CSS_URL.sub(sub, texto)
+
+class ReescritorCSS:
+    """Versión incremental de reescribir_css: corta en ``}`` o ``;``."""
+
+    def __init__(self, url_base, resolver_asset):
+        self.url_base = url_base
+        self.resolver_asset = resolver_asset
+        self.buf = ""
+
+    def feed(self, texto):
+        self.buf += texto
+        corte = max(self.buf.rfind("}"), self.buf.rfind(";"))
+        if corte < 0:
+            if len(self.buf) < MAX_TOKEN:
+                return ""
+            corte = len(self.buf) - 1
+        listo, self.buf = self.buf[:corte + 1], self.buf[corte + 1:]
+        return reescribir_css(listo, self.url_base, self.resolver_asset)
+
+    def close(self):
+        listo, self.buf = self.buf, ""
+        return reescribir_css(listo, self.url_base, self.resolver_asset)
+
+class ReescritorHTML:
+    """Tokenizador/reescritor de HTML en streaming.
+
+    ``feed(texto)`` devuelve la parte ya reescrita y se queda solo con el
+    token incompleto del final, así que la memoria no depende del tamaño de
+    la página. Todas las referencias a recursos (src, srcset, <link>, style,
+    url() y @import de CSS) pasan por ``resolver_asset(url, extension)`` y
+    los enlaces a páginas (a/area/form/iframe) por ``resolver_enlace(url)``;
+    si devuelven None se deja el valor original. ``inyectar`` se mete antes
+    de ``</body>`` (o al final si no hay).
+    """
+
+    def __init__(self, url_base, resolver_asset, resolver_enlace, inyectar=None):
+        self.base = url_base
+        self.resolver_asset = resolver_asset
+        self.resolver_enlace = resolver_enlace
+        self.inyectar = inyectar
+        self.inyectado = False
+        self.buf = ""
+        self.modo = "texto"      # texto | script | style
+        self._css = None
+
+    def feed(self, texto):
+        self.buf += texto
+        return self._procesar(final=False)
+
+    def close(self):
+        salida = self._procesar(final=True)
+        if self._css is not None:
+            salida += self._css.close()
+            self._css = None
+        if self.inyectar and not self.inyectado:
+            self.inyectado = True
+            salida += self.inyectar
+        return salida
+
+    # -- tokenizador --
+    def _procesar(self, final):
+        buf, out, i, n = self.buf, [], 0, len(self.buf)
+        while i < n:
+            if self.modo != "texto":
+                fin = RE_CIERRE_RAW[self.modo].search(buf, i)
+                corte = fin.start() if fin else (n if final else max(i, n - 9))
+                contenido = buf[i:corte]
+                out.append(self._css.feed(contenido) if self.modo == "style" else contenido)
+                i = corte
+                if fin is None:
+                    break
+                if self.modo == "style":
+                    out.append(self._css.close())
+                    self._css = None
+                self.modo = "texto"
+                continue
+            j = buf.find("<", i)
+            if j < 0:
+                out.append(buf[i:])
+                i = n
+                break
+            out.append(buf[i:j])
+            i = j
+            if buf.startswith("<!--", i):
+                k = buf.find("-->", i + 4)
+                if k < 0:
+                    if final or n - i > MAX_TOKEN:
+                        out.append(buf[i:])
+                        i = n
+                    break
+                out.append(buf[i:k + 3])
+                i = k + 3
+                continue
+            siguiente = buf[i + 1:i + 2]
+            if siguiente in ("!", "?"):
+                k = buf.find(">", i)
+                if k < 0:
+                    if final or n - i > MAX_TOKEN:
+                        out.append(buf[i:])
+                        i = n
+                    break
+                out.append(buf[i:k + 1])
+                i = k + 1
+                continue
+            m = RE_TAG.match(buf, i)
+            if m is None:
+                posible = siguiente == "" or siguiente == "/" or siguiente.isalpha()
+                if posible and not final and n - i <= MAX_TOKEN:
+                    break  # etiqueta partida entre chunks
+                out.append("<")
+                i += 1
+                continue
+            out.append(self._etiqueta(m))
+            i = m.end()
+        self.buf = buf[i:]
+        return "".join(out)
+
+    def _etiqueta(self, m):
+        cierre, nombre, attrs = m.groups()
+        tag = nombre.lower()
+        if cierre:
+            if tag == "body" and self.inyectar and not self.inyectado:
+                self.inyectado = True
+                return self.inyectar + m.group(0)
+            return m.group(0)
+        if tag in RE_CIERRE_RAW and not attrs.rstrip().endswith("/"):
+            self.modo = tag
+            if tag == "style":
+                self._css = ReescritorCSS(self.base, self.resolver_asset)
+        if not RE_ATTR_INTERES.search(attrs):
+            return m.group(0)
+        rel = ""
+        if tag == "link":
+            r = RE_REL.search(attrs)
+            rel = r.group(1).lower() if r else ""
+        nuevos = RE_ATTR.sub(lambda a: self._atributo(tag, rel, a), attrs)
+        return f"<{nombre}{nuevos}>"
+
+    def _atributo(self, tag, rel, a):
+        nombre, igual, valor = a.groups()
+        if valor is None:
+            return a.group(0)
+        attr = nombre.lower()
+        comilla = valor[0] if valor[0] in "\"'" else ""
+        crudo = valor[1:-1] if comilla else valor
+        nuevo = None
+        if attr in ATRIBUTOS_SRCSET:
+            nuevo = self._srcset(crudo)
+        elif attr == "style":
+            nuevo = reescribir_css(desescapar_html(crudo), self.base, self.resolver_asset)
+        elif attr in ATRIBUTOS_ASSET:
+            if tag in ("iframe", "frame"):
+                nuevo = self._enlace(crudo)
+            else:
+                nuevo = self._asset(crudo, ".js" if tag == "script" else "")
+        elif attr == "href":
+            if tag == "base":
+                self.base = urljoin(self.base, desescapar_html(crudo))
+                nuevo = "/"
+            elif tag == "link":
+                if RELS_ASSET.intersection(rel.split()):
+                    nuevo = self._asset(crudo, ".css" if "stylesheet" in rel else "")
+                else:
+                    nuevo = self._enlace(crudo)
+            elif tag in ("a", "area"):
+                nuevo = self._enlace(crudo)
+        elif attr == "action" and tag == "form":
+            nuevo = self._enlace(crudo)
+        if nuevo is None or nuevo == crudo:
+            return a.group(0)
+        comilla = comilla or '"'
+        nuevo = nuevo.replace("&", "&amp;").replace(comilla, "&quot;" if comilla == '"' else "&#39;")
+        return f"{nombre}{igual}{comilla}{nuevo}{comilla}"
+
+    def _absoluta(self, crudo):
+        valor = desescapar_html(crudo).strip()
+        if not valor or valor.startswith(("#", "data:", "javascript:", "mailto:", "tel:", "about:", "blob:")):
+            return None
+        url = urljoin(self.base, valor)
+        return url if urlparse(url).scheme in ("http", "https") else None
+
+    def _asset(self, crudo, extension):
+        url = self._absoluta(crudo)
+        return None if url is None else self.resolver_asset(url, extension)
+
+    def _enlace(self, crudo):
+        url = self._absoluta(crudo)
+        return None if url is None else self.resolver_enlace(url)
+
+    def _srcset(self, crudo):
+        candidatos = []
+        for parte in crudo.split(","):
+            trozos = parte.strip().split(None, 1)
+            if not trozos:
+                continue
+            local = self._asset(trozos[0], "")
+            candidatos.append(" ".join([local or trozos[0]] + trozos[1:]))
+        return ", ".join(candidatos)
+
+# ---------------------------
+# Clonar sitio (crawler concurrente)
+# ---------------------------
+def html_trampa():
+    """Enlaces ocultos y keylogger que se insertan en cada página clonada.
+    Se arma al clonar para que el script lleve la config ya cargada."""
+    return """
+            <div style="display:none;">
+                <a href="/admin">Panel admin</a>
+                <a href="/wp-admin">wp-admin</a>
+            </div>
+            """ + script_teclas() + """
+            """
+
+def ruta_local_pagina(url):
+    """Archivo dentro de CLONE_DIR donde se guarda la página ``url``."""
+    path = urlparse(url).path or "/"
+    if path.endswith("/"):
+        path += "index.html"
+    elif not os.path.splitext(path)[1]:
+        path += "/index.html"
+    return safe_join(os.path.abspath(CLONE_DIR), path.lstrip("/"))
+
+class ClonadorSitio:
+    """Crawler del mismo origen con pool de hilos y sesión HTTP compartida.
+
+    Recorre por niveles hasta ``niveles_profundidad`` (0 = solo la página
+    inicial), descarga páginas y assets en paralelo con ``clonado_hilos``
+    workers, reintenta con backoff y deduplica URLs.
+    """
+
+    def __init__(self, url, profundidad=None, hilos=None, progreso=None):
+        self.url = urldefrag(url)[0]
+        self.origen = urlparse(self.url).netloc
+        self.profundidad = int(config.get("niveles_profundidad", 3) if profundidad is None else profundidad)
+        self.hilos = max(1, int(hilos or config.get("clonado_hilos", 8)))
+        self.timeout = config.get("clonado_timeout", 10)
+        self.max_paginas = int(config.get("clonado_max_paginas", 200))
+        self.progreso = progreso or (lambda hechas, total, url: None)
+        self.trampa = html_trampa() if config.get("trampas_honeypot", True) else None
+        # perezoso: requests (+urllib3) es ~1/3 del tiempo de import y
+        # ``serve`` no lo necesita
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "Mozilla/5.0"
+        reintentos = Retry(total=int(config.get("clonado_reintentos", 3)), backoff_factor=0.5,
+                           status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+        adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=self.hilos, max_retries=reintentos)
+        self.session.mount("http://", adaptador)
+        self.session.mount("https://", adaptador)
+        self._lock = threading.Lock()
+        self.vistas = set()
+        self.assets = {}          # url -> nombre local en /assets/
+        self._nombres = set()
+        self.paginas = []
+        self.errores = 0
+        self._hechas = 0
+        self._total = 0
+
+    def _normalizar(self, url):
+        url = urldefrag(url)[0]
+        p = urlparse(url)
+        return f"{p.scheme}://{p.netloc}{p.path or '/'}"
+
+    def mismo_origen(self, url):
+        p = urlparse(url)
+        return p.scheme in ("http", "https") and p.netloc == self.origen
+
+    def nombre_asset(self, url, extension=""):
+        with self._lock:
+            nombre = self.assets.get(url)
+            if nombre is not None:
+                return nombre, False
+            nombre = os.path.basename(urlparse(url).path) or "recurso"
+            if extension and not os.path.splitext(nombre)[1]:
+                nombre += extension
+            if nombre in self._nombres:
+                nombre = f"{hashlib.sha1(url.encode()).hexdigest()[:10]}-{nombre}"
+            self._nombres.add(nombre)
+            self.assets[url] = nombre
+            self._total += 1
+            return nombre, True
+
+    def _avanzar(self, url):
+        with self._lock:
+            self._hechas += 1
+            hechas, total = self._hechas, self._total
+        self.progreso(hechas, total, url)
+
+    def _resolver_asset(self, nuevos_assets):
+        def resolver(url, extension):
+            url = urldefrag(url)[0]
+            nombre, nuevo = self.nombre_asset(url, extension)
+            if nuevo:
+                nuevos_assets.append(url)
+            return f"/assets/{nombre}"
+        return resolver
+
+    def _resolver_enlace(self, enlaces):
+        def resolver(url):
+            if not self.mismo_origen(url):
+                return None
+            enlaces.append(self._normalizar(url))
+            p = urlparse(url)
+            return f"{p.path or '/'}{'?' + p.query if p.query else ''}"
+        return resolver
+
+    @staticmethod
+    def _decodificador(r):
+        # requests asume ISO-8859-1 si el Content-Type no trae charset
+        cod = r.encoding if "charset" in r.headers.get("Content-Type", "").lower() else "utf-8"
+        try:
+            return codecs.getincrementaldecoder(cod or "utf-8")(errors="replace")
+        except LookupError:
+            return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def _bajar_pagina(self, url):
+        nuevos_assets, enlaces = [], []
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=True) as r:
+                r.raise_for_status()
+                if "html" not in r.headers.get("Content-Type", "text/html"):
+                    return nuevos_assets, enlaces
+                destino = ruta_local_pagina(url)
+                if destino is None:
+                    return nuevos_assets, enlaces
+                reescritor = ReescritorHTML(r.url, self._resolver_asset(nuevos_assets),
+                                            self._resolver_enlace(enlaces), self.trampa)
+                decodificador = self._decodificador(r)
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                with open(destino, "w", encoding="utf-8") as f:
+                    for chunk in r.iter_content(64 * 1024):
+                        f.write(reescritor.feed(decodificador.decode(chunk)))
+                    f.write(reescritor.feed(decodificador.decode(b"", final=True)))
+                    f.write(reescritor.close())
+            if url == self._normalizar(self.url):
+                # la página inicial siempre queda también como index.html
+                indice = os.path.join(os.path.abspath(CLONE_DIR), "index.html")
+                if destino != indice:
+                    shutil.copyfile(destino, indice)
+            with self._lock:
+                self.paginas.append(url)
+        except Exception as e:
+            with self._lock:
+                self.errores += 1
+            advanced_log_data({"action": "clone_page_error", "url": url, "error": str(e)}, "ERROR")
+        finally:
+            self._avanzar(url)
+        return nuevos_assets, enlaces
+
+    def _bajar_asset(self, url):
+        nuevos_assets = []
+        try:
+            ruta = os.path.join(ASSETS_DIR, self.assets[url])
+            with self.session.get(url, timeout=self.timeout, stream=True) as r:
+                r.raise_for_status()
+                es_css = ruta.endswith(".css") or "text/css" in r.headers.get("Content-Type", "")
+                if es_css:
+                    reescritor = ReescritorCSS(r.url, self._resolver_asset(nuevos_assets))
+                    decodificador = self._decodificador(r)
+                    with open(ruta, "w", encoding="utf-8") as f:
+                        for chunk in r.iter_content(64 * 1024):
+                            f.write(reescritor.feed(decodificador.decode(chunk)))
+                        f.write(reescritor.feed(decodificador.decode(b"", final=True)))
+                        f.write(reescritor.close())
+                else:
+                    with open(ruta, "wb") as f:
+                        for chunk in r.iter_content(64 * 1024):
+                            f.write(chunk)
+            generar_variantes_comprimidas(ruta)
+        except Exception as e:
+            with self._lock:
+                self.errores += 1
+            advanced_log_data({"action": "clone_asset_error", "url": url, "error": str(e)}, "ERROR")
+        finally:
+            self._avanzar(url)
+        return nuevos_assets
+
+    def clonar(self):
         os.makedirs(CLONE_DIR, exist_ok=True)
         os.makedirs(ASSETS_DIR, exist_ok=True)
+        inicio = time.monotonic()
+        nivel = [self._normalizar(self.url)]
+        self.vistas.add(nivel[0])
+        self._total = 1
+        with ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="clonador") as pool:
+            futuros_assets = set()
+            for profundidad in range(self.profundidad + 1):
+                siguiente = []
+                futuros = [pool.submit(self._bajar_pagina, u) for u in nivel]
+                for fut in as_completed(futuros):
+                    nuevos_assets, enlaces = fut.result()
+                    futuros_assets.update(pool.submit(self._bajar_asset, a) for a in nuevos_assets)
+                    if profundidad == self.profundidad:
+                        continue
+                    for enlace in enlaces:
+                        with self._lock:
+                            if enlace in self.vistas or len(self.vistas) >= self.max_paginas:
+                                continue
+                            self.vistas.add(enlace)
+                            self._total += 1
+                        siguiente.append(enlace)
+                if not siguiente:
+                    break
+                nivel = siguiente
+            # los CSS pueden traer más recursos (fuentes, imágenes, @import)
+            while futuros_assets:
+                hechos, futuros_assets = wait(futuros_assets, return_when=FIRST_COMPLETED)
+                for fut in hechos:
+                    futuros_assets.update(pool.submit(self._bajar_asset, a) for a in fut.result())
+        self.session.close()
+        return time.monotonic() - inicio
+
+def clone_site(url, progreso=None):
+    try:
         advanced_log_data({"action": "clone_start", "url": url}, "SYSTEM")
         print(f"[+] Orale, clonando {url} ...")
-        r = requests.get(url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
-        html = r.text
-        base_url = f"{urlparse(url).scheme}://{urlparse(url).netloc}"
+        clonador = ClonadorSitio(url, progreso=progreso)
+        segundos = clonador.clonar()
+        metricas.observar("queso_clonado_segundos", segundos)
+        if not clonador.paginas:
+            raise RuntimeError("no se pudo bajar ninguna página")
+        advanced_log_data({"action": "clone_done", "url": url, "paginas": len(clonador.paginas),
+                           "assets": len(clonador.assets), "errores": clonador.errores,
+                           "segundos": round(segundos, 3)}, "SYSTEM")
+        metricas.incrementar("queso_clonados_total", (("resultado", "ok"),))
+        print(f"[+] Clonación completada en {CLONE_DIR}/ ({len(clonador.paginas)} páginas, "
+              f"{len(clonador.assets)} assets, {clonador.errores} errores) en {segundos:.2f}s")
+        return True
+    except Exception as e:
+        advanced_log_data({"action": "clone_error", "error": str(e)}, "ERROR")
+        metricas.incrementar("queso_clonados_total", (("resultado", "error"),))
+        print(f"[!] Error clonando sitio: {e}")
+        return False
+
+# ---------------------------
+# Endpoints básicos del honeypot
+# ---------------------------
+@app.before_request
+def inicio_metricas():
+    # registrado antes que antes_de_request para medir también los 403/429
+    g.t0_metricas = time.perf_counter()
+
+@app.after_request
+def fin_metricas(resp):
+    ruta = (("ruta", request.url_rule.rule if request.url_rule else "sin_ruta"),)
+    metricas.incrementar("queso_http_peticiones_total",
+                         ruta + (("metodo", request.method), ("estado", str(resp.status_code))))
+    t0 = g.get("t0_metricas")
+    if t0 is not None:
+        metricas.observar("queso_http_latencia_segundos", time.perf_counter() - t0, ruta)
+    return resp
+
+def redirigir_tarpit():
+    """302 al tarpit conservando la ruta pedida, o None si está apagado."""
+    puerto = int(config.get("tarpit_puerto", 0) or 0)
+    if not puerto:
+        return None
+    base = config.get("tarpit_url")
+    if not base:
+        host = urlparse("//" + request.host).hostname or "127.0.0.1"
+        base = f"http://{f'[{host}]' if ':' in host else host}:{puerto}"
+    destino = base.rstrip("/") + request.path
+    if request.query_string:
+        destino += "?" + request.query_string.decode("latin-1")
+    metricas.incrementar("queso_tarpit_redirigidas_total")
+    return Response(status=302, headers={"Location": destino})
+
+@app.before_request
+def antes_de_request():
+    ip = request.headers.get('X-Forwarded-For', request.remote_addr)
+    if is_ip_blocked(ip):
+        metricas.incrementar("queso_peticiones_rechazadas_total", (("motivo", "bloqueo"),))
+        advanced_log_data(f"Acceso bloqueado: {ip}", "BLOCKED")
+        return redirigir_tarpit() or ("Acceso denegado", 403)
+    if not rate_limit_check(ip):
+        metricas.incrementar("queso_peticiones_rechazadas_total", (("motivo", "rate_limit"),))
+        advanced_log_data(f"Rate limit excedido: {ip}", "RATE_LIMIT")
+        return redirigir_tarpit() or ("Demasiadas solicitudes", 429)
+    clasificar_peticion()
+
+@app.teardown_request
+def registrar_ataque(_error=None):
+    """ATTACK solo para peticiones etiquetadas que su ruta no registró ya
+    (CREDENTIALS, KEYLOGGER... llevan los tags): un registro por petición."""
+    if g.get("firmas") and not g.get("registrado"):
+        advanced_log_data({"method": request.method, "path": request.path,
+                           "query": request.query_string.decode("latin-1"), "firmas": g.firmas}, "ATTACK")
+
+@app.route("/assets/<path:filename>")
+def serve_assets(filename):
+    ruta = safe_join(ASSETS_DIR, filename)
+    if ruta is None or not os.path.isfile(ruta):
+        return "Not found", 404
+    mime = tipo_mime(ruta)
+    codificacion = None
+    # con Range se sirve la representación sin comprimir para que los bytes cuadren
+    if "Range" not in request.headers:
+        for cod, sufijo in VARIANTES_COMPRIMIDAS:
+            if request.accept_encodings[cod] > 0 and os.path.isfile(ruta + sufijo):
+                ruta, codificacion = ruta + sufijo, cod
+                break
+    try:
+        # send_file resuelve ETag, If-None-Match/If-Modified-Since, Range y usa
+        # wsgi.file_wrapper (sendfile) cuando el servidor lo ofrece
+        resp = send_file(os.path.abspath(ruta), mimetype=mime, conditional=True, etag=True,
+                         max_age=config.get("assets_max_age", 86400))
+    except Exception:
+        return "Not found", 404
+    resp.headers["Vary"] = "Accept-Encoding"
+    if codificacion:
+        resp.headers["Content-Encoding"] = codificacion
+    return resp
+
+def registrar_credenciales(data):
+    """Loguea un formulario capturado (CREDENTIALS + CAPTURED_DATA_FILE)."""
+    ip = request.headers.get('X-Forwarded-For', request.remote_addr)
+    if motor_firmas().credenciales(ip, data.get("usuario", data.get("username", data.get("log", "")))):
+        g.tags = sorted(set(g.get("tags") or []) | {"credential_stuffing"})
+    advanced_log_data(data, "CREDENTIALS")
+    log_writer.encolar(CAPTURED_DATA_FILE, (datetime.now().isoformat(), data))
+
+@app.route("/capturar_credenciales", methods=["POST"])
+def capturar_credenciales():
+    data = request.form.to_dict()
+    origen = data.pop("origen", "unknown")
+    registrar_credenciales(data)
+    return render_template_string("""
+        <html><body><h2>¡Gracias!</h2><p>Te redirigimos al inicio.</p><a href="/">Volver</a></body></html>
+    """)
+
+def reconstruir_secuencias(teclas, pagina_defecto="unknown"):
+    """Agrupa teclas por (página, campo) en orden y devuelve un registro por
+    secuencia: el texto resultante (aplicando Backspace) y la secuencia cruda
+    con las teclas especiales entre corchetes."""
+    secuencias = OrderedDict()
+    for t in teclas:
+        if not isinstance(t, dict):
+            continue
+        tecla = str(t.get("k", t.get("tecla", t.get("key", ""))))[:32]
+        if not tecla:
+            continue
+        pagina = str(t.get("pagina", pagina_defecto))[:256]
+        campo = str(t.get("c", t.get("campo", "document")))[:128]
+        sec = secuencias.get((pagina, campo))
+        if sec is None:
+            sec = secuencias[(pagina, campo)] = {"pagina": pagina, "campo": campo, "texto": [], "crudo": [],
+                                                 "teclas": 0, "inicio": t.get("t", t.get("timestamp")), "fin": None}
+        sec["teclas"] += 1
+        sec["fin"] = t.get("t", t.get("timestamp"))
+        if len(tecla) == 1:
+            sec["texto"].append(tecla)
+            sec["crudo"].append(tecla)
+        else:
+            sec["crudo"].append(f"[{tecla}]")
+            if tecla == "Backspace" and sec["texto"]:
+                sec["texto"].pop()
+    for sec in secuencias.values():
+        sec["texto"] = "".join(sec["texto"])
+        sec["crudo"] = "".join(sec["crudo"])
+    return list(secuencias.values())
+
+# /log_teclas y /log_keypress se quedan por las páginas clonadas con el script viejo
+@app.route("/log_teclas_lote", methods=["POST"])
+@app.route("/log_teclas", methods=["POST"])
+@app.route("/log_keypress", methods=["POST"])
+def log_teclas():
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, (dict, list)):
+        data = {}  # "hola", 5, true...: nada que registrar, pero nunca un 500
+    if isinstance(data, list):
+        pagina, teclas = "unknown", data
+    elif isinstance(data.get("teclas"), list):
+        pagina, teclas = data.get("pagina", "unknown"), data["teclas"]
+    else:
+        pagina, teclas = data.get("pagina", "unknown"), [data]
+    teclas = teclas[:int(config.get("teclas_max_por_peticion", 2000))]
+    for sec in reconstruir_secuencias(teclas, pagina):
+        advanced_log_data(sec, "KEYLOGGER")
+    return jsonify({"ok": True})
+
+@app.route("/trampa_datos", methods=["POST"])
+def trampa_datos():
+    data = request.form.to_dict()
+    advanced_log_data(data, "TRAP")
+    return jsonify({"ok": True})
+
+def _cursor(f, offset, direccion):
+    crudo = json.dumps([f.identidad(), offset, direccion]).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+def _leer_cursor(f, cursor):
+    try:
+        ident, offset, direccion = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        offset = int(offset)
+    except Exception:
+        raise ValueError("cursor inválido")
+    if ident != f.identidad() or direccion not in ("atras", "adelante"):
+        raise ValueError("cursor inválido o de un log ya reiniciado")
+    return offset, direccion
+
+def paginar_flujo(ruta, limite=100, cursor=None):
+    """Página de ``limite`` líneas de ``ruta`` en orden cronológico.
+
+    Sin cursor: las últimas ``limite``. ``anterior`` lleva a las más viejas y
+    ``siguiente`` a lo que se escriba después; el costo es O(limite) salvo al
+    cruzar a un segmento comprimido.
+    """
+    f = flujo(ruta)
+    offset, direccion = _leer_cursor(f, cursor) if cursor else (None, "atras")
+    lineas = []
+    if direccion == "atras":
+        primero = fin = offset
+        for pos, linea in f.leer_hacia_atras(offset):
+            if len(lineas) >= limite:
+                break
+            if fin is None:
+                fin = pos + len(linea)
+            lineas.append(linea)
+            primero = pos
+        lineas.reverse()
+        if fin is None:
+            fin = primero = f.tamano()
+    else:
+        primero = fin = offset
+        for pos, linea in f.leer_desde(offset):
+            if len(lineas) >= limite or not linea.endswith(b"\n"):
+                break
+            lineas.append(linea)
+            fin = pos
+    return {
+        "captured": [l.decode("utf-8", "replace") for l in lineas],
+        "anterior": _cursor(f, primero, "atras"),
+        "siguiente": _cursor(f, fin, "adelante"),
+    }
+
+@app.route("/captured_data")
+def captured_data():
+    try:
+        limite = max(1, min(request.args.get("limit", 100, type=int), 1000))
+        return jsonify(paginar_flujo(CAPTURED_DATA_FILE, limite, request.args.get("cursor")))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/stats")
+def stats_route():
+    try:
+        res = agregador.totales()
+        return jsonify({"total_entries": res["total_entries"], "unique_ips": res["unique_ips"], "blocked": list(blocked_ips)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/analysis")
+def analysis_route():
+    return jsonify(agregador.resumen())
+
+@app_admin.route("/buscar")
+def buscar_route():
+    try:
+        return jsonify(indice_busqueda.buscar(request.args.get("q", ""),
+                                              request.args.get("pagina", 1, type=int),
+                                              request.args.get("por_pagina", 50, type=int)))
+    except sqlite3.OperationalError as e:
+        return jsonify({"error": f"consulta inválida: {e}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app_admin.route("/sesiones")
+def sesiones_route():
+    try:
+        return jsonify(sesionador.sesiones(request.args.get("limite", 20, type=int), request.args.get("ip") or None))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app_admin.route("/eventos")
+def eventos_route():
+    tipos = [t for t in request.args.get("type", "").split(",") if t.strip()]
+    sub = difusor_eventos.suscribir(tipos, request.args.get("ip"))
+    if sub is None:
+        return jsonify({"error": "demasiados espectadores en vivo"}), 503
+
+    def generar():
+        try:
+            yield "retry: 3000\n\n"
+            while not sub.cerrada:
+                eventos = sub.esperar(15)
+                if sub.perdidos:
+                    yield f"event: perdidos\ndata: {sub.perdidos}\n\n"
+                    sub.perdidos = 0
+                if not eventos:
+                    yield ": ping\n\n"
+                for j in eventos:
+                    yield f"event: {j.get('type', 'INFO')}\ndata: {json.dumps(j, ensure_ascii=False)}\n\n"
+        finally:
+            difusor_eventos.desuscribir(sub)
+
+    return Response(generar(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/admin_panel")
+def admin_panel():
+    return render_template_string("""
+        <html><body>
+        <h1>Panel de Administración (falso)</h1>
+        <p>Usa los endpoints /stats, /analysis, /captured_data</p>
+        </body></html>
+    """)
+
+# Comodín: werkzeug prueba antes las reglas fijas, así que esto solo recibe
+# lo que ninguna otra ruta atiende
+@app.route("/", defaults={"ruta": ""}, methods=["GET", "HEAD", "POST"])
+@app.route("/<path:ruta>", methods=["GET", "HEAD", "POST"])
+def senuelos(ruta):
+    """Sirve el árbol virtual de señuelos y, si no, las páginas clonadas."""
+    hoja = None
+    if ruta.strip("/"):
+        hoja = arbol_senuelos().resolver(ruta)
+    else:
+        indice = ruta_local_pagina("/")
+        if not (indice and os.path.isfile(indice)):
+            hoja = arbol_senuelos().resolver("index.html")
+    if hoja is None:
+        local = ruta_local_pagina("/" + ruta)
+        if request.method == "POST" or not (local and os.path.isfile(local)):
+            return "Not found", 404
+        return send_file(local, mimetype=tipo_mime(local), conditional=True, etag=True)
+    # si matcheó una firma, registrar_ataque lo deja como ATTACK al final
+    if not g.get("firmas"):
+        advanced_log_data({"method": request.method, "path": request.path, "senuelo": hoja}, "DECOY")
+    metricas.incrementar("queso_senuelos_servidos_total")
+    if request.method == "POST":
+        data = request.form.to_dict()
+        if data:
+            registrar_credenciales(data)
+        return Response(status=302, headers={"Location": "/"})
+    url_base = config.get("senuelos_url_base") or request.host_url.rstrip("/")
+    datos, mime, etag = arbol_senuelos().contenido(hoja, url_base)
+    resp = Response(datos, mimetype=mime)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+# ---------------------------
+# Bosquejos probabilísticos
+# ---------------------------
+class HyperLogLog:
+    """Cuenta elementos distintos con 2**p registros de un byte.
+
+    Error relativo típico 1.04/sqrt(2**p) (p=14: 0.81 %, 16 KB); en ~99 % de
+    los casos queda dentro de 3 veces eso. Con pocos elementos usa conteo
+    lineal, que ahí es casi exacto. Dos bosquejos con el mismo p se fusionan
+    tomando el máximo de cada registro (igual que si se hubiera visto todo).
+    """
+
+    _POTENCIAS = [2.0 ** -r for r in range(66)]
+
+    def __init__(self, p=14):
+        if not 4 <= p <= 18:
+            raise ValueError("p debe estar entre 4 y 18")
+        self.p = p
+        self.registros = bytearray(1 << p)
+
+    def agregar(self, valor):
+        h = int.from_bytes(hashlib.blake2b(str(valor).encode("utf-8", "replace"), digest_size=8).digest(), "big")
+        resto = 64 - self.p
+        i = h >> resto
+        rango = resto - (h & ((1 << resto) - 1)).bit_length() + 1
+        if rango > self.registros[i]:
+            self.registros[i] = rango
+
+    def estimar(self):
+        m = len(self.registros)
+        alfa = 0.7213 / (1 + 1.079 / m)
+        estimado = alfa * m * m / sum(self._POTENCIAS[r] for r in self.registros)
+        if estimado <= 2.5 * m:
+            vacios = self.registros.count(0)
+            if vacios:
+                estimado = m * math.log(m / vacios)
+        return int(round(estimado))
+
+    def error_relativo(self):
+        return 1.04 / math.sqrt(len(self.registros))
+
+    def fusionar(self, otro):
+        if otro.p != self.p:
+            raise ValueError("no se pueden fusionar HyperLogLog con distinto p")
+        self.registros = bytearray(map(max, self.registros, otro.registros))
+
+    def a_dict(self):
+        return {"p": self.p, "registros": base64.b64encode(zlib.compress(bytes(self.registros))).decode()}
+
+    @classmethod
+    def desde_dict(cls, d):
+        h = cls(int(d["p"]))
+        registros = zlib.decompress(base64.b64decode(d["registros"]))
+        if len(registros) != len(h.registros):
+            raise ValueError("registros de HyperLogLog con tamaño incorrecto")
+        h.registros = bytearray(registros)
+        return h
+
+class SpaceSaving:
+    """Top-K aproximado con ``k`` contadores (Metwally et al.).
+
+    Cada cuenta sobreestima a lo más su ``error`` (y nunca subestima), y el
+    error nunca pasa de total/k. Todo elemento con más de total/k
+    apariciones está garantizado en el top. Al fusionar, a los elementos que
+    faltan en un lado se les suma el mínimo de ese lado, así las garantías se
+    mantienen (con total = suma de ambos).
+    """
+
+    def __init__(self, k=1000):
+        self.k = max(1, int(k))
+        self.total = 0
+        self.cuentas = {}  # elemento -> [cuenta, error]
+        self._heap = []    # (cuenta_vista, elemento); la cuenta real puede ser mayor
+
+    def _sacar_minimo(self):
+        while True:
+            vista, elem = heapq.heappop(self._heap)
+            real = self.cuentas[elem][0]
+            if real == vista:
+                return elem
+            heapq.heappush(self._heap, (real, elem))
+
+    def agregar(self, elem, n=1):
+        self.total += n
+        c = self.cuentas.get(elem)
+        if c is not None:
+            c[0] += n
+            return
+        if len(self.cuentas) < self.k:
+            self.cuentas[elem] = [n, 0]
+            heapq.heappush(self._heap, (n, elem))
+            return
+        victima = self._sacar_minimo()
+        minimo = self.cuentas.pop(victima)[0]
+        self.cuentas[elem] = [minimo + n, minimo]
+        heapq.heappush(self._heap, (minimo + n, elem))
+
+    def _minimo(self):
+        return min(c[0] for c in self.cuentas.values()) if len(self.cuentas) >= self.k else 0
+
+    def fusionar(self, otro):
+        min_a, min_b = self._minimo(), otro._minimo()
+        juntos = {}
+        for elem in self.cuentas.keys() | otro.cuentas.keys():
+            ca, ea = self.cuentas.get(elem, (min_a, min_a))
+            cb, eb = otro.cuentas.get(elem, (min_b, min_b))
+            juntos[elem] = [ca + cb, ea + eb]
+        self.total += otro.total
+        self._cargar(heapq.nlargest(self.k, juntos.items(), key=lambda x: x[1][0]))
+
+    def _cargar(self, items):
+        self.cuentas = {elem: list(c) for elem, c in items}
+        self._heap = [(c[0], elem) for elem, c in self.cuentas.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, n=10):
+        """[(elemento, cuenta, error_max)] de mayor a menor."""
+        return [(elem, c[0], c[1]) for elem, c in heapq.nlargest(n, self.cuentas.items(), key=lambda x: x[1][0])]
+
+    def error_maximo(self):
+        return self.total // self.k
+
+    def a_dict(self):
+        return {"k": self.k, "total": self.total, "cuentas": [[e, c[0], c[1]] for e, c in self.cuentas.items()]}
+
+    @classmethod
+    def desde_dict(cls, d):
+        s = cls(d["k"])
+        s.total = int(d.get("total", 0))
+        s._cargar(((e, (c, err)) for e, c, err in d.get("cuentas", [])))
+        return s
+
+# ---------------------------
+# Análisis de logs
+# ---------------------------
+class EstadoAnalisis:
+    """Contadores de analyze_logs(); se alimentan línea por línea."""
+
+    APROXIMADO = False
+
+    def __init__(self):
+        self.total = 0
+        self.ip_count = Counter()
+        self.user_agents = Counter()
+        self.attack_patterns = Counter()
+        self.hourly_activity = defaultdict(int)
+
+    def acumular(self, linea, j=None):
+        try:
+            if j is None:
+                j = json.loads(linea)
+            ip = j.get("ip", "Unknown")
+            ua = j.get("user_agent", "Unknown")
+            ts = datetime.fromisoformat(j.get("timestamp"))
+        except Exception:
+            ip = "Unknown"
+            ua = "Unknown"
+            ts = datetime.now()
+        # categorías que puso el motor de firmas al registrar el evento
+        tags = j.get("tags") if isinstance(j, dict) else None
+        ruta = None
+        if self.APROXIMADO and isinstance(j, dict) and isinstance(j.get("data"), dict):
+            ruta = j["data"].get("path")
+        self.acumular_campos(ip, ua, ts.hour, tags, ruta)
+
+    def acumular_campos(self, ip, ua, hora, tags=None, ruta=None):
+        """Lo que queda de acumular() una vez extraídos los campos."""
+        self.total += 1
+        self.ip_count[ip] += 1
+        self.user_agents[ua] += 1
+        self.hourly_activity[hora] += 1
+        for t in tags if isinstance(tags, list) else ():
+            self.attack_patterns[t] += 1
+
+    def sumar(self, total, ips, uas, horas, tags, rutas=None):
+        """Suma recuentos ya agregados (segmentos .qlog)."""
+        self.total += total
+        self.ip_count.update(ips)
+        self.user_agents.update(uas)
+        self.attack_patterns.update(tags)
+        for h, n in horas.items():
+            self.hourly_activity[h] += n
+
+    def totales(self):
+        """Lo barato de resumen(): sin recorrer los contadores."""
+        return {"total_entries": self.total, "unique_ips": len(self.ip_count)}
+
+    def resumen(self):
+        most_active = self.ip_count.most_common(1)
+        most_ip = most_active[0][0] if most_active else None
+        most_count = most_active[0][1] if most_active else 0
+        return {
+            "total_entries": self.total,
+            "unique_ips": len(self.ip_count),
+            "most_active_ip": most_ip,
+            "most_active_ip_count": most_count,
+            "top_user_agents": self.user_agents.most_common(5),
+            "attack_patterns": dict(self.attack_patterns),
+            "hourly_activity": dict(self.hourly_activity),
+            "blocked_ips_count": len(blocked_ips)
+        }
+
+    def a_dict(self):
+        return {
+            "total": self.total,
+            "ip_count": self.ip_count,
+            "user_agents": self.user_agents,
+            "attack_patterns": self.attack_patterns,
+            "hourly_activity": self.hourly_activity,
+        }
+
+    @classmethod
+    def desde_dict(cls, d):
+        e = cls()
+        e.total = int(d.get("total", 0))
+        e.ip_count.update(d.get("ip_count", {}))
+        e.user_agents.update(d.get("user_agents", {}))
+        e.attack_patterns.update(d.get("attack_patterns", {}))
+        for h, n in d.get("hourly_activity", {}).items():
+            e.hourly_activity[int(h)] = n
+        return e
+
+class EstadoAproximado(EstadoAnalisis):
+    """Como EstadoAnalisis pero con memoria fija: HyperLogLog para IPs y
+    user agents únicos y Space-Saving para los top de IPs, user agents y
+    rutas atacadas. Categorías y horas siguen exactas (son pocas). Se puede
+    fusionar con otro (otro segmento u otro honeypot) y guardar como JSON.
+    """
+
+    APROXIMADO = True
+
+    def __init__(self, k=None, p=None):
+        k = k or int(config.get("aproximado_top_k", 1000))
+        p = p or int(config.get("aproximado_hll_p", 14))
+        self.total = 0
+        self.ips_unicas = HyperLogLog(p)
+        self.uas_unicos = HyperLogLog(p)
+        self.top_ips = SpaceSaving(k)
+        self.top_uas = SpaceSaving(k)
+        self.top_rutas = SpaceSaving(k)
+        self.attack_patterns = Counter()
+        self.hourly_activity = defaultdict(int)
+
+    def acumular_campos(self, ip, ua, hora, tags=None, ruta=None):
+        self.total += 1
+        # lo que ya está en el top ya pasó por el HyperLogLog: ahorra el hash
+        if ip not in self.top_ips.cuentas:
+            self.ips_unicas.agregar(ip)
+        if ua not in self.top_uas.cuentas:
+            self.uas_unicos.agregar(ua)
+        self.top_ips.agregar(ip)
+        self.top_uas.agregar(ua)
+        if ruta:
+            self.top_rutas.agregar(str(ruta))
+        self.hourly_activity[hora] += 1
+        for t in tags if isinstance(tags, list) else ():
+            self.attack_patterns[t] += 1
+
+    def sumar(self, total, ips, uas, horas, tags, rutas=None):
+        self.total += total
+        for ip, n in ips.items():
+            self.ips_unicas.agregar(ip)
+            self.top_ips.agregar(ip, n)
+        for ua, n in uas.items():
+            self.uas_unicos.agregar(ua)
+            self.top_uas.agregar(ua, n)
+        for ruta, n in (rutas or {}).items():
+            self.top_rutas.agregar(ruta, n)
+        self.attack_patterns.update(tags)
+        for h, n in horas.items():
+            self.hourly_activity[h] += n
+
+    def fusionar(self, otro):
+        self.total += otro.total
+        for propio, ajeno in ((self.ips_unicas, otro.ips_unicas), (self.uas_unicos, otro.uas_unicos),
+                              (self.top_ips, otro.top_ips), (self.top_uas, otro.top_uas),
+                              (self.top_rutas, otro.top_rutas)):
+            propio.fusionar(ajeno)
+        self.attack_patterns.update(otro.attack_patterns)
+        for h, n in otro.hourly_activity.items():
+            self.hourly_activity[h] += n
+        return self
+
+    def totales(self):
+        return {"total_entries": self.total, "unique_ips": self.ips_unicas.estimar()}
+
+    def resumen(self):
+        top_ip = self.top_ips.top(1)
+        return {
+            "total_entries": self.total,
+            "unique_ips": self.ips_unicas.estimar(),
+            "most_active_ip": top_ip[0][0] if top_ip else None,
+            "most_active_ip_count": top_ip[0][1] if top_ip else 0,
+            "top_user_agents": [(ua, n) for ua, n, _ in self.top_uas.top(5)],
+            "attack_patterns": dict(self.attack_patterns),
+            "hourly_activity": dict(self.hourly_activity),
+            "blocked_ips_count": len(blocked_ips),
+            "aproximado": {
+                "unique_user_agents": self.uas_unicos.estimar(),
+                "error_relativo_unicos": round(self.ips_unicas.error_relativo(), 5),
+                "error_maximo_top": self.top_ips.error_maximo(),
+                "top_ips": self.top_ips.top(10),
+                "top_rutas": self.top_rutas.top(10),
+            },
+        }
+
+    def a_dict(self):
+        return {
+            "total": self.total,
+            "ips_unicas": self.ips_unicas.a_dict(),
+            "uas_unicos": self.uas_unicos.a_dict(),
+            "top_ips": self.top_ips.a_dict(),
+            "top_uas": self.top_uas.a_dict(),
+            "top_rutas": self.top_rutas.a_dict(),
+            "attack_patterns": self.attack_patterns,
+            "hourly_activity": self.hourly_activity,
+        }
+
+    @classmethod
+    def desde_dict(cls, d):
+        e = cls()
+        e.total = int(d.get("total", 0))
+        e.ips_unicas = HyperLogLog.desde_dict(d["ips_unicas"])
+        e.uas_unicos = HyperLogLog.desde_dict(d["uas_unicos"])
+        e.top_ips = SpaceSaving.desde_dict(d["top_ips"])
+        e.top_uas = SpaceSaving.desde_dict(d["top_uas"])
+        e.top_rutas = SpaceSaving.desde_dict(d["top_rutas"])
+        e.attack_patterns.update(d.get("attack_patterns", {}))
+        for h, n in d.get("hourly_activity", {}).items():
+            e.hourly_activity[int(h)] = n
+        return e
+
+def clase_estado(aproximado=None):
+    """EstadoAproximado si ``estadisticas_aproximadas`` (o ``aproximado``) lo pide."""
+    if aproximado is None:
+        aproximado = config.get("estadisticas_aproximadas", False)
+    return EstadoAproximado if aproximado else EstadoAnalisis
+
+def analizar_flujo(estado, ruta=None):
+    """Alimenta ``estado`` con todo el flujo de ``ruta`` (LOG_FILE)."""
+    for _, f in flujo(ruta or LOG_FILE).archivos():
+        with f:
+            if isinstance(f, LectorQlog):
+                # segmentos binarios: se cuenta sobre el diccionario, sin JSON
+                total, ips, uas, horas, tags, rutas, crudas = f.contar(estado.APROXIMADO)
+                estado.sumar(total, ips, uas, horas, tags, rutas)
+                for l in crudas:
+                    estado.acumular(l.decode("utf-8", "replace"))
+            else:
+                for l in f:
+                    estado.acumular(l.decode("utf-8", "replace"))
+    return estado
+
+def analyze_logs(aproximado=None):
+    """Reescaneo completo de LOG_FILE (referencia del agregador incremental)."""
+    estado = clase_estado(aproximado)()
+    try:
+        analizar_flujo(estado)
+    except Exception:
+        pass
+    return estado.resumen()
+
+def main_bosquejos(args):
+    """``bosquejo [SALIDA.json]``: bosquejo aproximado de LOG_FILE (para
+    juntar varios honeypots). ``fusionar A.json B.json...``: resumen de la
+    fusión de varios bosquejos."""
+    if args[:1] == ["bosquejo"] and len(args) <= 2:
+        datos = json.dumps(analizar_flujo(EstadoAproximado()).a_dict(), ensure_ascii=False)
+        if len(args) == 2:
+            with open(args[1], "w", encoding="utf-8") as f:
+                f.write(datos)
+        else:
+            print(datos)
+        return 0
+    if args[:1] == ["fusionar"] and len(args) > 1:
+        total = None
+        for ruta in args[1:]:
+            with open(ruta, "r", encoding="utf-8") as f:
+                e = EstadoAproximado.desde_dict(json.load(f))
+            total = e if total is None else total.fusionar(e)
+        print(json.dumps(total.resumen(), indent=2, ensure_ascii=False))
+        return 0
+    print("Uso: queso_plus.py bosquejo [SALIDA.json] | fusionar A.json B.json...", file=sys.stderr)
+    return 2
+
+class ConsumidorLog:
+    """Base de todo lo que se mantiene al vuelo a partir de LOG_FILE.
+
+    Se alimenta con cada lote del escritor de logs y, si hay un hueco (otro
+    proceso escribió, o venimos de un reinicio), lee el flujo desde el último
+    offset lógico procesado, pasando por los segmentos rotados si hace falta.
+    Si el flujo se reemplazó o se truncó, empieza de cero. Las subclases
+    implementan _cargar_checkpoint, _reiniciar_estado, _procesar y _tras_lote.
+    """
+
+    LOTE_LECTURA = 5000
+
+    def __init__(self, ruta_log=None):
+        self.ruta_log = ruta_log or LOG_FILE
+        self.flujo = flujo(self.ruta_log)
+        self.offset = 0
+        self._ino = None  # FlujoLog.identidad(): inodo del primer archivo del flujo
+        self._lock = threading.RLock()
+        self._cargado = False
+
+    # -- a implementar --
+    def _cargar_checkpoint(self):
+        """Restaura el estado guardado; devuelve (offset, ino)."""
+        return 0, None
+
+    def _reiniciar_estado(self):
+        pass
+
+    def _procesar(self, eventos):
+        """``eventos``: lista de (linea, registro_o_None)."""
+        raise NotImplementedError
+
+    def _tras_lote(self):
+        pass
+
+    # -- mecánica común --
+    def _ino_actual(self):
+        return self.flujo.identidad()
+
+    def _asegurar_cargado(self):
+        if self._cargado:
+            return
+        self._cargado = True
+        try:
+            self.offset, self._ino = self._cargar_checkpoint()
+        except Exception as e:
+            print(f"[!] Checkpoint de {type(self).__name__} inválido, reescaneando: {e}")
+            self._reiniciar_estado()
+            self.offset, self._ino = 0, None
+        self.ponerse_al_dia()
+
+    def reiniciar(self):
+        with self._lock:
+            self._reiniciar_estado()
+            self.offset = 0
+            self._ino = self._ino_actual()
+            self._cargado = True
+            self._tras_lote()
+
+    def ponerse_al_dia(self):
+        """Lee el flujo desde self.offset hasta la última línea completa."""
+        with self._lock:
+            ino = self._ino_actual()
+            tam = self.flujo.tamano()
+            if ino != self._ino or tam < self.offset:
+                # otro archivo o truncado: empezar de cero
+                self._reiniciar_estado()
+                self.offset = 0
+                self._ino = ino
+            if tam == self.offset:
+                return
+            lote = []
+            for fin, linea in self.flujo.leer_desde(self.offset):
+                if not linea.endswith(b"\n"):
+                    break
+                lote.append((linea.decode("utf-8", "replace"), None))
+                if len(lote) >= self.LOTE_LECTURA:
+                    self._procesar(lote)
+                    self.offset = fin
+                    self._tras_lote()
+                    lote = []
+                else:
+                    self.offset = fin
+            if lote:
+                self._procesar(lote)
+            self._tras_lote()
+
+    def al_escribir(self, eventos, inicio, fin):
+        # nunca frenar al escritor: si alguien se está poniendo al día (o aún
+        # no cargamos), estas líneas ya están en el archivo y se leerán de ahí
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if not self._cargado:
+                self.precargar()
+                return
+            if inicio != self.offset or self._ino != self._ino_actual():
+                self.ponerse_al_dia()
+                return
+            avanzado = config.get("logging_avanzado", True)
+            self._procesar([(linea.decode("utf-8", "replace"),
+                             registro if avanzado and isinstance(registro, dict) else None)
+                            for registro, linea in eventos])
+            self.offset = fin
+            self._tras_lote()
+        finally:
+            self._lock.release()
+
+    def precargar(self):
+        """Carga el checkpoint y alcanza el log en un hilo aparte."""
+        if self._cargado or getattr(self, "_precargando", False):
+            return
+        self._precargando = True
+        threading.Thread(target=self.actualizar, name=f"precarga-{type(self).__name__}", daemon=True).start()
+
+    def actualizar(self):
+        """Carga y alcanza el final de LOG_FILE si hace falta (barato si ya está al día)."""
+        with self._lock:
+            self._asegurar_cargado()
+            if self.flujo.tamano() != self.offset:
+                self.ponerse_al_dia()
+
+class AgregadorLogs(ConsumidorLog):
+    """Estado de analyze_logs() mantenido al vuelo.
+
+    Se guarda cada ``analisis_checkpoint_seg`` en AGGREGATE_FILE para no
+    reescanear todo al arrancar.
+    """
+
+    # subir si cambia lo que cuenta EstadoAnalisis (invalida checkpoints viejos)
+    VERSION = 2
+
+    def __init__(self, ruta_log=None, ruta_estado=None):
+        ConsumidorLog.__init__(self, ruta_log)
+        self.ruta_estado = ruta_estado or AGGREGATE_FILE
+        self.estado = clase_estado()()
+        self._cache = None
+        self._cache_t = 0.0
+        self._sucio = False
+        self._ultimo_guardado = time.monotonic()
+
+    def _cargar_checkpoint(self):
+        try:
+            with open(self.ruta_estado, "r", encoding="utf-8") as f:
+                cp = json.load(f)
+        except FileNotFoundError:
+            return 0, None
+        if cp.get("version") != self.VERSION:
+            raise ValueError("versión de checkpoint distinta")
+        clase = clase_estado()
+        if cp.get("aproximado", False) != clase.APROXIMADO:
+            raise ValueError("modo de estadísticas distinto (exacto/aproximado)")
+        self.estado = clase.desde_dict(cp.get("estado", {}))
+        return int(cp.get("offset", 0)), cp.get("ino")
+
+    def _reiniciar_estado(self):
+        self.estado = clase_estado()()
+        self._cache = None
+
+    def _procesar(self, eventos):
+        for linea, j in eventos:
+            self.estado.acumular(linea, j)
+
+    def _tras_lote(self):
+        # no se tira la caché: los top (most_common) son O(IPs únicas) y se
+        # recalculan a lo más cada ``analisis_resumen_seg``
+        self._sucio = True
+        if time.monotonic() - self._ultimo_guardado >= config.get("analisis_checkpoint_seg", 30):
+            self.guardar()
+
+    def guardar(self):
+        with self._lock:
+            if not self._cargado:
+                return
+            cp = {"version": self.VERSION, "offset": self.offset, "ino": self._ino,
+                  "aproximado": self.estado.APROXIMADO, "estado": self.estado.a_dict()}
+            tmp = self.ruta_estado + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(cp, f, ensure_ascii=False)
+                os.replace(tmp, self.ruta_estado)
+                self._ultimo_guardado = time.monotonic()
+            except Exception as e:
+                print(f"[!] Error guardando checkpoint de análisis: {e}", file=sys.stderr)
+
+    def resumen(self):
+        """Resumen completo. Los totales siempre están al día; los top y
+        conteos por categoría/hora pueden tener hasta ``analisis_resumen_seg``."""
+        with self._lock:
+            self.actualizar()
+            ahora = time.monotonic()
+            if self._cache is None or (self._sucio and
+                                       ahora - self._cache_t >= config.get("analisis_resumen_seg", 5)):
+                self._cache = self.estado.resumen()
+                self._cache_t, self._sucio = ahora, False
+            res = dict(self._cache)
+            res.update(self.estado.totales())
+        res["blocked_ips_count"] = len(blocked_ips)
+        return res
+
+    def totales(self):
+        """Totales sin tocar los top: O(1) (lo que usa /stats)."""
+        with self._lock:
+            self.actualizar()
+            res = self.estado.totales()
+        res["blocked_ips_count"] = len(blocked_ips)
+        return res
+
+consumidores_log = []
+
+def registrar_consumidor(consumidor):
+    consumidores_log.append(consumidor)
+    log_writer.suscribir(consumidor.al_escribir)
+    return consumidor
+
+agregador = registrar_consumidor(AgregadorLogs())
+atexit.register(agregador.guardar)
+
+# ---------------------------
+# Búsqueda indexada (SQLite FTS5)
+# ---------------------------
+class IndiceBusqueda(ConsumidorLog):
+    """Índice de LOG_FILE en SQLite (tabla ``eventos`` + FTS5).
+
+    ip, type y ts van en columnas con índice; user_agent, referer, data y
+    tags también en FTS5 para texto libre. El offset del log se guarda en la
+    misma transacción que las filas, así que el índice nunca queda a medias.
+
+    Sintaxis de consulta: ``ip:1.2.3.4`` (o ``ip:10.0.*``), ``type:CREDENTIALS``,
+    ``ua:sqlmap``, ``data:admin``, ``referer:...``, ``tag:sqli``,
+    ``desde:2024-05-01``, ``hasta:2024-05-02T12:00`` y palabras sueltas
+    (``admin*`` busca por prefijo). Todo se combina con AND.
+    """
+
+    VERSION = 1
+    COLUMNAS_FTS = {"ua": "user_agent", "user_agent": "user_agent", "referer": "referer",
+                    "data": "data", "tag": "tags", "tags": "tags"}
+    MAX_CONTEO = 10000
+
+    def __init__(self, ruta_log=None, ruta_db=None):
+        ConsumidorLog.__init__(self, ruta_log)
+        self.ruta_db = ruta_db or INDEX_FILE
+        self._db = None
+
+    def _conexion(self):
+        if self._db is None:
+            db = sqlite3.connect(self.ruta_db, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS meta(clave TEXT PRIMARY KEY, valor TEXT);
+                CREATE TABLE IF NOT EXISTS eventos(
+                    id INTEGER PRIMARY KEY, ts TEXT, type TEXT, ip TEXT,
+                    user_agent TEXT, referer TEXT, data TEXT, tags TEXT);
+                CREATE INDEX IF NOT EXISTS eventos_ip ON eventos(ip);
+                CREATE INDEX IF NOT EXISTS eventos_type ON eventos(type);
+                CREATE INDEX IF NOT EXISTS eventos_ts ON eventos(ts);
+                CREATE VIRTUAL TABLE IF NOT EXISTS eventos_fts USING fts5(
+                    user_agent, referer, data, tags, content='eventos', content_rowid='id');
+            """)
+            self._db = db
+        return self._db
+
+    def _cargar_checkpoint(self):
+        meta = dict(self._conexion().execute("SELECT clave, valor FROM meta"))
+        if not meta:
+            return 0, None
+        if meta.get("version") != str(self.VERSION):
+            raise ValueError("versión de índice distinta")
+        ino = meta.get("ino")
+        return int(meta.get("offset", 0)), int(ino) if ino else None
+
+    def _reiniciar_estado(self):
+        db = self._conexion()
+        db.execute("DELETE FROM eventos")
+        db.execute("INSERT INTO eventos_fts(eventos_fts) VALUES('delete-all')")
+        db.commit()
+
+    def _procesar(self, eventos):
+        db = self._conexion()
+        siguiente = (db.execute("SELECT max(id) FROM eventos").fetchone()[0] or 0) + 1
+        filas = []
+        for linea, j in eventos:
+            if j is None:
+                try:
+                    j = json.loads(linea)
+                except Exception:
+                    j = None
+            if not isinstance(j, dict):
+                j = {"type": "RAW", "data": linea.rstrip("\n")}
+            data = j.get("data")
+            tags = j.get("tags")
+            filas.append((siguiente, str(j.get("timestamp", "")), str(j.get("type", "")), str(j.get("ip", "")),
+                          str(j.get("user_agent", "")), str(j.get("referer", "")),
+                          data if isinstance(data, str) else json.dumps(data, ensure_ascii=False),
+                          " ".join(tags) if isinstance(tags, list) else ""))
+            siguiente += 1
+        db.executemany("INSERT INTO eventos VALUES (?,?,?,?,?,?,?,?)", filas)
+        db.executemany("INSERT INTO eventos_fts(rowid, user_agent, referer, data, tags) VALUES (?,?,?,?,?)",
+                       [(f[0], f[4], f[5], f[6], f[7]) for f in filas])
+
+    def _tras_lote(self):
+        db = self._conexion()
+        db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                       [("version", str(self.VERSION)), ("offset", str(self.offset)),
+                        ("ino", str(self._ino) if self._ino is not None else "")])
+        db.commit()
+
+    @staticmethod
+    def _frase(valor):
+        prefijo = valor.endswith("*")
+        valor = valor.rstrip("*").replace('"', '""')
+        return f'"{valor}"*' if prefijo else f'"{valor}"'
+
+    def _compilar(self, consulta):
+        where, params, fts = [], [], []
+        try:
+            tokens = shlex.split(consulta)
+        except ValueError:
+            tokens = consulta.split()
+        for tok in tokens:
+            campo, _, valor = tok.partition(":")
+            campo = campo.lower()
+            if not valor:
+                if tok.strip("*"):
+                    fts.append(self._frase(tok))
+            elif campo == "ip":
+                if valor.endswith("*"):
+                    where.append("ip LIKE ?")
+                    params.append(valor.rstrip("*") + "%")
+                else:
+                    where.append("ip = ?")
+                    params.append(valor)
+            elif campo in ("type", "tipo"):
+                where.append("type = ?")
+                params.append(valor.upper())
+            elif campo in ("desde", "since"):
+                where.append("ts >= ?")
+                params.append(valor)
+            elif campo in ("hasta", "until"):
+                where.append("ts <= ?")
+                params.append(fin_de_dia(valor))
+            elif campo in self.COLUMNAS_FTS:
+                fts.append(f"{self.COLUMNAS_FTS[campo]} : {self._frase(valor)}")
+            else:
+                fts.append(self._frase(tok))
+        if fts:
+            where.append("id IN (SELECT rowid FROM eventos_fts WHERE eventos_fts MATCH ?)")
+            params.append(" AND ".join(fts))
+        return (" WHERE " + " AND ".join(where)) if where else "", params
+
+    def buscar(self, consulta, pagina=1, por_pagina=50):
+        pagina = max(1, int(pagina))
+        por_pagina = max(1, min(int(por_pagina), 1000))
+        self.actualizar()
+        where, params = self._compilar(consulta)
+        with self._lock:
+            db = self._conexion()
+            total = db.execute(f"SELECT count(*) FROM (SELECT 1 FROM eventos{where} LIMIT {self.MAX_CONTEO + 1})",
+                               params).fetchone()[0]
+            filas = db.execute(f"SELECT ts, type, ip, user_agent, referer, data, tags FROM eventos{where} "
+                               "ORDER BY id DESC LIMIT ? OFFSET ?",
+                               params + [por_pagina, (pagina - 1) * por_pagina]).fetchall()
+        resultados = []
+        for ts, tipo, ip, ua, referer, data, tags in filas:
+            try:
+                data = json.loads(data)
+            except Exception:
+                pass
+            entrada = {"timestamp": ts, "type": tipo, "ip": ip, "user_agent": ua, "referer": referer, "data": data}
+            if tags:
+                entrada["tags"] = tags.split()
+            resultados.append(entrada)
+        return {
+            "consulta": consulta,
+            "total": total if total <= self.MAX_CONTEO else f"{self.MAX_CONTEO}+",
+            "pagina": pagina,
+            "por_pagina": por_pagina,
+            "resultados": resultados,
+        }
+
+indice_busqueda = registrar_consumidor(IndiceBusqueda())
+
+# ---------------------------
+# Sesiones de atacantes
+# ---------------------------
+def _detalle_evento(tipo, data):
+    """Resumen corto de un evento para el recorrido de una sesión."""
+    if isinstance(data, dict):
+        if tipo in ("ATTACK", "DECOY"):
+            detalle = f"{data.get('method', '')} {data.get('path', '')}"
+            if data.get("query"):
+                detalle += "?" + str(data["query"])
+        elif tipo == "CREDENTIALS":
+            usuario = data.get("usuario") or data.get("username") or data.get("email") or ""
+            detalle = f"usuario={usuario} campos={','.join(sorted(data))}"
+        elif tipo == "KEYLOGGER":
+            detalle = f"{data.get('pagina', '')} [{data.get('campo', '')}] {data.get('teclas', 0)} teclas"
+        else:
+            detalle = json.dumps(data, ensure_ascii=False)
+    else:
+        detalle = str(data)
+    return detalle[:200]
+
+class Sesionador(ConsumidorLog):
+    """Agrupa los eventos de LOG_FILE en sesiones por IP + User-Agent.
+
+    Una sesión se cierra cuando pasan ``sesion_inactividad_seg`` sin
+    actividad (medido con el timestamp de los eventos, así reprocesar da lo
+    mismo) o, si hay más de ``sesiones_max_abiertas``, se cierra la menos
+    reciente. Las cerradas se agregan a SESSIONS_FILE (JSON por línea) y las
+    ``sesiones_top`` con más eventos se quedan en memoria. El checkpoint
+    guarda las abiertas y el tamaño de SESSIONS_FILE, que se recorta al
+    cargar para no duplicar las que se vuelvan a cerrar al reprocesar.
+    """
+
+    VERSION = 1
+
+    def __init__(self, ruta_log=None, ruta_sesiones=None, ruta_estado=None):
+        ConsumidorLog.__init__(self, ruta_log)
+        self.ruta_sesiones = ruta_sesiones or SESSIONS_FILE
+        self.ruta_estado = ruta_estado or SESSIONS_STATE_FILE
+        self._reiniciar_memoria()
+        self._ultimo_guardado = time.monotonic()
+
+    def _reiniciar_memoria(self):
+        self.abiertas = OrderedDict()  # (ip, ua) -> sesión, de la menos a la más reciente
+        self.top = []                  # heap de (eventos, n, sesión)
+        self.cerradas = 0
+        self.reloj = 0.0               # timestamp (seg) más nuevo visto
+        self._pendientes = []
+
+    # -- ConsumidorLog --
+    def _cargar_checkpoint(self):
+        try:
+            with open(self.ruta_estado, "r", encoding="utf-8") as f:
+                cp = json.load(f)
+        except FileNotFoundError:
+            self._recortar(0)
+            return 0, None
+        if cp.get("version") != self.VERSION:
+            raise ValueError("versión de checkpoint distinta")
+        self._recortar(int(cp.get("bytes_sesiones", 0)))
+        self._reiniciar_memoria()
+        self.cerradas = int(cp.get("cerradas", 0))
+        self.reloj = float(cp.get("reloj", 0))
+        for sesion in cp.get("abiertas", []):
+            self.abiertas[(sesion["ip"], sesion["user_agent"])] = sesion
+        self.top = [(x["eventos"], i, x) for i, x in enumerate(cp.get("top", []))]
+        heapq.heapify(self.top)
+        return int(cp.get("offset", 0)), cp.get("ino")
+
+    def _recortar(self, tam):
+        try:
+            with open(self.ruta_sesiones, "r+b") as f:
+                f.truncate(tam)
+        except FileNotFoundError:
+            pass
+
+    def _reiniciar_estado(self):
+        self._reiniciar_memoria()
+        self._recortar(0)
+
+    def _procesar(self, eventos):
+        inactividad = float(config.get("sesion_inactividad_seg", 1800))
+        maximo = max(1, int(config.get("sesiones_max_abiertas", 10000)))
+        for linea, j in eventos:
+            if j is None:
+                try:
+                    j = json.loads(linea)
+                except Exception:
+                    continue
+            if not isinstance(j, dict) or j.get("ip") in (None, "SYSTEM"):
+                continue
+            try:
+                t = (datetime.fromisoformat(j["timestamp"]) - _EPOCA).total_seconds()
+            except Exception:
+                continue
+            clave = (str(j["ip"]), str(j.get("user_agent", "Unknown")))
+            sesion = self.abiertas.get(clave)
+            if sesion is not None and t - sesion["_t"] > inactividad:
+                self._cerrar(clave, "inactividad")
+                sesion = None
+            if sesion is None:
+                sesion = self.abiertas[clave] = {
+                    "ip": clave[0], "user_agent": clave[1], "inicio": j["timestamp"], "fin": j["timestamp"],
+                    "_t0": t, "_t": t, "eventos": 0, "tipos": {}, "paginas": [], "credenciales": 0,
+                    "usuarios": [], "lotes_teclas": 0, "teclas": 0, "bloqueos": 0, "tags": [],
+                    "pasos": [], "pasos_omitidos": 0}
+                if len(self.abiertas) > maximo:
+                    self._cerrar(next(iter(self.abiertas)), "lru")
+            else:
+                self.abiertas.move_to_end(clave)
+            self._sumar(sesion, j, t)
+            if t > self.reloj:
+                self.reloj = t
+        self._barrer(self.reloj - inactividad)
+
+    def _tras_lote(self):
+        self._volcar()
+        if time.monotonic() - self._ultimo_guardado >= config.get("analisis_checkpoint_seg", 30):
+            self.guardar()
+
+    # -- sesiones --
+    def _sumar(self, sesion, j, t):
+        tipo = str(j.get("type", ""))
+        data = j.get("data")
+        sesion["eventos"] += 1
+        sesion["tipos"][tipo] = sesion["tipos"].get(tipo, 0) + 1
+        if t >= sesion["_t"]:
+            sesion["_t"], sesion["fin"] = t, j["timestamp"]
+        pagina = None
+        if isinstance(data, dict):
+            pagina = data.get("path") if tipo in ("ATTACK", "DECOY") else data.get("pagina") if tipo == "KEYLOGGER" else None
+        if pagina and pagina not in sesion["paginas"] and len(sesion["paginas"]) < 20:
+            sesion["paginas"].append(str(pagina)[:256])
+        if tipo == "CREDENTIALS":
+            sesion["credenciales"] += 1
+            usuario = isinstance(data, dict) and (data.get("usuario") or data.get("username") or data.get("email"))
+            if usuario and usuario not in sesion["usuarios"] and len(sesion["usuarios"]) < 10:
+                sesion["usuarios"].append(str(usuario)[:128])
+        elif tipo == "KEYLOGGER":
+            sesion["lotes_teclas"] += 1
+            if isinstance(data, dict) and isinstance(data.get("teclas"), int):
+                sesion["teclas"] += data["teclas"]
+        elif tipo in ("BLOCKED", "RATE_LIMIT"):
+            sesion["bloqueos"] += 1
+        for tag in j.get("tags") or ():
+            if tag not in sesion["tags"]:
+                sesion["tags"].append(tag)
+        if len(sesion["pasos"]) < int(config.get("sesion_max_pasos", 50)):
+            sesion["pasos"].append([j["timestamp"], tipo, _detalle_evento(tipo, data)])
+        else:
+            sesion["pasos_omitidos"] += 1
+
+    def _cerrar(self, clave, motivo):
+        sesion = self.abiertas.pop(clave)
+        sesion["cierre"] = motivo
+        sesion = self._publica(sesion)
+        self.cerradas += 1
+        self._pendientes.append(sesion)
+        entrada = (sesion["eventos"], self.cerradas, sesion)
+        if len(self.top) < int(config.get("sesiones_top", 100)):
+            heapq.heappush(self.top, entrada)
+        elif entrada[0] > self.top[0][0]:
+            heapq.heapreplace(self.top, entrada)
+
+    def _barrer(self, limite):
+        """Cierra las abiertas sin actividad desde antes de ``limite`` (seg)."""
+        while self.abiertas:
+            clave, sesion = next(iter(self.abiertas.items()))
+            if sesion["_t"] >= limite:
+                break
+            self._cerrar(clave, "inactividad")
+
+    @staticmethod
+    def _publica(sesion):
+        res = dict(sesion)
+        res["duracion_seg"] = round(res.pop("_t") - res.pop("_t0"), 3)
+        return res
+
+    def _volcar(self):
+        if not self._pendientes:
+            return
+        try:
+            with open(self.ruta_sesiones, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(x, ensure_ascii=False) + "\n" for x in self._pendientes))
+            self._pendientes = []
+        except Exception as e:
+            print(f"[!] Error escribiendo sesiones: {e}", file=sys.stderr)
+
+    def guardar(self):
+        with self._lock:
+            if not self._cargado:
+                return
+            self._volcar()
+            try:
+                tam = os.path.getsize(self.ruta_sesiones)
+            except OSError:
+                tam = 0
+            cp = {"version": self.VERSION, "offset": self.offset, "ino": self._ino, "bytes_sesiones": tam,
+                  "cerradas": self.cerradas, "reloj": self.reloj, "abiertas": list(self.abiertas.values()),
+                  "top": [x for _, _, x in self.top]}
+            tmp = self.ruta_estado + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(cp, f, ensure_ascii=False)
+                os.replace(tmp, self.ruta_estado)
+                self._ultimo_guardado = time.monotonic()
+            except Exception as e:
+                print(f"[!] Error guardando checkpoint de sesiones: {e}", file=sys.stderr)
+
+    def sesiones(self, limite=20, ip=None):
+        """Sesiones con más eventos (abiertas y cerradas). Con ``ip`` se
+        buscan todas las de esa IP, también en SESSIONS_FILE."""
+        limite = max(1, min(int(limite), 1000))
+        self.actualizar()
+        with self._lock:
+            # sin eventos nuevos nadie cierra las inactivas: usar también el reloj real
+            ahora = (datetime.now() - _EPOCA).total_seconds()
+            self._barrer(max(self.reloj, ahora) - float(config.get("sesion_inactividad_seg", 1800)))
+            self._volcar()
+            abiertas = [dict(self._publica(x), abierta=True) for x in self.abiertas.values()
+                        if ip is None or x["ip"] == ip]
+            if ip is None:
+                cerradas = [x for _, _, x in self.top]
+            else:
+                cerradas = []
+                try:
+                    with open(self.ruta_sesiones, "r", encoding="utf-8") as f:
+                        for linea in f:
+                            if f'"ip": {json.dumps(ip, ensure_ascii=False)},' in linea:
+                                cerradas.append(json.loads(linea))
+                except FileNotFoundError:
+                    pass
+            total_abiertas, total_cerradas = len(self.abiertas), self.cerradas
+        lista = sorted(abiertas + [dict(x, abierta=False) for x in cerradas],
+                       key=lambda x: (x["eventos"], x["fin"]), reverse=True)[:limite]
+        return {"abiertas": total_abiertas, "cerradas": total_cerradas, "sesiones": lista}
+
+sesionador = registrar_consumidor(Sesionador())
+atexit.register(sesionador.guardar)
 
-        css_links = re.findall(r'<link[^>]*href=["\']([^"\']*\.css)["\']', html)
-        js_links = re.findall(r'<script[^>]*src=["\']([^"\']*\.js)["\']', html)
+# ---------------------------
+# Exportación en streaming
+# ---------------------------
+COLUMNAS_EXPORT = ["timestamp", "type", "ip", "user_agent", "referer", "data", "tags"]
 
-        for css in css_links:
-            try:
-                css_url = urljoin(base_url, css)
-                res = requests.get(css_url, timeout=5)
-                name = os.path.basename(css) or "style.css"
-                with open(os.path.join(ASSETS_DIR, name), "w", encoding="utf-8") as f:
-                    f.write(res.text)
-                html = html.replace(css, f"/assets/{name}")
-            except Exception:
-                continue
-        for js in js_links:
-            try:
-                js_url = urljoin(base_url, js)
-                res = requests.get(js_url, timeout=5)
-                name = os.path.basename(js) or "script.js"
-                with open(os.path.join(ASSETS_DIR, name), "w", encoding="utf-8") as f:
-                    f.write(res.text)
-                html = html.replace(js, f"/assets/{name}")
-            except Exception:
-                continue
+def registros_log(desde=None, hasta=None, tipos=None):
+    """Itera (linea_json, registro) de todo el flujo de LOG_FILE filtrando por
+    tiempo (ISO, ``hasta`` con solo fecha incluye el día) y por ``type``."""
+    hasta = fin_de_dia(hasta)
+    tipos = {t.upper() for t in tipos} if tipos else None
+    for linea in flujo(LOG_FILE).lineas(desde, hasta):
+        if not linea.endswith("\n"):
+            continue
+        try:
+            j = json.loads(linea)
+            if not isinstance(j, dict):
+                raise ValueError
+        except Exception:
+            # líneas de formato viejo: se entregan ya como JSON
+            j = {"timestamp": _ts_linea(linea), "type": "RAW", "data": linea.rstrip("\n")}
+            linea = json.dumps(j, ensure_ascii=False) + "\n"
+        ts = j.get("timestamp") or ""
+        if (desde and ts < desde) or (hasta and ts > hasta):
+            continue
+        if tipos is not None and str(j.get("type", "")).upper() not in tipos:
+            continue
+        yield linea, j
 
-        # insertar trampas si están activadas
-        if config.get("trampas_honeypot", True):
-            trap_html = """
-            <div style="display:none;">
-                <a href="/admin">Panel admin</a>
-                <a href="/wp-admin">wp-admin</a>
-            </div>
-            <script>
-                document.addEventListener('keydown', function(e) {
-                    fetch('/log_keypress', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({key: e.key, timestamp: new Date().toISOString()})});
-                });
-            </script>
-            """
-            html = html.replace("</body>", trap_html + "</body>")
+def exportar_logs(formato="ndjson", comprimir=False, desde=None, hasta=None, tipos=None, destino=None):
+    """Exporta LOG_FILE registro a registro, con memoria constante.
+
+    ``ndjson``: una cabecera (``{"_export": "cabecera", ...}`` con filtros,
+    config e IPs bloqueadas), un objeto por evento y un pie con el análisis
+    de lo exportado. ``csv``: solo las columnas de COLUMNAS_EXPORT (``data``
+    y ``tags`` como JSON). Devuelve estadísticas de rendimiento.
+    """
+    if formato not in ("ndjson", "csv"):
+        raise ValueError(f"formato desconocido: {formato}")
+    if destino is None:
+        destino = f"export_honeypot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}" + (".gz" if comprimir else "")
+    log_writer.vaciar()
+    inicio = time.monotonic()
+    estado = clase_estado()()
+    n = 0
+    abrir = (lambda r: gzip.open(r, "wt", encoding="utf-8", newline="", compresslevel=6)) if comprimir else \
+        (lambda r: open(r, "w", encoding="utf-8", newline=""))
+    with abrir(destino) as out:
+        if formato == "ndjson":
+            out.write(json.dumps({
+                "_export": "cabecera",
+                "export_timestamp": datetime.now().isoformat(),
+                "filtros": {"desde": desde, "hasta": hasta, "tipos": tipos},
+                "blocked_ips": list(blocked_ips),
+                "config": config,
+            }, ensure_ascii=False) + "\n")
+            for linea, j in registros_log(desde, hasta, tipos):
+                out.write(linea)
+                estado.acumular(linea, j)
+                n += 1
+            segundos = time.monotonic() - inicio
+            out.write(json.dumps({"_export": "resumen", "registros": n, "segundos": round(segundos, 3),
+                                  "analysis": estado.resumen()}, ensure_ascii=False) + "\n")
+        else:
+            w = csv.writer(out)
+            w.writerow(COLUMNAS_EXPORT)
+            for linea, j in registros_log(desde, hasta, tipos):
+                data, tags = j.get("data"), j.get("tags")
+                w.writerow([j.get("timestamp", ""), j.get("type", ""), j.get("ip", ""), j.get("user_agent", ""),
+                            j.get("referer", ""),
+                            data if isinstance(data, str) else json.dumps(data, ensure_ascii=False),
+                            json.dumps(tags, ensure_ascii=False) if tags else ""])
+                n += 1
+    segundos = max(time.monotonic() - inicio, 1e-9)
+    tam = os.path.getsize(destino)
+    return {
+        "archivo": destino,
+        "registros": n,
+        "bytes": tam,
+        "segundos": round(segundos, 3),
+        "registros_por_seg": int(n / segundos),
+        "mb_por_seg": round(tam / segundos / 1e6, 2),
+    }
 
-        with open(os.path.join(CLONE_DIR, "index.html"), "w", encoding="utf-8") as f:
-            f.write(html)
-        advanced_log_data({"action": "clone_done", "url": url}, "SYSTEM")
-        print(f"[+] Clonación completada en {CLONE_DIR}/index.html")
-        return True
-    except Exception as e:
-        advanced_log_data({"action": "clone_error", "error": str(e)}, "ERROR")
-        print(f"[!] Error clonando sitio: {e}")
-        return False
 
 # ---------------------------
-# Endpoints básicos del honeypot
+# Seguimiento en vivo (tail -f / SSE)
 # ---------------------------
-@app.before_request
-def antes_de_request():
-    ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-    if is_ip_blocked(ip):
-        advanced_log_data(f"Acceso bloqueado: {ip}", "BLOCKED")
-        return "Acceso denegado", 403
-    if not rate_limit_check(ip):
-        advanced_log_data(f"Rate limit excedido: {ip}", "RATE_LIMIT")
-        return "Demasiadas solicitudes", 429
+class Suscripcion:
+    """Un espectador en vivo: filtros y un buffer acotado propio."""
 
-@app.route("/assets/<path:filename>")
-def serve_assets(filename):
-    try:
-        with open(os.path.join(ASSETS_DIR, filename), "r", encoding="utf-8") as f:
-            content = f.read()
-        if filename.endswith(".css"):
-            return content, 200, {'Content-Type': 'text/css'}
-        if filename.endswith(".js"):
-            return content, 200, {'Content-Type': 'application/javascript'}
-        return content
-    except Exception:
-        return "Not found", 404
+    def __init__(self, tipos=None, ip=None, maximo=1000):
+        self.tipos = {t.upper() for t in tipos} if tipos else None
+        self.ip = ip or None
+        self.cola = deque(maxlen=maximo)
+        self.perdidos = 0
+        self.cerrada = False
+        self._hay = threading.Event()
 
-@app.route("/capturar_credenciales", methods=["POST"])
-def capturar_credenciales():
-    data = request.form.to_dict()
-    origen = data.pop("origen", "unknown")
-    advanced_log_data(data, "CREDENTIALS")
-    with open(CAPTURED_DATA_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{datetime.now().isoformat()} - {json.dumps(data, ensure_ascii=False)}\n")
-    return render_template_string("""
-        <html><body><h2>¡Gracias!</h2><p>Te redirigimos al inicio.</p><a href="/">Volver</a></body></html>
-    """)
+    def acepta(self, j):
+        if self.tipos is not None and str(j.get("type", "")).upper() not in self.tipos:
+            return False
+        if self.ip:
+            ip = str(j.get("ip", ""))
+            return ip.startswith(self.ip[:-1]) if self.ip.endswith("*") else ip == self.ip
+        return True
 
-@app.route("/log_teclas", methods=["POST"])
-def log_teclas():
-    data = request.get_json() or {}
-    advanced_log_data(data, "KEYLOGGER")
-    return jsonify({"ok": True})
+    def poner(self, j):
+        # si no lee a tiempo se pierden los más viejos, nunca se espera
+        if len(self.cola) == self.cola.maxlen:
+            self.perdidos += 1
+        self.cola.append(j)
+        self._hay.set()
 
-@app.route("/trampa_datos", methods=["POST"])
-def trampa_datos():
-    data = request.form.to_dict()
-    advanced_log_data(data, "TRAP")
-    return jsonify({"ok": True})
+    def esperar(self, timeout=None):
+        """Bloquea hasta que haya eventos (o ``timeout``) y los devuelve todos."""
+        self._hay.wait(timeout)
+        self._hay.clear()
+        eventos = []
+        while True:
+            try:
+                eventos.append(self.cola.popleft())
+            except IndexError:
+                return eventos
 
-@app.route("/captured_data")
-def captured_data():
-    try:
-        with open(CAPTURED_DATA_FILE, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-        return jsonify({"captured": lines})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+class DifusorEventos:
+    """Reparte los eventos nuevos de LOG_FILE entre los espectadores.
 
-@app.route("/stats")
-def stats_route():
-    try:
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-        total = len(lines)
-        ips = []
-        for l in lines:
-            try:
-                j = json.loads(l)
-                ips.append(j.get("ip", "Unknown"))
-            except Exception:
-                if " - IP: " in l:
-                    parts = l.split(" - IP: ")
-                    ips.append(parts[1].strip())
-        return jsonify({"total_entries": total, "unique_ips": len(set(ips)), "blocked": list(blocked_ips)})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    En el proceso que escribe se alimenta directo del escritor de logs (sin
+    releer nada). Mientras haya espectadores, un hilo sondea el flujo cada
+    ``eventos_sondeo_ms`` para lo que escriba otro proceso; el offset lógico
+    compartido evita publicar dos veces la misma línea.
+    """
 
-@app.route("/analysis")
-def analysis_route():
-    return jsonify(analyze_logs())
+    def __init__(self, ruta_log=None):
+        self.flujo = flujo(ruta_log or LOG_FILE)
+        self._lock = threading.Lock()
+        self._subs = set()
+        self.offset = None
+        self._hilo = None
 
-@app.route("/admin_panel")
-def admin_panel():
-    return render_template_string("""
-        <html><body>
-        <h1>Panel de Administración (falso)</h1>
-        <p>Usa los endpoints /stats, /analysis, /captured_data</p>
-        </body></html>
-    """)
+    def __len__(self):
+        return len(self._subs)
 
-# ---------------------------
-# Análisis de logs
-# ---------------------------
-def analyze_logs():
+    def suscribir(self, tipos=None, ip=None):
+        sub = Suscripcion(tipos, ip, int(config.get("eventos_buffer_max", 1000)))
+        with self._lock:
+            if len(self._subs) >= int(config.get("eventos_max_clientes", 50)):
+                return None
+            if not self._subs:
+                self.offset = self.flujo.tamano()
+            self._subs = self._subs | {sub}
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._sondear, name="difusor-eventos", daemon=True)
+                self._hilo.start()
+        return sub
+
+    def desuscribir(self, sub):
+        with self._lock:
+            self._subs = self._subs - {sub}
+
+    def cerrar_todas(self):
+        """Despierta y da por terminadas todas las suscripciones (al apagar)."""
+        with self._lock:
+            subs, self._subs = self._subs, set()
+        for sub in subs:
+            sub.cerrada = True
+            sub._hay.set()
+
+    def _publicar(self, registros):
+        subs = self._subs
+        for j in registros:
+            for sub in subs:
+                if sub.acepta(j):
+                    sub.poner(j)
+
+    def al_escribir(self, eventos, inicio, fin):
+        if not self._subs:
+            return
+        # no frenar al escritor: si el sondeo tiene el lock, él lo lee del archivo
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if inicio != self.offset:
+                return
+            self._publicar([r if isinstance(r, dict) else _registro_de_linea(l.decode("utf-8", "replace"))
+                            for r, l in eventos])
+            self.offset = fin
+        finally:
+            self._lock.release()
+
+    def _sondear(self):
+        while self._subs:
+            time.sleep(config.get("eventos_sondeo_ms", 500) / 1000.0)
+            with self._lock:
+                tam = self.flujo.tamano()
+                if tam < self.offset:
+                    self.offset = tam  # truncado
+                if tam == self.offset:
+                    continue
+                registros = []
+                for fin, linea in self.flujo.leer_desde(self.offset):
+                    if not linea.endswith(b"\n"):
+                        break
+                    registros.append(_registro_de_linea(linea.decode("utf-8", "replace")))
+                    self.offset = fin
+                self._publicar(registros)
+
+def _registro_de_linea(linea):
     try:
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            lines = f.readlines()
+        j = json.loads(linea)
+        if isinstance(j, dict):
+            return j
     except Exception:
-        lines = []
-    ip_count = Counter()
-    user_agents = Counter()
-    attack_patterns = Counter()
-    hourly_activity = defaultdict(int)
-    for l in lines:
-        try:
-            j = json.loads(l)
-            ip = j.get("ip", "Unknown")
-            ua = j.get("user_agent", "Unknown")
-            ts = datetime.fromisoformat(j.get("timestamp"))
-        except Exception:
-            ip = "Unknown"
-            ua = "Unknown"
-            ts = datetime.now()
-        ip_count[ip] += 1
-        user_agents[ua] += 1
-        hourly_activity[ts.hour] += 1
-        low = l.lower()
-        if any(k in low for k in ("sql", "admin", "login", "password", "phpmyadmin")):
-            attack_patterns["potential_attack"] += 1
-    most_active = ip_count.most_common(1)
-    most_ip = most_active[0][0] if most_active else None
-    most_count = most_active[0][1] if most_active else 0
-    return {
-        "total_entries": len(lines),
-        "unique_ips": len(ip_count),
-        "most_active_ip": most_ip,
-        "most_active_ip_count": most_count,
-        "top_user_agents": user_agents.most_common(5),
-        "attack_patterns": dict(attack_patterns),
-        "hourly_activity": dict(hourly_activity),
-        "blocked_ips_count": len(blocked_ips)
-    }
+        pass
+    return {"timestamp": _ts_linea(linea), "type": "RAW", "data": linea.rstrip("\n")}
+
+difusor_eventos = DifusorEventos()
+log_writer.suscribir(difusor_eventos.al_escribir)
+
+def linea_en_vivo(j):
+    data = j.get("data")
+    data = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    tags = f" [{','.join(j['tags'])}]" if j.get("tags") else ""
+    return f"{str(j.get('timestamp', ''))[11:19]} {j.get('type', ''):<11} {j.get('ip', ''):<15}{tags} {data[:120]}"
 
 # ---------------------------
 # Clonar helpers y logging simple
 # ---------------------------
 def log_data(data):
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{datetime.now().isoformat()} - {data}\n")
-    except Exception:
-        pass
+    log_writer.encolar(LOG_FILE, f"{datetime.now().isoformat()} - {data}")
 
 # ---------------------------
 # Server thread (start/stop desde menú)
 # ---------------------------
+class ServidorWSGIPool(BaseWSGIServer):
+    """Servidor werkzeug que atiende cada conexión en un pool de hilos
+    compartido (en vez de un hilo nuevo por petición) y cuenta conexiones y
+    peticiones de su puerto."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, pool, fd=None):
+        self.pool = pool
+        self.conexiones = 0
+        self.peticiones = 0
+        self.activas = 0
+        self._lock_contadores = threading.Lock()
+        BaseWSGIServer.__init__(self, host, port, self._contar(app), fd=fd)
+
+    def _contar(self, app):
+        def wsgi(environ, start_response):
+            with self._lock_contadores:
+                self.peticiones += 1
+            return app(environ, start_response)
+        return wsgi
+
+    def process_request(self, request, client_address):
+        # cada conexión ocupa un worker hasta cerrarse: sin timeout, unas
+        # cuantas conexiones ociosas (keep-alive o slowloris) agotan el pool
+        request.settimeout(float(config.get("timeout_conexion_seg", 10)) or None)
+        with self._lock_contadores:
+            self.conexiones += 1
+            self.activas += 1
+        try:
+            self.pool.submit(self._atender, request, client_address)
+        except RuntimeError:
+            # pool cerrado: estamos apagando
+            self._terminar(request)
+
+    def _atender(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self._terminar(request)
+
+    def _terminar(self, request):
+        self.shutdown_request(request)
+        with self._lock_contadores:
+            self.activas -= 1
+
 class ServerThread(threading.Thread):
-    def __init__(self, app, host='0.0.0.0', port=8080):
+    def __init__(self, app, host='0.0.0.0', port=8080, pool=None):
         threading.Thread.__init__(self)
-        self.server = make_server(host, port, app)
+        self._pool_propio = pool is None
+        self.pool = pool or ThreadPoolExecutor(max_workers=int(config.get("hilos_servidor", 32)),
+                                               thread_name_prefix=f"http-{port}")
+        self.server = ServidorWSGIPool(host, port, app, self.pool)
         self.ctx = app.app_context()
         self.host = host
         self.port = port
@@ -479,14 +4309,753 @@ class ServerThread(threading.Thread):
     def shutdown(self):
         try:
             self.server.shutdown()
+            self.server.server_close()
             self._running = False
         except Exception as e:
             print(f"[!] Error deteniendo server: {e}")
+        if self._pool_propio:
+            self.pool.shutdown(wait=True)
+        # que no se quede nada en la cola del escritor
+        log_writer.vaciar()
 
     @property
     def running(self):
         return self._running
 
+    def estado(self):
+        srv = self.server
+        return {
+            "puerto": self.port,
+            "host": self.host,
+            "activo": self._running,
+            "conexiones": srv.conexiones,
+            "conexiones_activas": srv.activas,
+            "peticiones": srv.peticiones,
+        }
+
+def _medidores_servidor():
+    filas = []
+    for f in gestor_servidores.estado():
+        if f.get("activo") and isinstance(f.get("conexiones"), int):
+            filas.append(((("puerto", f["puerto"]),), f["conexiones"]))
+    return filas
+
+metricas.medidor("queso_log_registros_escritos_total", "Registros escritos por el escritor de logs.",
+                 lambda: log_writer.escritos, tipo="counter")
+metricas.medidor("queso_log_descartados_total", "Registros descartados por cola llena.",
+                 lambda: log_writer.descartados, tipo="counter")
+metricas.medidor("queso_log_cola", "Registros esperando en la cola del escritor.", lambda: log_writer.cola.qsize() if log_writer.cola else 0)
+metricas.medidor("queso_ips_rastreadas", "IPs con estado en el rate limiter.", lambda: len(limitador))
+metricas.medidor("queso_ips_bloqueadas", "Entradas en la lista de bloqueo (IPs y CIDR).", lambda: len(blocked_ips))
+metricas.medidor("queso_sesiones_abiertas", "Sesiones de atacantes abiertas en memoria.",
+                 lambda: len(sesionador.abiertas))
+metricas.medidor("queso_espectadores_en_vivo", "Suscriptores conectados a /eventos o al modo seguir.",
+                 lambda: len(difusor_eventos))
+metricas.medidor("queso_servidor_conexiones_total", "Conexiones aceptadas por puerto señuelo.",
+                 _medidores_servidor, tipo="counter")
+
+def app_metricas(environ, start_response):
+    """WSGI del listener admin: /metrics y los endpoints de ``app_admin``.
+    Fuera de ``app`` a propósito, así el señuelo no los expone y los scrapes
+    no ensucian los logs."""
+    token = config.get("metricas_token")
+    if token and environ.get("HTTP_AUTHORIZATION", "") != f"Bearer {token}":
+        start_response("401 Unauthorized", [("Content-Type", "text/plain")])
+        return [b"no autorizado\n"]
+    if environ.get("PATH_INFO", "/") not in ("/", "/metrics"):
+        return app_admin(environ, start_response)
+    cuerpo = metricas.exponer().encode("utf-8")
+    start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+                              ("Content-Length", str(len(cuerpo)))])
+    return [cuerpo]
+
+class ServidorMetricas:
+    """Listener admin en ``metricas_host``:``metricas_puerto``: /metrics y
+    los endpoints del operador. Hilo por conexión: los espectadores de
+    /eventos no le quitan workers al señuelo."""
+
+    def __init__(self):
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://{self.server.host}:{self.server.port}/metrics" if self.server else None
+
+    def iniciar(self, puertos_senuelo=()):
+        puerto = int(config.get("metricas_puerto", 0) or 0)
+        if not puerto or self.server is not None:
+            return
+        if puerto in puertos_senuelo:
+            print(f"[!] metricas_puerto {puerto} es también un puerto señuelo; métricas desactivadas.")
+            return
+        try:
+            self.server = make_server(config.get("metricas_host", "127.0.0.1"), puerto, app_metricas, threaded=True)
+        except OSError as e:
+            print(f"[!] No se pudo abrir el puerto de métricas {puerto}: {e}")
+            return
+        threading.Thread(target=self.server.serve_forever, name="metricas", daemon=True).start()
+
+    def detener(self):
+        if self.server is not None:
+            difusor_eventos.cerrar_todas()  # los /eventos no terminan solos
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+servidor_metricas = ServidorMetricas()
+
+# ---------------------------
+# Tarpit (asyncio)
+# ---------------------------
+# Un solo hilo con un event loop sostiene todas las conexiones atrapadas: cada
+# una es un Protocol con __slots__ (sin corrutina, sin buffers de lectura) y un
+# solo temporizador recorre todas cada ``tarpit_intervalo_seg`` mandando el
+# siguiente byte (goteo) o el siguiente renglón de un listado sin fin.
+
+TARPIT_CABECERA = (b"HTTP/1.1 200 OK\r\nServer: Apache/2.4.41 (Ubuntu)\r\n"
+                   b"Content-Type: text/html; charset=utf-8\r\nConnection: keep-alive\r\n\r\n")
+TARPIT_CUERPO = (b"<!DOCTYPE html><html><head><title>Cargando...</title></head><body>"
+                 b"<p>Preparando su descarga, espere por favor" + b"." * 64)
+_TARPIT_NOMBRES = ("backup", "db_dump", "usuarios", "config", "old_site", "wp-content", "private",
+                   "clientes", "facturas", "export", "logs", "keys")
+_TARPIT_EXT = ("/", "/", ".sql", ".sql.gz", ".zip", ".tar.gz", ".bak", ".env")
+
+class _ConexionTarpit(asyncio.Protocol):
+    __slots__ = ("tarpit", "transporte", "ip", "ua", "ruta", "listado", "inicio", "enviados", "paso", "buf")
+
+    def __init__(self, tarpit):
+        self.tarpit = tarpit
+        self.transporte = None
+        self.ip = "?"
+        self.ua = "Unknown"
+        self.ruta = None          # None = todavía no llega la petición completa
+        self.listado = False
+        self.inicio = time.monotonic()
+        self.enviados = 0
+        self.paso = 0
+        self.buf = b""
+
+    def connection_made(self, transporte):
+        if len(self.tarpit.conexiones) >= self.tarpit.max_conexiones:
+            transporte.abort()
+            return
+        self.transporte = transporte
+        self.ip = (transporte.get_extra_info("peername") or ("?",))[0]
+        self.tarpit.conexiones.add(self)
+
+    def data_received(self, datos):
+        if self.ruta is not None:
+            return  # lo que mande después da igual
+        self.buf += datos
+        if b"\r\n\r\n" not in self.buf and len(self.buf) < 8192:
+            return
+        lineas = self.buf.split(b"\r\n\r\n", 1)[0].decode("latin-1").split("\r\n")
+        self.buf = b""
+        partes = lineas[0].split(" ")
+        self.ruta = (partes[1] if len(partes) > 1 else "/").split("?", 1)[0][:256]
+        for linea in lineas[1:]:
+            clave, _, valor = linea.partition(":")
+            clave = clave.strip().lower()
+            if clave == "user-agent":
+                self.ua = valor.strip()[:256]
+            elif clave == "x-forwarded-for":
+                self.ip = valor.strip()[:64]  # igual que antes_de_request
+        modo = self.tarpit.modo
+        self.listado = modo == "listado" or (modo == "mixto" and self.ruta.endswith("/"))
+        if self.listado:
+            ruta = escapar_html(self.ruta)
+            self._escribir(TARPIT_CABECERA + f"<html><head><title>Index of {ruta}</title></head><body>"
+                           f"<h1>Index of {ruta}</h1><pre>".encode("utf-8"))
+
+    def connection_lost(self, exc):
+        if self.transporte is not None:
+            self.tarpit._cerrada(self)
+
+    def _escribir(self, datos):
+        self.transporte.write(datos)
+        self.enviados += len(datos)
+
+    def goteo(self):
+        """Siguiente pedacito de la respuesta (nunca termina)."""
+        self.paso += 1
+        if self.listado:
+            n = self.paso
+            nombre = f"{_TARPIT_NOMBRES[n % len(_TARPIT_NOMBRES)]}_{2015 + n % 10}{n:05d}{_TARPIT_EXT[n % len(_TARPIT_EXT)]}"
+            fecha = (datetime(2024, 1, 1) - timedelta(hours=n * 7)).strftime("%d-%b-%Y %H:%M")
+            tam = "-" if nombre.endswith("/") else f"{(n * 7919) % 900 + 10}M"
+            self._escribir(f'<a href="{nombre}">{nombre}</a>{" " * max(1, 40 - len(nombre))}{fecha}  {tam:>6}\n'
+                           .encode("utf-8"))
+        else:
+            # cabecera y cuerpo de a un byte: el cliente nunca termina ni de leer las cabeceras
+            i = self.paso - 1
+            if i < len(TARPIT_CABECERA):
+                self._escribir(TARPIT_CABECERA[i:i + 1])
+            else:
+                i = (i - len(TARPIT_CABECERA)) % len(TARPIT_CUERPO)
+                self._escribir(TARPIT_CUERPO[i:i + 1])
+
+class Tarpit:
+    """Listener asyncio en ``tarpit_puerto`` que entretiene a los clientes
+    redirigidos por redirigir_tarpit() lo más posible con el mínimo de
+    memoria. Al cerrarse cada conexión se loguea un evento TARPIT con el
+    tiempo que se le hizo perder a la IP."""
+
+    ESPERA_PETICION_SEG = 30   # sin petición completa en este tiempo, se cierra
+    MAX_IPS = 10000
+
+    def __init__(self):
+        self.conexiones = set()
+        self.loop = None
+        self.server = None
+        self.hilo = None
+        self.atendidas = 0
+        self.segundos_total = 0.0
+        self.por_ip = OrderedDict()  # ip -> [conexiones, segundos], LRU acotado
+
+    @property
+    def activo(self):
+        return self.server is not None
+
+    def iniciar(self, puertos_senuelo=()):
+        puerto = int(config.get("tarpit_puerto", 0) or 0)
+        if not puerto or self.hilo is not None:
+            return
+        if puerto in puertos_senuelo:
+            print(f"[!] tarpit_puerto {puerto} es también un puerto señuelo; tarpit desactivado.")
+            return
+        self.modo = config.get("tarpit_modo", "mixto")
+        self.intervalo = max(0.05, float(config.get("tarpit_intervalo_seg", 1.0)))
+        self.max_conexiones = int(config.get("tarpit_max_conexiones", 20000))
+        self.max_seg = float(config.get("tarpit_max_seg", 0) or 0)
+        self._subir_limite_archivos(self.max_conexiones + 1024)
+        host = config.get("tarpit_host") or config.get("host_servidor", "0.0.0.0")
+        listo = threading.Event()
+        self.hilo = threading.Thread(target=self._correr, args=(host, puerto, listo), name="tarpit", daemon=True)
+        self.hilo.start()
+        listo.wait(5)
+        if self.server is None:
+            self.hilo.join(1)
+            self.hilo = None
+        else:
+            print(f"[+] Tarpit ({self.modo}) en {host}:{puerto}")
+
+    @staticmethod
+    def _subir_limite_archivos(n):
+        # cada conexión atrapada es un descriptor; el límite blando suele ser 1024
+        try:
+            import resource
+            blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if blando != resource.RLIM_INFINITY and blando < n:
+                objetivo = n if duro == resource.RLIM_INFINITY else min(n, duro)
+                resource.setrlimit(resource.RLIMIT_NOFILE, (objetivo, duro))
+        except (ImportError, ValueError, OSError):
+            pass
+
+    def _correr(self, host, puerto, listo):
+        loop = asyncio.new_event_loop()
+        try:
+            self.server = loop.run_until_complete(loop.create_server(
+                lambda: _ConexionTarpit(self), host, puerto, backlog=4096, reuse_address=True))
+        except OSError as e:
+            print(f"[!] No se pudo abrir el puerto del tarpit {puerto}: {e}")
+            loop.close()
+            listo.set()
+            return
+        self.loop = loop
+        tarea = loop.create_task(self._latido())
+        listo.set()
+        try:
+            loop.run_forever()
+        finally:
+            tarea.cancel()
+            self.server.close()
+            for c in list(self.conexiones):
+                c.transporte.abort()
+            # connection_lost de cada una (y su log) corre en la siguiente vuelta
+            loop.run_until_complete(asyncio.sleep(0))
+            loop.run_until_complete(self.server.wait_closed())
+            loop.close()
+            self.loop = self.server = None
+
+    async def _latido(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            ahora = time.monotonic()
+            for c in list(self.conexiones):
+                if c.ruta is None:
+                    if ahora - c.inicio > self.ESPERA_PETICION_SEG:
+                        c.transporte.close()
+                elif self.max_seg and ahora - c.inicio > self.max_seg:
+                    c.transporte.close()
+                elif c.transporte.get_write_buffer_size() < 4096:  # si no lee, que espere
+                    c.goteo()
+
+    def _cerrada(self, c):
+        if c not in self.conexiones:
+            return
+        self.conexiones.discard(c)
+        segundos = time.monotonic() - c.inicio
+        self.atendidas += 1
+        self.segundos_total += segundos
+        fila = self.por_ip.pop(c.ip, None) or [0, 0.0]
+        fila[0] += 1
+        fila[1] += segundos
+        self.por_ip[c.ip] = fila
+        if len(self.por_ip) > self.MAX_IPS:
+            self.por_ip.popitem(last=False)
+        advanced_log_data({"action": "tarpit", "path": c.ruta, "modo": "listado" if c.listado else "goteo",
+                           "segundos": round(segundos, 1), "bytes": c.enviados,
+                           "segundos_ip": round(fila[1], 1)}, "TARPIT", cliente=(c.ip, c.ua, "Direct"))
+
+    def top(self, n=10):
+        """IPs a las que más tiempo se les hizo perder (conexiones ya cerradas)."""
+        return sorted(((ip, f[0], round(f[1], 1)) for ip, f in list(self.por_ip.items())),
+                      key=lambda x: -x[2])[:n]
+
+    def detener(self):
+        if self.hilo is None:
+            return
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.hilo.join(10)
+        self.hilo = None
+
+tarpit = Tarpit()
+
+metricas.medidor("queso_tarpit_conexiones", "Conexiones retenidas ahora mismo en el tarpit.",
+                 lambda: len(tarpit.conexiones))
+metricas.medidor("queso_tarpit_atendidas_total", "Conexiones del tarpit ya cerradas.",
+                 lambda: tarpit.atendidas, tipo="counter")
+metricas.medidor("queso_tarpit_segundos_total", "Tiempo total que se les hizo perder a los clientes del tarpit.",
+                 lambda: tarpit.segundos_total, tipo="counter")
+
+# ---------------------------
+# Modo multiproceso (pre-fork)
+# ---------------------------
+# El maestro abre los puertos, hace fork de ``trabajadores`` procesos que
+# atienden esos sockets y se queda como coordinador: dueño del limitador, la
+# lista de bloqueo, el escritor de logs y los consumidores. Los trabajadores
+# le hablan por un socket Unix (mensajes JSON con prefijo de longitud), así
+# que un bloqueo vale para todos en cuanto se responde y todos los logs salen
+# de un solo escritor, en un solo flujo ordenado.
+
+def _enviar_msg(sock, obj):
+    datos = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    sock.sendall(struct.pack("!I", len(datos)) + datos)
+
+def _recibir_exacto(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        trozo = sock.recv(n - len(buf))
+        if not trozo:
+            return None
+        buf += trozo
+    return bytes(buf)
+
+def _recibir_msg(sock):
+    cabecera = _recibir_exacto(sock, 4)
+    if cabecera is None:
+        return None
+    datos = _recibir_exacto(sock, struct.unpack("!I", cabecera)[0])
+    return None if datos is None else json.loads(datos)
+
+def _encolar_lote_remoto(lote):
+    for ruta, registro in lote:
+        if ruta in (LOG_FILE, CAPTURED_DATA_FILE):
+            log_writer.encolar(ruta, registro)
+
+# lo único que un trabajador puede pedirle al maestro
+OPERACIONES_COORDINADOR = {
+    "limitador.verificar": lambda ip: limitador.verificar(ip),
+    "limitador.olvidar": lambda ip: limitador.olvidar(ip),
+    "limitador.len": lambda: len(limitador),
+    "bloqueo.contiene": lambda ip: ip in blocked_ips,
+    "bloqueo.add": lambda valor: blocked_ips.add(valor),
+    "bloqueo.discard": lambda valor: blocked_ips.discard(valor),
+    "bloqueo.lista": lambda: list(blocked_ips),
+    "bloqueo.len": lambda: len(blocked_ips),
+    "agregador.resumen": lambda: agregador.resumen(),
+    "agregador.totales": lambda: agregador.totales(),
+    "indice.buscar": lambda *args: indice_busqueda.buscar(*args),
+    "sesiones.top": lambda *args: sesionador.sesiones(*args),
+    "log.lote": _encolar_lote_remoto,
+    "metricas.lote": lambda lote: metricas.sumar_lote(lote),
+}
+
+class _ManejadorCoordinador(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                msg = _recibir_msg(self.request)
+            except (OSError, ValueError):
+                return
+            if msg is None:
+                return
+            op, args = msg
+            try:
+                fn = OPERACIONES_COORDINADOR[op]
+                resp = [True, fn(*args)]
+            except Exception as e:
+                resp = [False, f"{type(e).__name__}: {e}"]
+            try:
+                _enviar_msg(self.request, resp)
+            except OSError:
+                return
+
+class Coordinador:
+    """Servidor del socket Unix en el proceso maestro. Se hace bind antes del
+    fork y se atiende después, así que los trabajadores pueden conectarse
+    desde el primer momento."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        if os.path.exists(ruta):
+            os.unlink(ruta)
+        self.server = socketserver.ThreadingUnixStreamServer(ruta, _ManejadorCoordinador)
+        self.server.daemon_threads = True
+        os.chmod(ruta, 0o600)
+
+    def iniciar(self):
+        threading.Thread(target=self.server.serve_forever, name="coordinador", daemon=True).start()
+
+    def detener(self):
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            os.unlink(self.ruta)
+        except OSError:
+            pass
+
+class ClienteCoordinador:
+    """Una conexión persistente por hilo del trabajador."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+
+    def llamar(self, op, *args):
+        for intento in (1, 2):
+            s = getattr(self._local, "s", None)
+            try:
+                if s is None:
+                    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    s.connect(self.ruta)
+                    self._local.s = s
+                _enviar_msg(s, [op, list(args)])
+                resp = _recibir_msg(s)
+                if resp is None:
+                    raise ConnectionError("el coordinador cerró la conexión")
+                break
+            except OSError:
+                if s is not None:
+                    s.close()
+                self._local.s = None
+                if intento == 2:
+                    raise
+        ok, res = resp
+        if not ok:
+            raise RuntimeError(res)
+        return res
+
+class LimitadorRemoto:
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def verificar(self, ip):
+        return self.cliente.llamar("limitador.verificar", ip)
+
+    def olvidar(self, ip):
+        self.cliente.llamar("limitador.olvidar", ip)
+
+    def __len__(self):
+        return self.cliente.llamar("limitador.len")
+
+class ListaBloqueoRemota:
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def __contains__(self, ip):
+        return self.cliente.llamar("bloqueo.contiene", ip)
+
+    def add(self, valor):
+        return self.cliente.llamar("bloqueo.add", valor)
+
+    def discard(self, valor):
+        return self.cliente.llamar("bloqueo.discard", valor)
+
+    def __iter__(self):
+        return iter(self.cliente.llamar("bloqueo.lista"))
+
+    def __len__(self):
+        return self.cliente.llamar("bloqueo.len")
+
+class AgregadorRemoto:
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def resumen(self):
+        return self.cliente.llamar("agregador.resumen")
+
+    def totales(self):
+        return self.cliente.llamar("agregador.totales")
+
+class IndiceRemoto:
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def buscar(self, consulta, pagina=1, por_pagina=50):
+        return self.cliente.llamar("indice.buscar", consulta, pagina, por_pagina)
+
+class SesionadorRemoto:
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def sesiones(self, limite=20, ip=None):
+        return self.cliente.llamar("sesiones.top", limite, ip)
+
+class EscritorRemoto(EscritorLogs):
+    """Escritor de un trabajador: agrupa igual que EscritorLogs pero manda
+    cada lote al maestro en vez de escribir archivos."""
+
+    def __init__(self, cliente):
+        EscritorLogs.__init__(self)
+        self.cliente = cliente
+
+    def _al_arrancar(self):
+        pass
+
+    def _escribir_lote(self, lote):
+        if not lote:
+            return
+        try:
+            self.cliente.llamar("log.lote", [[ruta, registro] for ruta, registro in lote])
+            self.escritos += len(lote)
+        except Exception as e:
+            with self._lock:
+                self.descartados += len(lote)
+            print(f"[!] Error mandando logs al maestro: {e}", file=sys.stderr)
+
+def _enviar_metricas(cliente):
+    """Pasa al maestro lo que este trabajador contó desde el último envío: el
+    /metrics del maestro es el único que se raspa."""
+    try:
+        metricas.enviar_delta(lambda lote: cliente.llamar("metricas.lote", lote))
+    except Exception as e:
+        print(f"[!] Error mandando métricas al maestro: {e}", file=sys.stderr)
+
+def _proceso_trabajador(sockets, host, coordinador):
+    """Cuerpo de un trabajador después del fork. Nunca regresa."""
+    global log_writer, blocked_ips, limitador, agregador, indice_busqueda, sesionador
+    codigo = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C lo atiende el maestro
+        parar = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: parar.set())
+        coordinador.server.socket.close()
+        # nada de locks ni hilos heredados del maestro
+        _flujos.clear()
+        metricas.tras_fork()
+        cliente = ClienteCoordinador(coordinador.ruta)
+        log_writer = EscritorRemoto(cliente)
+        blocked_ips = ListaBloqueoRemota(cliente)
+        limitador = LimitadorRemoto(cliente)
+        agregador = AgregadorRemoto(cliente)
+        indice_busqueda = IndiceRemoto(cliente)
+        sesionador = SesionadorRemoto(cliente)
+        # lotes cortos: los eventos de varios trabajadores llegan casi en orden
+        config["log_lote_ms"] = min(config.get("log_lote_ms", 200), 20)
+        pool = ThreadPoolExecutor(max_workers=int(config.get("hilos_servidor", 32)), thread_name_prefix="http")
+        servidores = []
+        for puerto, sock in sockets.items():
+            srv = ServidorWSGIPool(host, puerto, app, pool, fd=sock.fileno())
+            threading.Thread(target=srv.serve_forever, daemon=True).start()
+            servidores.append(srv)
+        padre = os.getppid()
+        while not parar.wait(1):
+            if os.getppid() != padre:
+                break  # el maestro murió
+            _enviar_metricas(cliente)
+        for srv in servidores:
+            srv.shutdown()
+            srv.server_close()
+        pool.shutdown(wait=True)
+        _enviar_metricas(cliente)
+        log_writer.cerrar()
+    except Exception as e:
+        print(f"[!] Trabajador {os.getpid()} falló: {e}", file=sys.stderr)
+        codigo = 1
+    finally:
+        os._exit(codigo)
+
+def _proceso_vivo(pid):
+    try:
+        return os.waitpid(pid, os.WNOHANG) == (0, 0)
+    except ChildProcessError:
+        return False
+
+class GestorServidores:
+    """Levanta/detiene juntos todos los ``puertos_activos``.
+
+    Todos los listeners comparten el pool de ``hilos_servidor`` workers y,
+    como viven en el mismo proceso, el mismo limitador, lista de bloqueo y
+    escritor de logs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.hilos = {}
+        self.errores = {}
+        self.pool = None
+        # modo multiproceso
+        self.trabajadores = []
+        self.sockets = {}
+        self.coordinador = None
+
+    @property
+    def corriendo(self):
+        if self.trabajadores:
+            return any(_proceso_vivo(pid) for pid in self.trabajadores)
+        return any(t.running for t in self.hilos.values())
+
+    def iniciar(self, puertos=None, host=None):
+        host = host or config.get("host_servidor", "0.0.0.0")
+        puertos = puertos or config.get("puertos_activos", [8080])
+        n = int(config.get("trabajadores", 1))
+        if n > 1 and hasattr(os, "fork"):
+            return self._iniciar_prefork([int(p) for p in puertos], host, n)
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=int(config.get("hilos_servidor", 32)),
+                                           thread_name_prefix="http")
+        self.errores = {}
+        for puerto in puertos:
+            puerto = int(puerto)
+            if puerto in self.hilos and self.hilos[puerto].running:
+                continue
+            try:
+                t = ServerThread(self.app, host=host, port=puerto, pool=self.pool)
+            except OSError as e:
+                self.errores[puerto] = str(e)
+                print(f"[!] No se pudo abrir el puerto {puerto}: {e}")
+                continue
+            t.daemon = True
+            t.start()
+            self.hilos[puerto] = t
+        servidor_metricas.iniciar(set(self.hilos))
+        tarpit.iniciar(set(self.hilos))
+        advanced_log_data({"action": "server_start", "puertos": sorted(self.hilos),
+                           "errores": self.errores}, "SYSTEM")
+        return sorted(self.hilos)
+
+    def _iniciar_prefork(self, puertos, host, n):
+        if self.trabajadores:
+            return sorted(self.sockets)
+        self.errores = {}
+        familia = socket.AF_INET6 if ":" in host else socket.AF_INET
+        for puerto in puertos:
+            try:
+                self.sockets[puerto] = socket.create_server((host, puerto), family=familia, backlog=1024)
+            except OSError as e:
+                self.errores[puerto] = str(e)
+                print(f"[!] No se pudo abrir el puerto {puerto}: {e}")
+        if not self.sockets:
+            return []
+        ruta = config.get("coordinador_socket") or os.path.join(
+            tempfile.gettempdir(), f"queso_coordinador_{os.getpid()}.sock")
+        self.coordinador = Coordinador(ruta)
+        # el escritor en reposo al hacer fork (los hijos no heredan hilos)
+        log_writer.vaciar()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for _ in range(n):
+            pid = os.fork()
+            if pid == 0:
+                _proceso_trabajador(self.sockets, host, self.coordinador)
+            self.trabajadores.append(pid)
+        self.coordinador.iniciar()
+        servidor_metricas.iniciar(set(self.sockets))
+        tarpit.iniciar(set(self.sockets))
+        print(f"[+] {n} trabajadores (pids {', '.join(map(str, self.trabajadores))}) atendiendo "
+              f"{', '.join(f'http://{host}:{p}' for p in sorted(self.sockets))}")
+        advanced_log_data({"action": "server_start", "puertos": sorted(self.sockets),
+                           "trabajadores": self.trabajadores, "errores": self.errores}, "SYSTEM")
+        return sorted(self.sockets)
+
+    def _detener_prefork(self):
+        for pid in self.trabajadores:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        limite = time.monotonic() + 10
+        pendientes = list(self.trabajadores)
+        while pendientes and time.monotonic() < limite:
+            pendientes = [pid for pid in pendientes if _proceso_vivo(pid)]
+            time.sleep(0.05)
+        for pid in pendientes:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        for sock in self.sockets.values():
+            sock.close()
+        # hasta que salieron los trabajadores: mandan sus últimos logs al coordinador
+        self.coordinador.detener()
+        servidor_metricas.detener()
+        tarpit.detener()
+        advanced_log_data({"action": "server_stop", "puertos": sorted(self.sockets),
+                           "trabajadores": self.trabajadores}, "SYSTEM")
+        self.trabajadores, self.sockets, self.coordinador = [], {}, None
+        log_writer.vaciar()
+
+    def detener(self):
+        if self.trabajadores:
+            return self._detener_prefork()
+        for t in self.hilos.values():
+            if t.running:
+                t.server.shutdown()
+                t.server.server_close()
+        for t in self.hilos.values():
+            t.join(timeout=5)
+        if self.pool is not None:
+            # deja terminar las peticiones en curso
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        servidor_metricas.detener()
+        tarpit.detener()
+        advanced_log_data({"action": "server_stop", "puertos": sorted(self.hilos)}, "SYSTEM")
+        self.hilos = {}
+        log_writer.vaciar()
+
+    def estado(self):
+        if self.trabajadores:
+            # los contadores viven en cada trabajador; aquí solo cuántos siguen vivos
+            vivos = sum(1 for pid in self.trabajadores if _proceso_vivo(pid))
+            res = [{"puerto": p, "activo": vivos > 0, "trabajadores": vivos, "conexiones": "-",
+                    "conexiones_activas": "-", "peticiones": "-"} for p in sorted(self.sockets)]
+            res.extend({"puerto": p, "activo": False, "error": e} for p, e in sorted(self.errores.items()))
+            return res
+        res = [t.estado() for _, t in sorted(self.hilos.items())]
+        res.extend({"puerto": p, "activo": False, "error": e} for p, e in sorted(self.errores.items()))
+        return res
+
+    def imprimir_estado(self):
+        filas = self.estado()
+        if not filas:
+            print("[!] No hay listeners levantados.")
+            return
+        print(f"{'Puerto':>7}  {'Estado':<10} {'Conexiones':>10} {'Activas':>8} {'Peticiones':>10}")
+        for f in filas:
+            if "error" in f:
+                print(f"{f['puerto']:>7}  {'ERROR':<10} {f['error']}")
+            else:
+                est = "activo" if f["activo"] else "detenido"
+                print(f"{f['puerto']:>7}  {est:<10} {f['conexiones']:>10} {f['conexiones_activas']:>8} {f['peticiones']:>10}")
+        if self.trabajadores:
+            print(f"[*] Modo multiproceso: {filas[0].get('trabajadores', 0)}/{len(self.trabajadores)} trabajadores vivos")
+
+gestor_servidores = GestorServidores(app)
+
 # ---------------------------
 # Menú interactivo (mexicanizado)
 # ---------------------------
@@ -501,79 +5070,87 @@ def mostrar_menu():
     print("5) 🚫 Gestionar IPs bloqueadas")
     print("6) ⚙️  Configuración rápida")
     print("7) 🧹 Limpiar logs")
-    print("8) 📤 Exportar datos (JSON)")
+    print("8) 📤 Exportar datos (NDJSON/CSV)")
     print("9) 🔧 Configurar puertos activos")
     print("10) 🎯 Ver datos capturados (últimas líneas)")
     print("11) 🔍 Buscar en logs")
     print("12) 📱 URL del panel web (admin falso)")
+    print("13) 📡 Seguir ataques en vivo (tail -f)")
+    print("14) 🧭 Sesiones de atacantes (top)")
     print("0) 🚪 Salir")
     print("="*60)
 
 def main_menu():
-    server_thread = None
     while True:
         mostrar_menu()
         choice = input("¿Qué quieres hacer? (elige número) » ").strip()
         if choice == "1":
             url = input("Pon la URL a clonar (ej. https://example.com): ").strip()
             if url:
-                clone_site(url)
+                clone_site(url, progreso=lambda hechas, total, u: print(f"    [{hechas}/{total}] {u}"))
             else:
                 print("[!] URL inválida, órale intenta otra vez.")
             input("Presiona ENTER para continuar...")
         elif choice == "2":
-            if server_thread and server_thread.running:
+            if gestor_servidores.corriendo:
+                gestor_servidores.imprimir_estado()
                 print("[*] Deteniendo el honeypot...")
-                server_thread.shutdown()
-                server_thread.join(timeout=5)
-                server_thread = None
+                gestor_servidores.detener()
                 print("[OK] Honeypot detenido.")
             else:
-                puerto = input(f"Puerto para el servidor [{config.get('puertos_activos',[8080])[0]}]: ").strip()
+                defecto = ",".join(str(p) for p in config.get('puertos_activos', [8080]))
+                puertos = input(f"Puertos para el servidor [{defecto}]: ").strip()
                 try:
-                    puerto = int(puerto) if puerto else int(config.get('puertos_activos',[8080])[0])
+                    puertos = [int(x.strip()) for x in puertos.split(",") if x.strip()] if puertos else None
                 except Exception:
-                    puerto = int(config.get('puertos_activos',[8080])[0])
-                server_thread = ServerThread(app, host='0.0.0.0', port=puerto)
-                server_thread.daemon = True
-                server_thread.start()
+                    puertos = None
+                gestor_servidores.iniciar(puertos)
                 time.sleep(0.5)
+                gestor_servidores.imprimir_estado()
             input("Presiona ENTER para continuar...")
         elif choice == "3":
-            stats = analyze_logs()
+            log_writer.vaciar()
+            stats = agregador.resumen()
             print("\n--- Estadísticas rápidas ---")
             print(f"Entradas totales: {stats.get('total_entries')}")
-            print(f"IPs únicas: {stats.get('unique_ips')}")
+            if stats.get("aproximado"):
+                error = stats["aproximado"]["error_relativo_unicos"]
+                print(f"IPs únicas: ~{stats.get('unique_ips')} (±{error:.1%} típico, modo aproximado)")
+            else:
+                print(f"IPs únicas: {stats.get('unique_ips')}")
             print(f"IP más activa: {stats.get('most_active_ip')} ({stats.get('most_active_ip_count')})")
             print(f"IPs bloqueadas: {len(blocked_ips)}")
             input("\nENTER para seguir...")
         elif choice == "4":
-            data = analyze_logs()
+            log_writer.vaciar()
+            data = agregador.resumen()
             print("\n--- Análisis detallado ---")
             print(json.dumps(data, indent=2, ensure_ascii=False))
             input("\nENTER para seguir...")
         elif choice == "5":
             print("\nGestión de IPs bloqueadas:")
             print("a) Listar")
-            print("b) Bloquear IP")
-            print("c) Desbloquear IP")
+            print("b) Bloquear IP o rango (ej. 10.0.0.0/16, 2001:db8::/32)")
+            print("c) Desbloquear IP o rango")
             sub = input("Elige a/b/c » ").strip().lower()
             if sub == "a":
-                print(json.dumps(list(blocked_ips), ensure_ascii=False, indent=2))
+                print(json.dumps(sorted(blocked_ips), ensure_ascii=False, indent=2))
             elif sub == "b":
-                ip = input("IP a bloquear: ").strip()
-                if ip:
+                ip = input("IP o rango a bloquear: ").strip()
+                if ip and ListaBloqueo.normalizar(ip)[1] is None:
+                    print(f"[!] {ip} no es una IP ni un rango CIDR válido.")
+                elif ip:
                     blocked_ips.add(ip)
-                    guardar_ips_bloqueadas(blocked_ips)
                     advanced_log_data({"action": "manual_block", "ip": ip}, "ADMIN")
-                    print(f"[OK] IP {ip} bloqueada.")
+                    print(f"[OK] {ListaBloqueo.normalizar(ip)[0]} bloqueada.")
             elif sub == "c":
-                ip = input("IP a desbloquear: ").strip()
+                ip = input("IP o rango a desbloquear: ").strip()
                 if ip:
-                    blocked_ips.discard(ip)
-                    guardar_ips_bloqueadas(blocked_ips)
-                    advanced_log_data({"action": "manual_unblock", "ip": ip}, "ADMIN")
-                    print(f"[OK] IP {ip} desbloqueada.")
+                    if blocked_ips.discard(ip):
+                        advanced_log_data({"action": "manual_unblock", "ip": ip}, "ADMIN")
+                        print(f"[OK] {ListaBloqueo.normalizar(ip)[0]} desbloqueada.")
+                    else:
+                        print(f"[!] {ip} no estaba en la lista.")
             input("ENTER para seguir...")
         elif choice == "6":
             print("\nConfiguración rápida:")
@@ -588,26 +5165,20 @@ def main_menu():
                     print("[!] Valor inválido.")
             input("ENTER para seguir...")
         elif choice == "7":
-            open(LOG_FILE, "w").close()
+            log_writer.truncar(LOG_FILE, lambda: [c.reiniciar() for c in consumidores_log])
             advanced_log_data("Logs limpiados manualmente", "ADMIN")
             print("[OK] Logs limpiados.")
             input("ENTER para seguir...")
         elif choice == "8":
+            formato = input("Formato (ndjson/csv, default ndjson) » ").strip().lower() or "ndjson"
+            comprimir = input("¿Comprimir con gzip? (s/N) » ").strip().lower() == "s"
+            desde = input("Desde (YYYY-MM-DD[THH:MM], vacío = todo) » ").strip() or None
+            hasta = input("Hasta (YYYY-MM-DD[THH:MM], vacío = todo) » ").strip() or None
+            tipos = [t.strip() for t in input("Tipos separados por comas (vacío = todos) » ").split(",") if t.strip()]
             try:
-                raw = []
-                with open(LOG_FILE, "r", encoding="utf-8") as f:
-                    raw = f.readlines()
-                export = {
-                    "export_timestamp": datetime.now().isoformat(),
-                    "analysis": analyze_logs(),
-                    "raw_logs": raw,
-                    "blocked_ips": list(blocked_ips),
-                    "config": config
-                }
-                fname = f"export_honeypot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                with open(fname, "w", encoding="utf-8") as ef:
-                    json.dump(export, ef, indent=2, ensure_ascii=False)
-                print(f"[OK] Exportado a {fname}")
+                res = exportar_logs(formato, comprimir, desde, hasta, tipos or None)
+                print(f"[OK] Exportado a {res['archivo']}: {res['registros']} registros en {res['segundos']} s "
+                      f"({res['registros_por_seg']} reg/s, {res['mb_por_seg']} MB/s)")
             except Exception as e:
                 print(f"[!] Error exportando: {e}")
             input("ENTER para seguir...")
@@ -624,59 +5195,251 @@ def main_menu():
             input("ENTER para seguir...")
         elif choice == "10":
             try:
-                with open(CAPTURED_DATA_FILE, "r", encoding="utf-8") as f:
-                    lines = f.readlines()
                 n = input("Cuántas líneas mostrar (default 20) » ").strip()
                 try:
                     n = int(n) if n else 20
                 except Exception:
                     n = 20
-                tail = lines[-n:]
+                log_writer.vaciar()
+                tail = paginar_flujo(CAPTURED_DATA_FILE, max(n, 1))["captured"]
                 print("".join(tail) if tail else "[vacío]")
             except Exception as e:
                 print(f"[!] Error leyendo captured data: {e}")
             input("ENTER para seguir...")
         elif choice == "11":
+            print("Filtros: ip:1.2.3.4 type:CREDENTIALS ua:sqlmap tag:sqli desde:2024-05-01 hasta:2024-05-02 palabra*")
             q = input("Consulta a buscar en logs » ").strip()
             if q:
                 try:
-                    with open(LOG_FILE, "r", encoding="utf-8") as f:
-                        lines = f.readlines()
-                    res = [l for l in lines if q.lower() in l.lower()]
-                    print(f"[+] {len(res)} resultados encontrados:")
-                    for r in res[-50:]:
-                        print(r.strip())
+                    log_writer.vaciar()
+                    pagina = 1
+                    while True:
+                        res = indice_busqueda.buscar(q, pagina, 20)
+                        if pagina == 1:
+                            print(f"[+] {res['total']} resultados encontrados:")
+                        for r in res["resultados"]:
+                            print(json.dumps(r, ensure_ascii=False))
+                        if len(res["resultados"]) < 20 or input("¿Más? (s/N) » ").strip().lower() != "s":
+                            break
+                        pagina += 1
                 except Exception as e:
                     print(f"[!] Error buscando: {e}")
             input("ENTER para seguir...")
         elif choice == "12":
-            puerto_default = config.get("puertos_activos", [8080])[0]
-            print(f"Panel admin (falso): http://127.0.0.1:{puerto_default}/admin_panel")
-            if not any(threading.enumerate()) or not any(isinstance(t, ServerThread) and t.running for t in threading.enumerate()):
+            activos = [f["puerto"] for f in gestor_servidores.estado() if f.get("activo")]
+            for puerto in activos or config.get("puertos_activos", [8080])[:1]:
+                print(f"Panel admin (falso): http://127.0.0.1:{puerto}/admin_panel")
+            gestor_servidores.imprimir_estado()
+            if servidor_metricas.url:
+                print(f"Métricas (solo admin): {servidor_metricas.url}")
+                print("    mismo puerto: /eventos, /buscar?q=, /sesiones")
+            if tarpit.activo:
+                print(f"Tarpit: {len(tarpit.conexiones)} conexiones atrapadas, "
+                      f"{tarpit.segundos_total:.0f} s perdidos por {tarpit.atendidas} ya cerradas")
+                for ip, conexiones, segundos in tarpit.top(5):
+                    print(f"    {ip:<16} {conexiones:>5} conexiones  {segundos:>9.1f} s")
+            if not activos:
                 print("[!] Oye, el servidor no parece estar corriendo. Inicia con opción 2 primero.")
             input("ENTER para seguir...")
+        elif choice == "13":
+            tipos = [t.strip() for t in input("Tipos separados por comas (vacío = todos) » ").split(",") if t.strip()]
+            ip = input("IP (o prefijo con *, vacío = todas) » ").strip()
+            sub = difusor_eventos.suscribir(tipos, ip)
+            if sub is None:
+                print("[!] Demasiados espectadores en vivo ahorita.")
+            else:
+                print("[*] Siguiendo eventos... Ctrl+C para regresar al menú.")
+                try:
+                    while not sub.cerrada:
+                        for j in sub.esperar(1):
+                            print(linea_en_vivo(j))
+                        if sub.perdidos:
+                            print(f"[!] {sub.perdidos} eventos perdidos (no se alcanzó a imprimir)")
+                            sub.perdidos = 0
+                except KeyboardInterrupt:
+                    print()
+                finally:
+                    difusor_eventos.desuscribir(sub)
+        elif choice == "14":
+            ip = input("IP (vacío = top general) » ").strip() or None
+            try:
+                log_writer.vaciar()
+                res = sesionador.sesiones(20, ip)
+                print(f"[+] {res['abiertas']} abiertas, {res['cerradas']} cerradas")
+                for i, x in enumerate(res["sesiones"], 1):
+                    estado = "abierta" if x["abierta"] else x.get("cierre", "")
+                    print(f"{i:>2}) {x['ip']:<16} {x['eventos']:>6} ev  {x['duracion_seg']:>8.0f}s  "
+                          f"cred={x['credenciales']} teclas={x['teclas']} bloq={x['bloqueos']}  "
+                          f"{x['inicio'][:19]}  [{estado}]  {x['user_agent'][:40]}")
+                elegida = input("Número para ver el recorrido (ENTER = regresar) » ").strip()
+                if elegida.isdigit() and 1 <= int(elegida) <= len(res["sesiones"]):
+                    x = res["sesiones"][int(elegida) - 1]
+                    for ts, tipo, detalle in x["pasos"]:
+                        print(f"  {ts[:19]}  {tipo:<12} {detalle}")
+                    if x["pasos_omitidos"]:
+                        print(f"  ... y {x['pasos_omitidos']} eventos más")
+            except Exception as e:
+                print(f"[!] Error leyendo sesiones: {e}")
+            input("ENTER para seguir...")
         elif choice == "0":
             print("Sale pues — cerrando todo.")
-            # Detener servidor si está corriendo
-            for t in threading.enumerate():
-                if isinstance(t, ServerThread) and t.running:
-                    t.shutdown()
-                    t.join(timeout=3)
+            # Detener servidores si están corriendo
+            if gestor_servidores.corriendo:
+                gestor_servidores.detener()
+            log_writer.cerrar()
+            if log_writer.descartados:
+                print(f"[!] Se descartaron {log_writer.descartados} registros por cola llena.")
             print("Nos vemos, Héctor.")
             sys.exit(0)
         else:
             print("[!] Opción no válida, intenta otra vez.")
             time.sleep(0.3)
 
+# ---------------------------
+# Línea de comandos (modo demonio)
+# ---------------------------
+def sd_notify(estado):
+    """Manda ``estado`` (p. ej. "READY=1") a systemd por $NOTIFY_SOCKET.
+    Sin systemd (o con Type=simple) no hace nada."""
+    destino = os.environ.get("NOTIFY_SOCKET")
+    if not destino:
+        return False
+    if destino.startswith("@"):
+        destino = "\0" + destino[1:]  # socket abstracto
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            s.setblocking(False)  # si el receptor no lee, se pierde el aviso pero no se traba
+            s.connect(destino)
+            s.sendall(estado.encode("utf-8"))
+        return True
+    except OSError:
+        return False
+
+def main_serve(args):
+    """Honeypot sin menú: levanta los listeners, avisa que está listo y en
+    SIGTERM/SIGINT deja de aceptar, termina las peticiones en curso y vacía
+    los logs antes de salir."""
+    if args.host:
+        config["host_servidor"] = args.host
+    if args.puertos:
+        config["puertos_activos"] = args.puertos
+    if args.trabajadores:
+        config["trabajadores"] = args.trabajadores
+    if args.metricas_puerto is not None:
+        config["metricas_puerto"] = args.metricas_puerto
+    inicializar_archivos()
+    parar = threading.Event()
+    for sen in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sen, lambda *_: parar.set())
+    puertos = gestor_servidores.iniciar()
+    if not puertos:
+        print("[!] No se pudo abrir ningún puerto.", file=sys.stderr)
+        return 1
+    listo_ms = (time.monotonic() - _T_ARRANQUE) * 1000
+    sd_notify(f"READY=1\nMAINPID={os.getpid()}\nSTATUS=Atendiendo puertos {','.join(map(str, puertos))}")
+    print(f"[+] Listo en {listo_ms:.0f} ms: puertos {', '.join(map(str, puertos))} (SIGTERM para detener)", flush=True)
+    # WatchdogSec= de systemd: latido a la mitad del plazo
+    latido = int(os.environ.get("WATCHDOG_USEC", 0) or 0) / 2e6
+    while not parar.wait(min(latido, 1) if latido else 1):
+        if latido:
+            sd_notify("WATCHDOG=1")
+        if not gestor_servidores.corriendo:
+            print("[!] Los listeners se cayeron, saliendo.", file=sys.stderr)
+            break
+    sd_notify("STOPPING=1")
+    print("[*] Deteniendo: terminando peticiones en curso y vaciando logs...", flush=True)
+    gestor_servidores.detener()
+    log_writer.cerrar()
+    if log_writer.descartados:
+        print(f"[!] Se descartaron {log_writer.descartados} registros por cola llena.", file=sys.stderr)
+    return 0 if parar.is_set() else 1
+
+def main_clone(args):
+    if args.niveles is not None:
+        config["niveles_profundidad"] = args.niveles
+    inicializar_archivos()
+    progreso = None if args.silencioso else (lambda hechas, total, u: print(f"    [{hechas}/{total}] {u}"))
+    ok = clone_site(args.url, progreso=progreso)
+    log_writer.cerrar()
+    return 0 if ok else 1
+
+def main_stats(args):
+    log_writer.vaciar()
+    datos = analyze_logs(aproximado=True) if args.aproximado else agregador.resumen()
+    print(json.dumps(datos, indent=2, ensure_ascii=False))
+    return 0
+
+def main_export(args):
+    log_writer.vaciar()
+    tipos = [t.strip() for t in (args.tipos or "").split(",") if t.strip()]
+    try:
+        res = exportar_logs(args.formato, args.gzip, args.desde, args.hasta, tipos or None, args.destino)
+    except Exception as e:
+        print(f"[!] Error exportando: {e}", file=sys.stderr)
+        return 1
+    print(f"[OK] Exportado a {res['archivo']}: {res['registros']} registros en {res['segundos']} s "
+          f"({res['registros_por_seg']} reg/s, {res['mb_por_seg']} MB/s)")
+    return 0
+
+def _lista_puertos(texto):
+    return [int(x) for x in texto.split(",") if x.strip()]
+
+def main_cli(argv):
+    """Subcomandos no interactivos; sin argumentos se abre el menú."""
+    comun = argparse.ArgumentParser(add_help=False)
+    comun.add_argument("--config", help=f"archivo de config (default {CONFIG_FILE})")
+    parser = argparse.ArgumentParser(prog="queso_plus.py", description="Queso Honeypot (sin argumentos: menú)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p = sub.add_parser("serve", parents=[comun], help="honeypot en primer plano (systemd/contenedores)")
+    p.add_argument("--host", help="interfaz (default host_servidor)")
+    p.add_argument("--puertos", type=_lista_puertos, help="ej. 8080,9000 (default puertos_activos)")
+    p.add_argument("--trabajadores", type=int, help="procesos (default trabajadores)")
+    p.add_argument("--metricas-puerto", type=int, help="puerto de /metrics, 0 = apagado")
+    p.set_defaults(funcion=main_serve)
+    p = sub.add_parser("clone", parents=[comun], help="clonar un sitio a " + CLONE_DIR)
+    p.add_argument("url")
+    p.add_argument("--niveles", type=int, help="profundidad (default niveles_profundidad)")
+    p.add_argument("--silencioso", action="store_true")
+    p.set_defaults(funcion=main_clone)
+    p = sub.add_parser("stats", parents=[comun], help="resumen de los logs en JSON")
+    p.add_argument("--aproximado", action="store_true", help="bosquejos en vez de conteo exacto")
+    p.set_defaults(funcion=main_stats)
+    p = sub.add_parser("export", parents=[comun], help="exportar logs a NDJSON/CSV")
+    p.add_argument("--formato", choices=["ndjson", "csv"], default="ndjson")
+    p.add_argument("--gzip", action="store_true")
+    p.add_argument("--desde", help="YYYY-MM-DD[THH:MM]")
+    p.add_argument("--hasta", help="YYYY-MM-DD[THH:MM]")
+    p.add_argument("--tipos", help="tipos separados por comas")
+    p.add_argument("--destino", help="archivo de salida")
+    p.set_defaults(funcion=main_export)
+    p = sub.add_parser("leer", help="segmentos .qlog a JSON por stdout")
+    p.add_argument("archivos", nargs="+")
+    p.set_defaults(funcion=lambda a: main_qlog(["leer", *a.archivos]))
+    p = sub.add_parser("compactar", help="log JSON a .qlog")
+    p.add_argument("origen")
+    p.add_argument("destino")
+    p.set_defaults(funcion=lambda a: main_qlog(["compactar", a.origen, a.destino]))
+    p = sub.add_parser("bosquejo", help="bosquejo aproximado de los logs")
+    p.add_argument("salida", nargs="?")
+    p.set_defaults(funcion=lambda a: main_bosquejos(["bosquejo"] + ([a.salida] if a.salida else [])))
+    p = sub.add_parser("fusionar", help="resumen de varios bosquejos")
+    p.add_argument("bosquejos", nargs="+")
+    p.set_defaults(funcion=lambda a: main_bosquejos(["fusionar", *a.bosquejos]))
+    args = parser.parse_args(argv)
+    if getattr(args, "config", None) and not os.path.isfile(args.config):
+        parser.error(f"no existe {args.config}")
+    inicializar(getattr(args, "config", None))
+    return args.funcion(args)
+
 # ---------------------------
 # MAIN
 # ---------------------------
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main_cli(sys.argv[1:]))
     print(BANNER)
+    inicializar()
     inicializar_archivos()
-    # asegurar config actualizada
-    config = cargar_config()
-    blocked_ips = cargar_ips_bloqueadas()
     try:
         main_menu()
     except KeyboardInterrupt:
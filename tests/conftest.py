@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# queso_plus crea sus archivos (config, logs, lista de bloqueo) en el
+# directorio actual: las pruebas corren en uno temporal
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+DIR_PRUEBAS = tempfile.mkdtemp(prefix="queso_pruebas_")
+os.chdir(DIR_PRUEBAS)
+
+
+def pytest_unconfigure(config):
+    # pytest regresa al directorio original antes de los atexit de queso_plus
+    os.chdir(DIR_PRUEBAS)
+
+
+@pytest.fixture(scope="session")
+def qp():
+    import queso_plus
+    return queso_plus
+
+
+@pytest.fixture
+def registros(qp):
+    """Lee los registros escritos en LOG_FILE desde el inicio de la prueba."""
+    qp.log_writer.vaciar()
+    inicio = os.path.getsize(qp.LOG_FILE) if os.path.exists(qp.LOG_FILE) else 0
+
+    def leer():
+        import json
+        qp.log_writer.vaciar()
+        with open(qp.LOG_FILE, "rb") as f:
+            f.seek(inicio)
+            return [json.loads(linea) for linea in f if linea.strip()]
+    return leer
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+from werkzeug.http import http_date
+
+
+@pytest.fixture
+def cliente(tmp_path):
+    import queso
+    queso.CLONE_DIR = str(tmp_path)
+    queso.LOG_FILE = str(tmp_path / "honeypot.log")
+    ruta = tmp_path / "index.html"
+    ruta.write_text("<html><body>hola</body></html>")
+    os.utime(ruta, (1_700_000_000.75, 1_700_000_000.75))
+    queso.invalidate_pages()
+    return queso.app.test_client()
+
+
+def test_post_nunca_devuelve_304(cliente):
+    etag = cliente.get("/").headers["ETag"]
+    r = cliente.post("/", data={"username": "a"}, headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert b"hola" in r.data
+    assert cliente.get("/", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_if_modified_since_compara_fechas(cliente):
+    assert cliente.get("/", headers={"If-Modified-Since": http_date(1_700_000_000)}).status_code == 304
+    assert cliente.get("/", headers={"If-Modified-Since": http_date(1_700_000_100)}).status_code == 304
+    assert cliente.get("/", headers={"If-Modified-Since": http_date(1_699_999_999)}).status_code == 200
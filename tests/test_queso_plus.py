@@ -0,0 +1,475 @@
+import itertools
+
+_ips = (f"10.77.{i // 250}.{i % 250 + 1}" for i in itertools.count())
+
+
+def _cliente(qp):
+    # IP distinta por prueba para no tocar el rate limit
+    return qp.app.test_client(), {"REMOTE_ADDR": next(_ips)}
+
+
+def test_credenciales_etiquetadas_un_solo_registro(qp, registros):
+    c, env = _cliente(qp)
+    r = c.post("/capturar_credenciales", data={"usuario": "admin' OR '1'='1", "password": "x"},
+               environ_base=env)
+    assert r.status_code == 200
+    propios = [j for j in registros() if j["ip"] == env["REMOTE_ADDR"]]
+    assert [j["type"] for j in propios] == ["CREDENTIALS"]
+    assert "sqli" in propios[0]["tags"]
+
+
+def test_peticion_etiquetada_sin_registro_de_ruta_queda_como_attack(qp, registros):
+    c, env = _cliente(qp)
+    c.get("/stats?id=1 union select password from usuarios", environ_base=env)
+    propios = [j for j in registros() if j["ip"] == env["REMOTE_ADDR"]]
+    assert [j["type"] for j in propios] == ["ATTACK"]
+
+
+def test_log_teclas_no_revienta_con_json_escalar(qp):
+    c, env = _cliente(qp)
+    for cuerpo in ('"hola"', "5", "true", "null", "no es json", '{"teclas": "x"}'):
+        r = c.post("/log_teclas_lote", data=cuerpo, content_type="application/json", environ_base=env)
+        assert r.status_code == 200, cuerpo
+
+
+def test_conexiones_ociosas_no_agotan_el_pool(qp):
+    import socket
+    import time
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+
+    n = 4
+    qp.config["timeout_conexion_seg"] = 0.5
+    pool = ThreadPoolExecutor(max_workers=n)
+    srv = qp.ServidorWSGIPool("127.0.0.1", 0, qp.app, pool)
+    hilo = qp.threading.Thread(target=srv.serve_forever, daemon=True)
+    hilo.start()
+    ociosas = []
+    try:
+        # n clientes que conectan y no mandan nada ocupan los n workers
+        for _ in range(n):
+            ociosas.append(socket.create_connection(("127.0.0.1", srv.server_port)))
+        time.sleep(0.1)
+        t0 = time.monotonic()
+        conn = http.client.HTTPConnection("127.0.0.1", srv.server_port, timeout=5)
+        conn.request("GET", "/admin", headers={"X-Forwarded-For": "10.78.0.1"})
+        assert conn.getresponse().status == 200
+        assert time.monotonic() - t0 < 3
+        conn.close()
+    finally:
+        qp.config["timeout_conexion_seg"] = 10
+        for s in ociosas:
+            s.close()
+        srv.shutdown()
+        srv.server_close()
+        pool.shutdown(wait=True)
+
+
+def test_stats_no_recalcula_los_top(qp, monkeypatch):
+    c, env = _cliente(qp)
+    llamadas = []
+    original = qp.agregador.estado.__class__.resumen
+    monkeypatch.setattr(qp.agregador.estado.__class__, "resumen",
+                        lambda self: llamadas.append(1) or original(self))
+    qp.agregador.resumen()  # deja la caché armada
+    llamadas.clear()
+    monkeypatch.setitem(qp.config, "analisis_resumen_seg", 3600)
+    for i in range(3):
+        qp.advanced_log_data({"i": i}, "INFO")
+        qp.log_writer.vaciar()
+        antes = qp.agregador.totales()["total_entries"]
+        assert c.get("/stats", environ_base=env).get_json()["total_entries"] >= antes
+        assert c.get("/analysis", environ_base=env).get_json()["total_entries"] >= antes
+    assert llamadas == []
+    monkeypatch.setitem(qp.config, "analisis_resumen_seg", 0)
+    qp.advanced_log_data({"i": "x"}, "INFO")
+    qp.log_writer.vaciar()
+    c.get("/analysis", environ_base=env)
+    assert llamadas == [1]
+
+
+def test_config_se_lee_en_inicializar_y_el_escritor_la_respeta(qp, tmp_path, monkeypatch):
+    import json
+    import os
+    # importar no escribe ni lee la config
+    assert not os.path.exists(qp.CONFIG_FILE)
+    ruta = tmp_path / "otra.json"
+    ruta.write_text(json.dumps({"log_cola_max": 7}))
+    monkeypatch.setattr(qp, "CONFIG_FILE", qp.CONFIG_FILE)
+    respaldo = dict(qp.config)
+    try:
+        qp.inicializar(str(ruta))
+        assert qp.config["log_cola_max"] == 7
+        escritor = qp.EscritorLogs()
+        escritor.encolar(str(tmp_path / "x.log"), "hola")
+        assert escritor.cola.maxsize == 7
+        escritor.cerrar()
+    finally:
+        qp.config.clear()
+        qp.config.update(respaldo)
+
+
+def test_truncar_log_reinicia_offsets_del_escritor(qp, monkeypatch):
+    lotes = []
+    oyente = lambda eventos, inicio, fin: lotes.append((inicio, fin))
+    qp.log_writer.suscribir(oyente)
+    monkeypatch.setattr(qp.log_writer, "_oyentes", qp.log_writer._oyentes[:-1] + [oyente])
+    # segmentos rotados: la base lógica del archivo activo queda > 0
+    monkeypatch.setitem(qp.config, "rotacion_max_mb", 0.0001)
+    for i in range(5):
+        qp.advanced_log_data({"relleno": "x" * 200, "i": i}, "INFO")
+        qp.log_writer.vaciar()
+    assert qp.flujo(qp.LOG_FILE).base() > 0
+    monkeypatch.setitem(qp.config, "rotacion_max_mb", 64)
+    # el escritor vuelve a abrir el activo con esa base
+    qp.advanced_log_data({"antes": True}, "INFO")
+    qp.log_writer.vaciar()
+    assert qp.log_writer.truncar(qp.LOG_FILE, lambda: [c.reiniciar() for c in qp.consumidores_log])
+    lotes.clear()
+    qp.advanced_log_data({"despues": True}, "INFO")
+    qp.log_writer.vaciar()
+    import os
+    assert lotes == [(0, os.path.getsize(qp.LOG_FILE))]
+    assert qp.agregador.totales()["total_entries"] == 1
+    assert qp.indice_busqueda.buscar("data:despues")["total"] == 1
+
+
+def test_lista_bloqueo_rechaza_entradas_invalidas(qp, tmp_path, monkeypatch):
+    import json
+    journal = []
+    monkeypatch.setattr(qp.log_writer, "encolar", lambda ruta, registro, **kw: journal.append(registro))
+    lista = qp.ListaBloqueo()
+    assert not lista.add("not an ip")
+    assert not lista.add("10.0.0.0/99")
+    assert "not an ip" not in lista and len(lista) == 0
+    assert journal == []
+    assert lista.add("10.1.0.0/16") and "10.1.2.3" in lista
+    assert [r["red"] for r in journal] == ["10.1.0.0/16"]
+    # archivos viejos con basura: se ignora al cargar
+    ruta = tmp_path / "bloq.json"
+    ruta.write_text(json.dumps(["1.2.3.4", "hola", "2001:db8::/32"]))
+    cargada = qp.ListaBloqueo().cargar(str(ruta), str(tmp_path / "no_existe.jsonl"))
+    assert sorted(cargada) == ["1.2.3.4", "2001:db8::/32"]
+
+
+def test_journal_de_bloqueo_no_se_descarta_con_la_cola_llena(qp, tmp_path, monkeypatch):
+    import json
+    import threading
+    monkeypatch.setitem(qp.config, "log_cola_max", 2)
+    monkeypatch.setitem(qp.config, "log_desbordamiento", "descartar")
+    escritor = qp.EscritorLogs()
+    monkeypatch.setattr(qp, "log_writer", escritor)
+    # el escritor se queda atorado en una tarea y la cola se llena
+    atorado, soltar = threading.Event(), threading.Event()
+    escritor.tarea(lambda: atorado.set() or soltar.wait())
+    assert atorado.wait(5)
+    otro = str(tmp_path / "otro.log")
+    while escritor.encolar(otro, "relleno"):
+        pass
+    assert escritor.descartados == 1
+    lista = qp.ListaBloqueo()
+    hilo = threading.Thread(target=lista.add, args=("10.99.0.7",))
+    hilo.start()
+    hilo.join(0.2)
+    assert hilo.is_alive()  # espera sitio en vez de descartar
+    soltar.set()
+    hilo.join(5)
+    assert escritor.vaciar()
+    escritor.cerrar()
+    with open(qp.BLOCKED_JOURNAL_FILE, encoding="utf-8") as f:
+        assert {"op": "+", "red": "10.99.0.7"}.items() <= json.loads(f.readlines()[-1]).items()
+    assert "10.99.0.7" in qp.ListaBloqueo().cargar()
+
+
+def test_cuerpo_grande_no_se_lee_entero(qp, monkeypatch):
+    import tracemalloc
+    c, env = _cliente(qp)
+    monkeypatch.setitem(qp.app.config, "MAX_CONTENT_LENGTH", 1024 * 1024)
+    # más que el límite: 413 sin leer el cuerpo
+    r = c.get("/admin/", data=b"x" * (2 * 1024 * 1024), environ_base=env)
+    assert r.status_code == 413
+    # por debajo del límite pero enorme para las firmas: solo se leen 8 KB
+    cuerpo = b"' or 1=1 -- " + b"x" * (900 * 1024)
+    tracemalloc.start()
+    r = c.get("/admin/", data=cuerpo, environ_base=env)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert r.status_code == 200
+    assert pico < 300 * 1024
+
+
+def test_ruta_sigue_viendo_el_cuerpo_completo(qp, registros):
+    import json
+    c, env = _cliente(qp)
+    teclas = [{"k": "a", "t": i, "c": "usuario"} for i in range(400)]
+    cuerpo = json.dumps({"pagina": "/login?' union select 1", "teclas": teclas})
+    assert len(cuerpo) > 8192
+    r = c.post("/log_teclas_lote", data=cuerpo, content_type="application/json", environ_base=env)
+    assert r.status_code == 200
+    propios = [j for j in registros() if j["ip"] == env["REMOTE_ADDR"]]
+    assert propios and all(j["type"] == "KEYLOGGER" for j in propios)
+    assert "sqli" in propios[0]["tags"]
+    assert sum(len(j["data"]["texto"]) for j in propios) == 400
+
+
+def test_formulario_enorme_se_recorta_para_las_firmas(qp):
+    datos = {f"campo{i}": "v" * 100 for i in range(500)}
+    with qp.app.test_request_context("/", method="POST", data=datos):
+        assert len(qp.superficie_peticion()["form"]) == 8192
+
+
+def test_trampa_clonada_usa_la_config_cargada(qp, tmp_path, monkeypatch):
+    import json
+    ruta = tmp_path / "cfg.json"
+    ruta.write_text(json.dumps({"teclas_lote_max": 7, "teclas_intervalo_ms": 1234}))
+    monkeypatch.setattr(qp, "CONFIG_FILE", qp.CONFIG_FILE)
+    respaldo = dict(qp.config)
+    try:
+        qp.inicializar(str(ruta))
+        trampa = qp.ClonadorSitio("http://ejemplo.test/").trampa
+        assert "MAX = 7," in trampa and "}, 1234);" in trampa
+    finally:
+        qp.config.clear()
+        qp.config.update(respaldo)
+
+
+def test_metricas_de_trabajador_llegan_al_maestro(qp, monkeypatch):
+    import json
+    import pytest
+    trabajador, maestro = qp.Metricas(), qp.Metricas()
+    for m in (trabajador, maestro):
+        m._definiciones = qp.metricas._definiciones
+    monkeypatch.setattr(qp, "metricas", maestro)
+    lotes = []
+
+    def enviar(lote):
+        # mismo camino que el socket del coordinador: JSON de ida y vuelta
+        lotes.append(lote)
+        qp.OPERACIONES_COORDINADOR["metricas.lote"](json.loads(json.dumps(lote)))
+
+    ruta = (("ruta", "/login"), ("metodo", "POST"), ("estado", "200"))
+    trabajador.incrementar("queso_http_peticiones_total", ruta, 3)
+    trabajador.observar("queso_http_latencia_segundos", 0.003, (("ruta", "/login"),))
+    trabajador.enviar_delta(enviar)
+    texto = maestro.exponer()
+    assert 'queso_http_peticiones_total{ruta="/login",metodo="POST",estado="200"} 3' in texto
+    assert 'queso_http_latencia_segundos_count{ruta="/login"} 1' in texto
+    # sin cambios no se manda nada; después, solo la diferencia
+    trabajador.enviar_delta(enviar)
+    assert len(lotes) == 1
+    trabajador.incrementar("queso_http_peticiones_total", ruta, 2)
+
+    def falla(lote):
+        raise OSError("maestro caído")
+    with pytest.raises(OSError):
+        trabajador.enviar_delta(falla)
+    trabajador.enviar_delta(enviar)  # lo que no salió va en el siguiente
+    assert lotes[-1] == [[["queso_http_peticiones_total", ruta, 2]], []]
+    assert 'estado="200"} 5' in maestro.exponer()
+
+
+def test_endpoints_del_operador_solo_en_el_listener_admin(qp):
+    from werkzeug.test import Client
+    c, env = _cliente(qp)
+    for ruta in ("/eventos", "/buscar?q=type:CREDENTIALS", "/sesiones"):
+        r = c.get(ruta, environ_base=env)
+        assert r.mimetype != "text/event-stream" and not r.is_json, ruta
+    admin = Client(qp.app_metricas)
+    assert "total" in admin.get("/buscar?q=type:CREDENTIALS").get_json()
+    assert isinstance(admin.get("/sesiones").get_json(), (list, dict))
+    r = admin.get("/eventos", buffered=False)
+    assert r.mimetype == "text/event-stream"
+    assert next(r.response).startswith(b"retry:")
+    r.close()
+    assert len(qp.difusor_eventos) == 0
+    assert "queso_http_peticiones_total" in admin.get("/metrics").get_data(as_text=True)
+
+
+def test_bosquejos_dentro_de_cota_contra_conteo_exacto(qp):
+    import random
+    from collections import Counter
+    rng = random.Random(22)
+    n, k = 50000, 200
+    flujo = [f"10.{i >> 8 & 255}.{i & 255}.1" for i in (int(rng.paretovariate(1.1)) % 40000 for _ in range(n))]
+    exacto = Counter(flujo)
+    mitades = (flujo[:n // 2], flujo[n // 2:])
+
+    hll, partes_hll = qp.HyperLogLog(14), [qp.HyperLogLog(14), qp.HyperLogLog(14)]
+    ss, partes_ss = qp.SpaceSaving(k), [qp.SpaceSaving(k), qp.SpaceSaving(k)]
+    for parte, h, s in zip(mitades, partes_hll, partes_ss):
+        for ip in parte:
+            hll.agregar(ip)
+            ss.agregar(ip)
+            h.agregar(ip)
+            s.agregar(ip)
+
+    # HyperLogLog: dentro de 3 errores típicos; fusionar = haber visto todo
+    error = abs(hll.estimar() - len(exacto)) / len(exacto)
+    assert error <= 3 * hll.error_relativo()
+    fusion = qp.HyperLogLog.desde_dict(partes_hll[0].a_dict())
+    fusion.fusionar(partes_hll[1])
+    assert fusion.registros == hll.registros
+
+    fusion_ss = qp.SpaceSaving.desde_dict(partes_ss[0].a_dict())
+    fusion_ss.fusionar(partes_ss[1])
+    for bosquejo in (ss, fusion_ss):
+        assert bosquejo.total == n
+        cota = bosquejo.error_maximo()
+        for ip, cuenta, err in bosquejo.top(k):
+            # nunca subestima y sobreestima a lo más su error (<= total/k)
+            assert exacto[ip] <= cuenta <= exacto[ip] + err
+            assert err <= cota
+        # todo lo que pasa de total/k está en el top, y los 10 reales también
+        presentes = {ip for ip, _, _ in bosquejo.top(k)}
+        assert {ip for ip, c in exacto.items() if c > cota} <= presentes
+        assert [ip for ip, _, _ in bosquejo.top(10)] == [ip for ip, _ in exacto.most_common(10)]
+
+
+def test_agregador_igual_a_reescaneo_completo(qp, tmp_path, monkeypatch):
+    monkeypatch.setitem(qp.config, "analisis_resumen_seg", 0)
+    monkeypatch.setitem(qp.config, "rotacion_max_mb", 0.002)
+
+    def escribir(desde, hasta):
+        for i in range(desde, hasta):
+            qp.advanced_log_data({"usuario": f"u{i % 7}", "pagina": f"/p{i % 5}"},
+                                 ("REQUEST", "ATTACK", "CREDENTIALS")[i % 3],
+                                 cliente=(f"10.80.{i % 3}.{i % 11}", f"agente-ñ/{i % 4}", ""))
+        qp.log_writer.vaciar()
+
+    escribir(0, 300)
+    assert len(list(qp.flujo(qp.LOG_FILE).archivos())) > 1  # cruzó segmentos rotados
+    assert qp.agregador.resumen() == qp.analyze_logs()
+    # desde un checkpoint: lo escrito después (con más rotaciones) se lee del flujo
+    ruta_estado = str(tmp_path / "estado.json")
+    otro = qp.AgregadorLogs(ruta_estado=ruta_estado)
+    otro.actualizar()
+    otro.guardar()
+    escribir(300, 600)
+    recargado = qp.AgregadorLogs(ruta_estado=ruta_estado)
+    assert recargado._cargar_checkpoint()[0] > 0
+    assert recargado.resumen() == qp.analyze_logs() == qp.agregador.resumen()
+
+
+def _lineas_de_log(qp, n, desde=0):
+    lineas = []
+    for i in range(desde, desde + n):
+        entrada = {"timestamp": f"2026-10-18T09:{i // 60 % 60:02d}:{i % 60:02d}" + (".000120" if i % 4 else ""),
+                   "type": ("REQUEST", "ATTACK", "KEYLOGGER")[i % 3], "ip": f"10.81.0.{i % 9}",
+                   "user_agent": ("Mozilla/5.0 (ñandú; 日本語)", "curl/8.0", "Bot \"raro\" \\ ☃")[i % 3],
+                   "referer": "Direct",
+                   "data": ({"path": f"/p{i % 4}", "usuario": "josé"}, f"texto {i}", [i, None])[i % 3]}
+        if i % 5 == 0:
+            entrada["tags"] = ["sqli", "xss"]
+        lineas.append(qp._formatear_evento(entrada).encode("utf-8"))
+    # lo que no se puede reproducir campo a campo va como línea cruda
+    lineas.append(b'{"type": "X", "timestamp": "2026-10-18T10:00:00"}\n')
+    lineas.append("2026-10-18 10:00:00 - texto plano ü - IP: 1.2.3.4\n".encode("utf-8"))
+    return lineas
+
+
+def test_qlog_ida_y_vuelta_identico_al_json(qp, tmp_path, capsysbinary):
+    segmentos = [_lineas_de_log(qp, 120), _lineas_de_log(qp, 60, desde=30)]
+    rutas = []
+    for i, lineas in enumerate(segmentos):
+        ruta = str(tmp_path / f"seg{i}.qlog")
+        with qp.EscritorQlog(open(ruta, "wb")) as out:
+            for linea in lineas:
+                out.write(linea)
+        assert out.eventos == len(lineas) - 2 and out.crudas == 2
+        # cada segmento arranca con su propio diccionario: se lee solo
+        assert min(out.ids.values()) == 0
+        with qp.LectorQlog(ruta) as f:
+            assert f.read() == b"".join(lineas)
+        rutas.append(ruta)
+    # el convertidor de línea de comandos concatena los segmentos tal cual
+    assert qp.main_qlog(["leer"] + rutas) == 0
+    assert capsysbinary.readouterr().out == b"".join(segmentos[0] + segmentos[1])
+
+
+def test_qlog_en_segmentos_rotados(qp, monkeypatch):
+    import time
+    monkeypatch.setitem(qp.config, "rotacion_compresion", "binario")
+    monkeypatch.setitem(qp.config, "rotacion_max_mb", 0.004)
+    escritas = []
+    oyente = lambda eventos, inicio, fin: escritas.extend(l for _, l in eventos)
+    monkeypatch.setattr(qp.log_writer, "_oyentes", qp.log_writer._oyentes + [oyente])
+    f = qp.flujo(qp.LOG_FILE)
+    qp.log_writer.vaciar()
+    inicio, antes = f.tamano(), len(f.segmentos())
+    for i in range(200):
+        qp.advanced_log_data({"pagina": f"/ñ{i % 6}", "i": i}, "KEYLOGGER",
+                             cliente=(f"10.82.0.{i % 5}", "Mozilla/5.0 (日本語; ñ)", "Direct"))
+        if i % 20 == 19:
+            qp.log_writer.vaciar()  # rota al cerrar cada lote
+    limite = time.monotonic() + 10
+    while time.monotonic() < limite and not all(s["comprimido"] for s in f.segmentos()[antes:]):
+        time.sleep(0.05)
+    nuevos = f.segmentos()[antes:]
+    assert len(nuevos) > 1 and all(s["comprimido"] for s in nuevos)
+    abiertos = list(f.archivos(inicio))
+    assert sum(isinstance(a, qp.LectorQlog) for _, a in abiertos) == len(nuevos)
+    for _, a in abiertos:
+        a.close()
+    assert b"".join(l for _, l in f.leer_desde(inicio)) == b"".join(escritas)
+
+
+def _veredictos(limitador, ip, tiempos):
+    return [limitador.verificar(ip, ahora=t) for t in tiempos]
+
+
+def test_limitador_ventana_deslizante_pondera_la_anterior(qp, monkeypatch):
+    monkeypatch.setitem(qp.config, "modo_rate_limit", "ventana_deslizante")
+    monkeypatch.setitem(qp.config, "max_peticiones_por_minuto", 10)
+    monkeypatch.setitem(qp.config, "umbral_bloqueo_automatico", 100)
+    lim, P, L = qp.LimitadorTasa(), qp.LimitadorTasa.PERMITIR, qp.LimitadorTasa.LIMITAR
+    assert _veredictos(lim, "ip", [60 + i for i in range(11)]) == [P] * 10 + [L]
+    # a media ventana siguiente, las 11 de antes pesan 5.5: caben 4 más
+    assert _veredictos(lim, "ip", [150] * 5) == [P] * 4 + [L]
+    # dos ventanas después la anterior ya no cuenta
+    assert _veredictos(lim, "ip", [300] * 11) == [P] * 10 + [L]
+
+
+def test_limitador_token_bucket_rellena(qp, monkeypatch):
+    monkeypatch.setitem(qp.config, "modo_rate_limit", "token_bucket")
+    monkeypatch.setitem(qp.config, "max_peticiones_por_minuto", 60)
+    monkeypatch.setitem(qp.config, "umbral_bloqueo_automatico", 1000)
+    lim, P, L = qp.LimitadorTasa(), qp.LimitadorTasa.PERMITIR, qp.LimitadorTasa.LIMITAR
+    assert _veredictos(lim, "ip", [0.0] * 61) == [P] * 60 + [L]
+    # una ficha por segundo
+    assert _veredictos(lim, "ip", [0.5, 1.5, 1.6, 3.0]) == [L, P, L, P]
+    # nunca más de la cubeta llena, por mucho que haya esperado
+    assert _veredictos(lim, "ip", [1000.0] * 61) == [P] * 60 + [L]
+
+
+def test_limitador_strikes_bloquean(qp, monkeypatch):
+    monkeypatch.setitem(qp.config, "modo_rate_limit", "ventana_deslizante")
+    monkeypatch.setitem(qp.config, "max_peticiones_por_minuto", 1)
+    monkeypatch.setitem(qp.config, "umbral_bloqueo_automatico", 3)
+    lim = qp.LimitadorTasa()
+    T = qp.LimitadorTasa
+    assert _veredictos(lim, "ip", [0, 1, 2, 3]) == [T.PERMITIR, T.LIMITAR, T.LIMITAR, T.BLOQUEAR]
+    # por el camino de la app: se bloquea, se olvida en el limitador y se registra
+    ip = "10.83.0.1"
+    try:
+        assert [qp.rate_limit_check(ip) for _ in range(4)] == [True, False, False, False]
+        assert ip in qp.blocked_ips
+        assert ip not in qp.limitador._claves
+    finally:
+        qp.blocked_ips.discard(ip)
+
+
+def test_limitador_olvida_inactivas_y_respeta_el_tope(qp, monkeypatch):
+    monkeypatch.setitem(qp.config, "ip_inactiva_seg", 300)
+    monkeypatch.setitem(qp.config, "max_ips_rastreadas", 3)
+    lim = qp.LimitadorTasa()
+    lim.verificar("a", ahora=0)
+    lim.verificar("b", ahora=100)
+    lim.verificar("c", ahora=350)
+    assert list(lim._claves) == ["b", "c"]  # "a" lleva más de 300 s inactiva
+    lim.verificar("d", ahora=360)
+    lim.verificar("b", ahora=361)  # usada hace poco: pasa al final
+    lim.verificar("e", ahora=362)
+    assert list(lim._claves) == ["d", "b", "e"]  # se expulsa la usada hace más tiempo
+    for i in range(50):
+        lim.verificar(f"x{i}", ahora=400)
+    assert len(lim) == 3